@@ -0,0 +1,5 @@
+'''
+Benchmark of FastSLAM on deterministic scenarios with ground truth.
+
+Run from main/: python -m benchmark.run --help
+'''
@@ -0,0 +1,107 @@
+'''
+Replay a log of fastSLAM.run_log through FastSlam.run as fast as possible, without pygame nor the robot.
+
+Report:
+    ms_per_step: mean time of FastSlam.run
+    total_s: time of the whole replay
+    trajectory_rmse, final_error, orientation_error: error of the mean pose, on the steps with a ground truth
+    trajectory: with --trajectory, the mean pose (x, y, orientation) after each step
+
+Two replays of the same log with the same seed give the same trajectory (with one worker),
+compare their outputs to check a change of the filter against a recorded run.
+
+Record a log with ManualSimulation(log=...) / BaseController(log=...),
+or from a scenario of the benchmark with --record.
+
+Usage (from main/):
+    python -m benchmark.replay --record run.log --plan 0 --steps 40
+    python -m benchmark.replay run.log --particles 50 --output replay.json
+'''
+
+import argparse, json, math, time
+import numpy as np
+from fastSLAM.run_log import LogReader, LogWriter
+from fastSLAM.slam_helper import pi_2_pi
+from fastSLAM.profiler import profiler
+from .run import VARIANTS, get_commit
+
+
+def replay(filename, particle_size, seed=0, n_workers=1, slam_class=VARIANTS['points'], size_bounds=None, trajectory=False):
+    '''Run slam_class on the steps of the log, return the metrics'''
+    log = LogReader(filename)
+    steps = log.steps()
+
+    fastslam = slam_class(*log.start, particle_size=particle_size, n_workers=n_workers, seed=seed, size_bounds=size_bounds)
+    poses = []
+    start = time.perf_counter()
+    for step in steps:
+        fastslam.run(step.mov, step.obs)
+        poses.append((*fastslam.get_mean_pos(), fastslam.get_mean_orien()))
+    total = time.perf_counter() - start
+    fastslam.collect_profile()
+    fastslam.close()
+
+    result = {
+        'steps': len(steps),
+        'ms_per_step': 1000 * total / max(len(steps), 1),
+        'total_s': total,
+    }
+    truths = [(pose, step.truth) for pose, step in zip(poses, steps) if step.truth is not None]
+    if truths:
+        errors = [math.hypot(pose[0] - truth[0], pose[1] - truth[1]) for pose, truth in truths]
+        result['trajectory_rmse'] = float(np.sqrt(np.mean(np.square(errors))))
+        result['final_error'] = float(errors[-1])
+        result['orientation_error'] = float(np.mean([abs(pi_2_pi(pose[2] - truth[2])) for pose, truth in truths]))
+    if trajectory:
+        result['trajectory'] = [[float(v) for v in pose] for pose in poses]
+    if profiler.enabled:
+        result['profile'] = profiler.to_dict()
+        profiler.reset()
+    return result
+
+def record(filename, plan_idx, n_steps, n_rays, seed=0):
+    '''Write the steps of a scenario of the benchmark in a log, with the ground truth'''
+    from planGenerator import Generator
+    from specifications import Specifications as Spec
+    from .scenario import Scenario
+
+    plans = Generator(Spec.WINDOW).load_plans()
+    scenario = Scenario(plans[plan_idx], n_steps, n_rays, seed=seed)
+    with LogWriter(filename, scenario.start) as log:
+        for i, (mov, obs, pose) in enumerate(scenario):
+            # timestamps of a step per second
+            log.write(mov, obs, truth=pose, timestamp=float(i))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a log of FastSlam')
+    parser.add_argument('log', help='log file (see fastSLAM.run_log)')
+    parser.add_argument('--particles', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='number of processes of FastSlam')
+    parser.add_argument('--variant', choices=list(VARIANTS), default='points', help='landmarks of FastSlam')
+    parser.add_argument('--size-bounds', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        help='adaptive number of particles (KLD-sampling), --particles is the initial one')
+    parser.add_argument('--profile', action='store_true', help='add the profile of the phases to the results')
+    parser.add_argument('--trajectory', action='store_true', help='add the mean pose of each step to the results')
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--record', action='store_true', help='write a scenario of the benchmark in the log instead')
+    parser.add_argument('--plan', type=int, default=0, help='with --record, index of the plan of data/room.pickle')
+    parser.add_argument('--steps', type=int, default=40, help='with --record')
+    parser.add_argument('--rays', type=int, default=20, help='with --record, number of rays of the sensor')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.log, args.plan, args.steps, args.rays, args.seed)
+        print(f'{args.steps} steps written in {args.log}')
+    else:
+        if args.profile:
+            profiler.enable()
+
+        result = replay(args.log, args.particles, args.seed, args.workers, VARIANTS[args.variant], args.size_bounds, args.trajectory)
+        print(', '.join(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}'
+                        for key, value in result.items() if key not in ('profile', 'trajectory')))
+
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump({'commit': get_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': vars(args), 'result': result}, file, indent=2)
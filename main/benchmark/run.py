@@ -0,0 +1,157 @@
+'''
+Run FastSlam on a grid of particle counts and landmark densities (number of sensor rays).
+
+For each run, report:
+    ms_per_step: mean time of FastSlam.run
+    peak_memory_mb: peak of the memory allocated in the main process (tracemalloc, separate run)
+    trajectory_rmse: RMS distance between the mean position of the particles and the true position
+    orientation_error: mean absolute error of the mean orientation (radian)
+    map_error: mean distance of the landmarks of the best particle to the walls of the plan
+    n_mean_landmarks: size of the weighted mean map (FastSlam.get_mean_landmarks, the summaries of each variant)
+    mean_particles: mean number of particles (changes with --size-bounds)
+    profile: with --profile, the phases of FastSlam.run (see fastSLAM.profiler),
+             the counts include the observations dropped by the preprocessing and the pairs out of the association gate
+
+The results are written in a JSON file, compare two of them with --compare.
+
+Usage (from main/): python -m benchmark.run --particles 20 50 100 --rays 10 20 40 --output bench.json
+'''
+
+import argparse, json, math, subprocess, time, tracemalloc
+import numpy as np
+from planGenerator import Generator
+from fastSLAM.fast_slam import FastSlam
+from fastSLAM.line_slam import LineFastSlam
+from fastSLAM.grid_slam import GridFastSlam
+from fastSLAM.slam_helper import pi_2_pi
+from fastSLAM.preprocessing import ObservationFilter
+from fastSLAM.particle2 import Particle2
+from fastSLAM.profiler import profiler
+from specifications import Specifications as Spec
+from .scenario import Scenario, distances_to_walls
+
+VARIANTS = {'points': FastSlam, 'lines': LineFastSlam, 'grid': GridFastSlam}
+
+
+def run_scenario(scenario, particle_size, seed=0, n_workers=1, track_memory=False, slam_class=FastSlam, size_bounds=None,
+                 voxel_size=ObservationFilter.VOXEL_SIZE):
+    '''Run FastSlam (or slam_class, see VARIANTS) on the scenario, return the metrics'''
+    if track_memory:
+        tracemalloc.start()
+
+    fastslam = slam_class(*scenario.start, particle_size=particle_size, n_workers=n_workers, seed=seed, size_bounds=size_bounds,
+                          obs_filter=ObservationFilter(voxel_size))
+    times = []
+    errors = []
+    orien_errors = []
+    sizes = []
+    for mov, obs, pose in scenario:
+        start = time.perf_counter()
+        fastslam.run(mov, obs)
+        times.append(time.perf_counter() - start)
+
+        x, y = fastslam.get_mean_pos()
+        errors.append(math.hypot(x - pose[0], y - pose[1]))
+        orien_errors.append(abs(pi_2_pi(fastslam.get_mean_orien() - pose[2])))
+        sizes.append(fastslam.particle_size)
+
+    best = int(np.argmax(fastslam.particle_set.log_weights))
+    landmarks = fastslam.get_landmarks_dps(best)
+    mean_landmarks = fastslam.get_mean_landmarks()
+    fastslam.collect_profile()
+    fastslam.close()
+
+    result = {
+        'ms_per_step': 1000 * float(np.mean(times)),
+        'trajectory_rmse': float(np.sqrt(np.mean(np.square(errors)))),
+        'final_error': float(errors[-1]),
+        'orientation_error': float(np.mean(orien_errors)),
+        'map_error': float(np.mean(distances_to_walls(landmarks, scenario.walls))) if landmarks else None,
+        'n_landmarks': len(landmarks),
+        'n_mean_landmarks': len(mean_landmarks),
+        'mean_particles': float(np.mean(sizes)),
+    }
+    if profiler.enabled:
+        result['profile'] = profiler.to_dict()
+        profiler.reset()
+    if track_memory:
+        result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+def run_grid(plan_indexes, particle_sizes, ray_counts, n_steps, seed=0, n_workers=1, memory=True, slam_class=FastSlam, size_bounds=None,
+             voxel_size=ObservationFilter.VOXEL_SIZE):
+    '''Run all the combinations, return the list of the results'''
+    plans = Generator(Spec.WINDOW).load_plans()
+    results = []
+    for plan_idx in plan_indexes:
+        for n_rays in ray_counts:
+            scenario = Scenario(plans[plan_idx], n_steps, n_rays, seed=seed)
+            for particle_size in particle_sizes:
+                result = {'plan': plan_idx, 'rays': n_rays, 'particles': particle_size, 'steps': n_steps}
+                result.update(run_scenario(scenario, particle_size, seed, n_workers, False, slam_class, size_bounds, voxel_size))
+                if memory:
+                    # measured apart, tracemalloc slows down the run
+                    result['peak_memory_mb'] = run_scenario(scenario, particle_size, seed, n_workers, True, slam_class, size_bounds, voxel_size)['peak_memory_mb']
+                print(', '.join(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}'
+                                for key, value in result.items() if key != 'profile'))
+                results.append(result)
+    return results
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def compare(old_filename, results):
+    '''Print the relative change of the metrics of the runs found in both'''
+    with open(old_filename) as file:
+        old = json.load(file)
+    key = lambda r: (r['plan'], r['rays'], r['particles'], r['steps'])
+    old_results = {key(r): r for r in old['results']}
+    print(f"Compared to {old_filename} (commit: {old['commit']}):")
+    for result in results:
+        if key(result) not in old_results:
+            continue
+        old_result = old_results[key(result)]
+        changes = []
+        for metric in ('ms_per_step', 'peak_memory_mb', 'trajectory_rmse', 'map_error'):
+            if result.get(metric) is not None and old_result.get(metric):
+                changes.append(f'{metric}: {100 * (result[metric] / old_result[metric] - 1):+.1f}%')
+        print(f'  plan {key(result)[0]}, rays {key(result)[1]}, particles {key(result)[2]}: ' + ', '.join(changes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of FastSlam')
+    parser.add_argument('--plans', type=int, nargs='+', default=[0, 1], help='indexes of the plans of data/room.pickle')
+    parser.add_argument('--particles', type=int, nargs='+', default=[20, 50, 100])
+    parser.add_argument('--rays', type=int, nargs='+', default=[10, 20, 40], help='number of rays of the sensor')
+    parser.add_argument('--steps', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='number of processes of FastSlam')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    parser.add_argument('--variant', choices=list(VARIANTS), default='points', help='landmarks of FastSlam')
+    parser.add_argument('--size-bounds', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        help='adaptive number of particles (KLD-sampling), --particles is the initial one')
+    parser.add_argument('--voxel-size', type=float, default=ObservationFilter.VOXEL_SIZE,
+                        help='size of the voxels of the downsampling of the observations (pixel), 0: no downsampling')
+    parser.add_argument('--gate', type=float, default=Particle2.ASSOCIATION_GATE,
+                        help='gate of the data association (squared Mahalanobis distance), 0: no gate')
+    parser.add_argument('--profile', action='store_true', help='add the profile of the phases to the results')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.enable()
+    Particle2.ASSOCIATION_GATE = args.gate or None
+
+    results = run_grid(args.plans, args.particles, args.rays, args.steps, args.seed, args.workers, not args.no_memory,
+                       VARIANTS[args.variant], args.size_bounds, args.voxel_size)
+
+    with open(args.output, 'w') as file:
+        json.dump({'commit': get_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': vars(args), 'results': results}, file, indent=2)
+
+    if args.compare:
+        compare(args.compare, results)
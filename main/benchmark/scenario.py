@@ -0,0 +1,96 @@
+'''
+Deterministic scenarios of the benchmark: a plan of planGenerator and a scripted path of the robot in it.
+The observations are the collisions of the sensor with the plan (BaseSimulation.collision), as in the simulation.
+'''
+
+import math
+import numpy as np
+from geometry import middle
+from simulation import BaseSimulation
+from fastSLAM.slam_helper import euclidean_distance, sense_direction
+from specifications import Specifications as Spec
+
+
+def distances_to_walls(points, walls):
+    '''
+    Distance of each point to the closest wall
+    points: (P,2), walls: (W,2,2) segments, return (P,)
+    '''
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    start, end = walls[:,0], walls[:,1]
+    direction = end - start
+    # projection of the points on the segments, clipped to the ends
+    t = np.sum((points[:,None] - start) * direction, axis=-1) / np.sum(direction**2, axis=-1)
+    closest = start + np.clip(t, 0, 1)[...,None] * direction
+    return np.min(np.hypot(*(points[:,None] - closest).transpose(2,0,1)), axis=1)
+
+def is_inside(plan, pos):
+    '''Even-odd rule: if pos is inside the polygon plan'''
+    inside = False
+    for (x1, y1), (x2, y2) in zip(plan, plan[1:] + plan[:1]):
+        if (y1 > pos[1]) != (y2 > pos[1]):
+            if pos[0] < x1 + (pos[1] - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+class Scenario:
+    '''
+    Recorded run of the robot: ground truth poses, movements and observations of each step.  
+    The robot goes forward of STEP_DISTANCE at each step, turns of TURN every TURN_PERIOD steps
+    and turns of 90° until it isn't heading into a wall.  
+    The angles are whole degrees as FastSlam.run truncates the movements to degrees.
+
+    Arguments:
+        plan: corners of the room, see planGenerator
+        n_steps: length of the path
+        n_rays: number of rays of the sensor, the density of the observed landmarks
+        seed: seed of the measure noise
+    '''
+    STEP_DISTANCE = 30
+    TURN = 10 # degree
+    TURN_PERIOD = 3
+    WALL_MARGIN = 80
+
+    def __init__(self, plan, n_steps, n_rays=20, seed=0):
+        self.plan = plan
+        self.n_rays = n_rays
+        simulation = BaseSimulation(with_robot=False, plan=plan, with_fastslam=False)
+        simulation.angles = list(np.linspace(Spec.SENSOR_ANGLES[0], Spec.SENSOR_ANGLES[1], n_rays))
+        self.walls = simulation.walls
+
+        # noise of the collisions
+        simulation.rng = np.random.default_rng(seed)
+
+        pos = middle(plan)
+        orien = 0 # degree
+        self.start = (pos[0], pos[1], 0.0)
+        self.poses = [] # true pose after each step
+        self.movs = []
+        self.obs = []
+        for step in range(n_steps):
+            turn = self.TURN if step % self.TURN_PERIOD == 0 else 0
+            for _ in range(4):
+                if self.is_free(pos, math.radians(orien + turn)):
+                    break
+                turn += 90
+            orien = (orien + turn) % 360
+            angle = math.radians(orien)
+            pos = (pos[0] + self.STEP_DISTANCE * math.cos(angle), pos[1] + self.STEP_DISTANCE * math.sin(angle))
+
+            collisions = simulation.collision(position=pos, orientation=angle)
+            self.poses.append((pos[0], pos[1], angle))
+            self.movs.append((self.STEP_DISTANCE, math.radians(turn)))
+            self.obs.append([(euclidean_distance(pos, col), sense_direction(pos, col, 0.0)) for col in collisions])
+
+    def is_free(self, pos, angle):
+        '''If the robot can move forward in direction angle'''
+        target = (pos[0] + self.STEP_DISTANCE * math.cos(angle), pos[1] + self.STEP_DISTANCE * math.sin(angle))
+        return is_inside(self.plan, target) and distances_to_walls(target, self.walls)[0] > self.WALL_MARGIN
+
+    def __len__(self):
+        return len(self.movs)
+
+    def __iter__(self):
+        '''yield the movement, observations and true pose of each step'''
+        return zip(self.movs, self.obs, self.poses)
@@ -1,4 +1,7 @@
 from fastSLAM.fast_slam import FastSlam
+from fastSLAM.localization import MonteCarloLocalization
+from fastSLAM.run_log import LogWriter
+from fastSLAM.service import FastSlamService
 from interface import Interface
 import paho.mqtt.client as mqtt
 from time import sleep
@@ -41,14 +44,19 @@ class Connection:
 
 
 class BaseController:
-    
+    '''
+    plan: if the room is known, the robot is only localized in it (see MonteCarloLocalization) instead of running FastSLAM  
+    log: file where the inputs of fastslam are recorded (see fastSLAM.run_log), None: no record  
+    asynchronous: if fastslam runs in a background thread (see FastSlamService),
+    the robot is placed at the newest estimation by update_robot()
+    '''
     connected = False
     order_pending = False
     robot_error = False
     mov = None
     obs = None
 
-    def __init__(self, robot=None):
+    def __init__(self, robot=None, plan=None, log=None, asynchronous=False):
         self.conn = Connection()
 
         if robot:
@@ -56,7 +64,18 @@ class BaseController:
         else:
             self.robot = Interface.robot
         
-        self.fastslam = FastSlam(self.robot.x, self.robot.y, self.robot.orien)
+        if plan:
+            self.fastslam = MonteCarloLocalization.from_plan(self.robot.x, self.robot.y, self.robot.orien, plan)
+        else:
+            self.fastslam = FastSlam(self.robot.x, self.robot.y, self.robot.orien)
+
+        self.log = None
+        if log:
+            self.log = LogWriter(log, (self.robot.x, self.robot.y, self.robot.orien))
+
+        self.service = None
+        if asynchronous:
+            self.service = FastSlamService(self.fastslam)
 
     @property
     def has_new_msg(self):
@@ -71,13 +90,40 @@ class BaseController:
         if self.mov == None or self.obs == None:
             return
 
-        self.fastslam.run(self.mov, self.obs)
+        if self.service:
+            self.service.submit(self.mov, self.obs)
+        else:
+            self.fastslam.run(self.mov, self.obs)
+        if self.log:
+            # the true pose of the robot is unknown
+            self.log.write(self.mov, self.obs)
 
         # reset variables in case of error/incorrect order
         self.mov, self.obs = None, None
 
-        self.robot.set_pos(self.fastslam.get_mean_pos(), center=True, scale=True)
-        self.robot.set_orien(self.fastslam.get_mean_orien())
+        if not self.service:
+            self.update_robot()
+
+    def update_robot(self):
+        '''Place the robot at the estimation of fastslam, the newest snapshot if asynchronous (doesn't block)'''
+        if self.service:
+            snapshot = self.service.snapshot()
+            pos, orien = snapshot.pos, snapshot.orien
+        else:
+            pos, orien = self.fastslam.get_mean_pos(), self.fastslam.get_mean_orien()
+
+        self.robot.set_pos(pos, center=True, scale=True)
+        self.robot.set_orien(orien)
+
+    def get_particles_dps(self):
+        if self.service:
+            return self.service.snapshot().particles
+        return self.fastslam.get_particles_dps()
+
+    def get_landmarks_dps(self):
+        if self.service:
+            return self.service.snapshot().landmarks[0]
+        return self.fastslam.get_landmarks_dps()
 
     def decrypt_robot_state(self, msg):
         '''
@@ -0,0 +1,98 @@
+'''
+Batched kernels of the data association of FastSLAM2.0.
+
+All the observations are associated with all the candidate landmarks of a particle at once,
+the quantities are computed as (obs x landmarks) tensors instead of one (obs, landmark) pair at a time.
+
+Shapes: M observations, L landmarks
+'''
+
+import numpy as np
+from .small_linalg import inv2, inv3, multi_normal, sample_multi_normal
+
+
+def compute_jacobians(pose, mus, sigs, obs_noise):
+    '''
+    Batched version of Particle2.compute_jacobians
+
+    Arguments:
+        pose (3,): x, y, orientation of the particle
+        mus (L,2): positions of the landmarks
+        sigs (L,2,2): covariances of the landmarks
+        obs_noise (2,2)
+
+    Return predicted_obs (L,2), feature_jacobian (L,2,2), pose_jacobian (L,2,3), adj_cov (L,2,2)
+    '''
+    dx = mus[:,0] - pose[0]
+    dy = mus[:,1] - pose[1]
+    d2 = dx**2 + dy**2
+    d = np.sqrt(d2)
+
+    predicted_obs = np.stack((d, np.arctan2(dy, dx)), axis=-1)
+
+    feature_jacobian = np.empty((len(mus), 2, 2))
+    feature_jacobian[:,0,0] = dx/d
+    feature_jacobian[:,0,1] = dy/d
+    feature_jacobian[:,1,0] = -dy/d2
+    feature_jacobian[:,1,1] = dx/d2
+
+    pose_jacobian = np.zeros((len(mus), 2, 3))
+    pose_jacobian[:,:,:2] = -feature_jacobian
+    pose_jacobian[:,1,2] = -1
+
+    adj_cov = feature_jacobian @ sigs @ feature_jacobian.transpose(0,2,1) + obs_noise
+    return predicted_obs, feature_jacobian, pose_jacobian, adj_cov
+
+def mahalanobis_gate(obs, predicted_obs, pose_jacobian, adj_cov, control_noise, threshold):
+    '''
+    Cheap gate of the (obs, landmark) pairs, before the sampling of the proposal distributions:
+    squared Mahalanobis distance of the innovation at the current pose, with the uncertainty of the motion.
+
+    Arguments:
+        obs (M,2): observations (distance, angle)
+        predicted_obs (L,2), pose_jacobian (L,2,3), adj_cov (L,2,2): see compute_jacobians
+        control_noise (3,3)
+        threshold: bound of the squared distance (chi-square with 2 degrees of freedom)
+
+    Return (M,L) bool, the pairs under threshold
+    '''
+    inv_cov = inv2(adj_cov + pose_jacobian @ control_noise @ pose_jacobian.transpose(0,2,1))
+    innovation = obs[:,None,:] - predicted_obs[None,:,:] # (M,L,2)
+    return np.einsum('mli,lij,mlj->ml', innovation, inv_cov, innovation) < threshold
+
+def data_association(pose, mus, obs, predicted_obs, pose_jacobian, adj_cov, control_noise, rng):
+    '''
+    Maximum likelihood data association of all the observations with all the landmarks.
+    For each (obs, landmark) pair, sample a pose from the proposal distribution
+    and compute the likelihood of the observation from this pose.
+
+    Arguments:
+        pose (3,): x, y, orientation of the particle
+        mus (L,2): positions of the landmarks
+        obs (M,2): observations (distance, angle)
+        predicted_obs (L,2), pose_jacobian (L,2,3), adj_cov (L,2,2): see compute_jacobians
+        control_noise (3,3)
+        rng: numpy.random.Generator of the particle
+
+    Return probs (M,), idxs (M,): likelihood and index of the most likely landmark of each observation
+    '''
+
+    # proposal distribution of each (obs, landmark) pair
+    inv_adj_cov = inv2(adj_cov)
+    jacobian_t_inv = pose_jacobian.transpose(0,2,1) @ inv_adj_cov # (L,3,2)
+    pose_cov = inv3(jacobian_t_inv @ pose_jacobian + inv3(control_noise)) # (L,3,3)
+    gain = pose_cov @ jacobian_t_inv # (L,3,2)
+    innovation = obs[:,None,:] - predicted_obs[None,:,:] # (M,L,2)
+    pose_mean = pose + np.einsum('lij,mlj->mli', gain, innovation) # (M,L,3)
+
+    # sample the new poses
+    new_poses = sample_multi_normal(rng, pose_mean, pose_cov)
+
+    # likelihood of the observations from the sampled poses
+    dx = mus[None,:,0] - new_poses[:,:,0]
+    dy = mus[None,:,1] - new_poses[:,:,1]
+    sampled_obs = np.stack((np.hypot(dx, dy), np.arctan2(dy, dx)), axis=-1)
+    probs = multi_normal(obs[:,None,:], sampled_obs, adj_cov[None])
+
+    idxs = np.argmax(probs, axis=1)
+    return probs[np.arange(len(obs)), idxs], idxs
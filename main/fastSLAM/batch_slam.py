@@ -0,0 +1,248 @@
+'''
+K independent FastSlam filters advanced together, to evaluate many runs at once (see mlNeatExec.test_simulation).
+
+The filters are the occupancy grid FastSlam of grid_slam: the particles of all the filters are stacked
+in the arrays of one GridParticleSet, the rows k*N to (k+1)*N being the N particles of the filter k.
+A step moves, weights and updates the maps of all the particles with the same NumPy kernels,
+the filters only differ by their normalization and their resampling.
+The observations of the filters are padded to the same number of rays (see pad_observations).
+
+Memory: the grids take K * N * GridParticleSet.SHAPE * 4 bytes (~25 KB per particle).
+'''
+
+import math
+import numpy as np
+from . import kernel
+from .grid_slam import GridParticleSet, GridFastSlam
+from .profiler import profiler
+from .preprocessing import ObservationFilter
+
+
+def pad_observations(obs_list):
+    '''Stack the observations (M_k,2) of the filters in a (K,M,2) array, padded with null distances'''
+    obs_list = [np.asarray(obs, dtype=float).reshape(-1, 2) for obs in obs_list]
+    padded = np.zeros((len(obs_list), max([len(obs) for obs in obs_list] + [0]), 2))
+    for k, obs in enumerate(obs_list):
+        padded[k,:len(obs)] = obs
+    return padded
+
+
+class BatchParticleSet(GridParticleSet):
+    '''
+    Particles of n_filters filters of filter_size particles, starts: (K,3) initial poses of the filters.
+    The weights are normalized per filter, the moves are given per filter.
+    '''
+    def __init__(self, starts, size, spread=.1, seed=None):
+        starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+        self.n_filters = len(starts)
+        self.filter_size = size
+        super(BatchParticleSet, self).__init__(0, 0, 0, self.n_filters * size, spread, seed)
+        self.poses[:,:2] = np.repeat(starts[:,:2], size, axis=0)
+        self.poses[:,2] += np.repeat(starts[:,2], size)
+
+    def per_particle(self, values):
+        '''Repeat the values (K,...) of the filters for each of their particles'''
+        return np.repeat(np.asarray(values, dtype=float), self.filter_size, axis=0)
+
+    def forward(self, d):
+        '''Move the particles of each filter forward of its distance d (K,)'''
+        # kernel.forward takes a single distance (compiled version)
+        d = self.per_particle(d)
+        self.poses[:,0] += d * np.cos(self.poses[:,2])
+        self.poses[:,1] += d * np.sin(self.poses[:,2])
+        if self.motion_noise:
+            self.poses[:,:2] += self.rng.normal(0, self.motion_noise, (self.size, 2))
+
+    def turn_left(self, angle):
+        '''Turn the particles of each filter of its angle (K,) (degree)'''
+        angles = self.per_particle(angle)
+        if self.turning_noise:
+            angles += self.rng.normal(0, self.turning_noise, self.size)
+        kernel.turn(self.poses, angles / 180. * math.pi)
+
+    def update(self, obs):
+        '''Weight and update the maps of the filters with their observations (K,M,2), see pad_observations'''
+        obs = np.asarray(obs, dtype=float).reshape(self.n_filters, -1, 2)
+        if obs.shape[1] == 0 or not np.any(obs[...,0] > 0):
+            return
+        self.update_rays(self.per_particle(obs[...,0]), self.per_particle(obs[...,1]))
+
+    def filter_view(self, values):
+        '''View of the (K*N,...) array as (K,N,...)'''
+        return values.reshape((self.n_filters, self.filter_size) + values.shape[1:])
+
+    def normalize_weights(self):
+        '''Normalize the weights of each filter, uniform weights for the filters where they are all null'''
+        log_weights = self.filter_view(self.log_weights)
+        log_weights[np.isnan(log_weights)] = -np.inf
+        top = np.max(log_weights, axis=1, keepdims=True)
+        finite = np.isfinite(top[:,0])
+        safe_top = np.where(np.isfinite(top), top, 0)
+        log_weights -= safe_top + np.log(np.sum(np.exp(log_weights - safe_top), axis=1, keepdims=True))
+        log_weights[~finite] = -math.log(self.filter_size)
+
+    def effective_sample_size(self):
+        '''(K,) effective sample size of each filter'''
+        return 1.0 / np.sum(self.filter_view(self.weights)**2, axis=1)
+
+    def resampling_indexes(self):
+        '''Low variance resampling of all the filters at once, return the (K*N,) indexes of the drawn particles'''
+        n = self.filter_size
+        wcum = np.cumsum(self.filter_view(self.weights), axis=1)
+        wcum[:,-1] = 1.0
+        # the cumulated weights of the filter k are shifted in [k, k+1]: a single sorted array
+        shifts = np.arange(self.n_filters)[:,None]
+        positions = (np.arange(n) + self.rng.random((self.n_filters, 1))) / n
+        indexes = np.searchsorted((wcum + shifts).ravel(), (positions + shifts).ravel())
+        # guard against rounding errors at the bounds of the filters
+        return np.clip(indexes, np.repeat(shifts[:,0] * n, n), np.repeat(shifts[:,0] * n + n - 1, n))
+
+    def select(self, indexes, filters=None):
+        '''Replace the particles of the filters (K,) bool (default: all) by the ones at the given indexes'''
+        rows = np.ones(self.size, dtype=bool) if filters is None else self.per_particle(filters).astype(bool)
+        self.poses[rows] = self.poses[indexes[rows]]
+        self.grids[rows] = self.grids[indexes[rows]]
+        self.revisions[rows] = self.revisions[indexes[rows]]
+        self.log_weights[rows] = -math.log(self.filter_size)
+
+    def mean_pos(self):
+        '''(K,2) mean position of the particles of each filter'''
+        return np.mean(self.filter_view(self.poses[:,:2]), axis=1)
+
+    def mean_orien(self):
+        '''(K,) mean orientation of the particles of each filter'''
+        return np.mean(self.filter_view(self.poses[:,2]), axis=1)
+
+
+class BatchFastSlam:
+    '''
+    n_filters = len(starts) FastSlam with occupancy grids (see GridFastSlam) of particle_size particles each,
+    starts: (K,3) initial pose (x, y, orientation) of each filter.
+    run() advances all the filters by one step, a filter is resampled when its effective sample size
+    drops below resample_threshold * particle_size.
+    filter(k) gives an object with the interface of FastSlam for the filter k, to be used by a simulation
+    while the batch is run by the caller.
+    obs_filter: ObservationFilter applied to the observations of each filter, True: the default one, None: no preprocessing.
+    '''
+    particle_set_class = BatchParticleSet
+    OCCUPIED = GridFastSlam.OCCUPIED
+
+    def __init__(self, starts, particle_size=20, resample_threshold=GridFastSlam.RESAMPLE_THRESHOLD, seed=None, obs_filter=True):
+        self.particle_set = self.particle_set_class(starts, particle_size, seed=seed)
+        self.resample_threshold = resample_threshold
+        self.obs_filter = ObservationFilter() if obs_filter is True else obs_filter
+
+    @property
+    def n_filters(self):
+        return self.particle_set.n_filters
+
+    @property
+    def particle_size(self):
+        '''number of particles of each filter'''
+        return self.particle_set.filter_size
+
+    def run(self, movs, obs, active=None):
+        '''
+        Main function for localization
+
+        Arguments:
+        movs (K,2): displacement (distance, angle) of the robot of each filter
+        obs (K,M,2) or list of K lists (distance, angle): observations of each filter
+        active (K,) bool: the filters to advance (default: all), the others don't move nor see anything
+        '''
+        movs = np.asarray(movs, dtype=float).reshape(-1, 2)
+        if self.obs_filter:
+            # as FastSlam.run, the padding is out of range
+            with profiler.phase('preprocessing'):
+                obs = [self.obs_filter(filter_obs) for filter_obs in obs]
+        obs = pad_observations(obs)
+        if active is not None:
+            active = np.asarray(active, dtype=bool)
+            movs = np.where(active[:,None], movs, 0)
+            obs[~active] = 0
+
+        with profiler.phase('run'):
+            with profiler.phase('motion'):
+                # as FastSlam.run: turn of an integer number of degrees, then move
+                if active is not None:
+                    frozen = self.particle_set.per_particle(~active).astype(bool)
+                    poses = self.particle_set.poses[frozen]
+                self.particle_set.turn_left(np.trunc(movs[:,1] * 180/math.pi))
+                self.particle_set.forward(movs[:,0])
+                if active is not None:
+                    # no motion noise on the stopped filters
+                    self.particle_set.poses[frozen] = poses
+
+            with profiler.phase('update'):
+                self.particle_set.update(obs)
+
+            with profiler.phase('resampling'):
+                degenerated = self.particle_set.effective_sample_size() < self.resample_threshold * self.particle_size
+                if active is not None:
+                    degenerated &= active
+                if np.any(degenerated):
+                    self.particle_set.select(self.particle_set.resampling_indexes(), degenerated)
+                    profiler.count('resamplings', int(np.sum(degenerated)))
+
+    def get_mean_pos(self):
+        '''(K,2) mean position of each filter'''
+        return self.particle_set.mean_pos()
+
+    def get_mean_orien(self):
+        '''(K,) mean orientation of each filter'''
+        return self.particle_set.mean_orien()
+
+    def occupied(self, k, index=0):
+        '''(X,Y) bool grid of the occupied cells of the particle index of the filter k'''
+        return self.particle_set.grids[k * self.particle_size + index] > self.OCCUPIED
+
+    def get_landmarks_dps(self, k, index=0):
+        x, y = np.nonzero(self.occupied(k, index))
+        centers = (np.stack((x, y), axis=-1) + .5) * self.particle_set.RESOLUTION
+        return [tuple(pos) for pos in centers.tolist()]
+
+    def get_particles_dps(self, k):
+        return [tuple(pos) for pos in self.particle_set.filter_view(self.particle_set.poses)[k,:,:2].tolist()]
+
+    def filter(self, k):
+        return BatchFilter(self, k)
+
+    def collect_profile(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BatchFilter:
+    '''
+    One filter of a BatchFastSlam, with the interface of FastSlam to read its state.
+    run() doesn't advance the filter: it records the inputs of the step, the batch is run with them by
+    BatchFastSlam.run(*batch_inputs(filters)).
+    '''
+    def __init__(self, batch, k):
+        self.batch = batch
+        self.k = k
+        self.mov = (0., 0.)
+        self.obs = np.zeros((0, 2))
+
+    def run(self, mov, obs):
+        self.mov = mov
+        self.obs = obs
+
+    def get_mean_pos(self):
+        return tuple(self.batch.get_mean_pos()[self.k])
+
+    def get_mean_orien(self):
+        return self.batch.get_mean_orien()[self.k]
+
+    def get_landmarks_dps(self, index=0):
+        return self.batch.get_landmarks_dps(self.k, index)
+
+    def get_particles_dps(self):
+        return self.batch.get_particles_dps(self.k)
+
+
+def batch_inputs(filters):
+    '''Inputs (movs, obs) of BatchFastSlam.run recorded by its filters (in the order of the batch)'''
+    return [f.mov for f in filters], pad_observations([f.obs for f in filters])
@@ -0,0 +1,239 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+'''
+Compiled version of the kernel of the particles, see fastSLAM/kernel.py for the NumPy implementation.
+The functions have the same signatures and return the same arrays.
+
+Build: python setup.py build_ext --inplace
+'''
+
+import numpy as np
+from libc.math cimport sqrt, atan2, cos, sin, exp, fmod, isnan, M_PI
+
+
+cdef void _inv2(const double[:, :] a, double[:, ::1] out) noexcept nogil:
+    cdef double det = a[0,0] * a[1,1] - a[0,1] * a[1,0]
+    out[0,0] = a[1,1] / det
+    out[0,1] = -a[0,1] / det
+    out[1,0] = -a[1,0] / det
+    out[1,1] = a[0,0] / det
+
+cdef void _inv3(const double[:, :] a, double[:, ::1] out) noexcept nogil:
+    # adjugate divided by the determinant
+    cdef double det
+    cdef int i, j
+    out[0,0] = a[1,1] * a[2,2] - a[1,2] * a[2,1]
+    out[0,1] = a[0,2] * a[2,1] - a[0,1] * a[2,2]
+    out[0,2] = a[0,1] * a[1,2] - a[0,2] * a[1,1]
+    out[1,0] = a[1,2] * a[2,0] - a[1,0] * a[2,2]
+    out[1,1] = a[0,0] * a[2,2] - a[0,2] * a[2,0]
+    out[1,2] = a[0,2] * a[1,0] - a[0,0] * a[1,2]
+    out[2,0] = a[1,0] * a[2,1] - a[1,1] * a[2,0]
+    out[2,1] = a[0,1] * a[2,0] - a[0,0] * a[2,1]
+    out[2,2] = a[0,0] * a[1,1] - a[0,1] * a[1,0]
+    det = a[0,0] * out[0,0] + a[0,1] * out[1,0] + a[0,2] * out[2,0]
+    for i in range(3):
+        for j in range(3):
+            out[i,j] /= det
+
+cdef void _chol3(double[:, ::1] a, double[:, ::1] out) noexcept nogil:
+    out[0,0] = sqrt(a[0,0])
+    out[1,0] = a[1,0] / out[0,0]
+    out[2,0] = a[2,0] / out[0,0]
+    out[1,1] = sqrt(a[1,1] - out[1,0]**2)
+    out[2,1] = (a[2,1] - out[2,0] * out[1,0]) / out[1,1]
+    out[2,2] = sqrt(a[2,2] - out[2,0]**2 - out[2,1]**2)
+    out[0,1] = out[0,2] = out[1,2] = 0
+
+cdef double _multi_normal2(double x0, double x1, const double[:, :] cov) noexcept nogil:
+    '''Density of a 2D normal distribution of covariance cov at (x0, x1) - mean'''
+    cdef double det = cov[0,0] * cov[1,1] - cov[0,1] * cov[1,0]
+    cdef double mahalanobis = (x0 * (cov[1,1] * x0 - cov[0,1] * x1) + x1 * (cov[0,0] * x1 - cov[1,0] * x0)) / det
+    return exp(-0.5 * mahalanobis) / sqrt((2 * M_PI)**2 * det)
+
+cdef void _jacobians(double px, double py, double mx, double my, const double[:, :] sig, const double[:, :] obs_noise,
+                     double[::1] predicted_obs, double[:, ::1] feature_jacobian, double[:, ::1] pose_jacobian,
+                     double[:, ::1] adj_cov) noexcept nogil:
+    cdef double dx = mx - px
+    cdef double dy = my - py
+    cdef double d2 = dx * dx + dy * dy
+    cdef double d = sqrt(d2)
+    cdef double fs[2][2]
+    cdef int i, j
+
+    predicted_obs[0] = d
+    predicted_obs[1] = atan2(dy, dx)
+
+    feature_jacobian[0,0] = dx / d
+    feature_jacobian[0,1] = dy / d
+    feature_jacobian[1,0] = -dy / d2
+    feature_jacobian[1,1] = dx / d2
+
+    for i in range(2):
+        pose_jacobian[i,0] = -feature_jacobian[i,0]
+        pose_jacobian[i,1] = -feature_jacobian[i,1]
+    pose_jacobian[0,2] = 0
+    pose_jacobian[1,2] = -1
+
+    # feature_jacobian @ sig @ feature_jacobian.T + obs_noise
+    for i in range(2):
+        for j in range(2):
+            fs[i][j] = feature_jacobian[i,0] * sig[0,j] + feature_jacobian[i,1] * sig[1,j]
+    for i in range(2):
+        for j in range(2):
+            adj_cov[i,j] = fs[i][0] * feature_jacobian[j,0] + fs[i][1] * feature_jacobian[j,1] + obs_noise[i,j]
+
+
+def forward(double[:, :] poses, double d):
+    '''Move the poses (N,3) forward of distance d, in place'''
+    cdef Py_ssize_t i
+    for i in range(poses.shape[0]):
+        poses[i,0] += d * cos(poses[i,2])
+        poses[i,1] += d * sin(poses[i,2])
+
+def turn(double[:, :] poses, const double[:] angles):
+    '''Turn the poses (N,3) of angles (N,) (radian), in place'''
+    cdef Py_ssize_t i
+    cdef double orientation
+    for i in range(poses.shape[0]):
+        # same sign as the divisor, as python's modulo
+        orientation = fmod(poses[i,2] + angles[i], 2 * M_PI)
+        if orientation < 0:
+            orientation += 2 * M_PI
+        poses[i,2] = orientation
+
+def compute_jacobians(const double[:] pose, const double[:, :] mus, const double[:, :, :] sigs, const double[:, :] obs_noise):
+    '''See kernel.compute_jacobians'''
+    cdef Py_ssize_t l, n = mus.shape[0]
+    predicted_obs = np.empty((n, 2))
+    feature_jacobian = np.empty((n, 2, 2))
+    pose_jacobian = np.empty((n, 2, 3))
+    adj_cov = np.empty((n, 2, 2))
+    cdef double[:, ::1] pred_v = predicted_obs
+    cdef double[:, :, ::1] feat_v = feature_jacobian
+    cdef double[:, :, ::1] pose_v = pose_jacobian
+    cdef double[:, :, ::1] adj_v = adj_cov
+
+    for l in range(n):
+        _jacobians(pose[0], pose[1], mus[l,0], mus[l,1], sigs[l], obs_noise, pred_v[l], feat_v[l], pose_v[l], adj_v[l])
+    return predicted_obs, feature_jacobian, pose_jacobian, adj_cov
+
+def data_association(const double[:] pose, const double[:, :] mus, const double[:, :] obs, const double[:, :] predicted_obs,
+                     const double[:, :, :] pose_jacobian, const double[:, :, :] adj_cov, const double[:, :] control_noise, rng):
+    '''See kernel.data_association'''
+    cdef Py_ssize_t m, l, i, j, n_obs = obs.shape[0], n_lms = mus.shape[0]
+    if n_lms == 0:
+        raise ValueError('no landmark to associate the observations with')
+    # same random draws as the NumPy implementation
+    cdef double[:, :, ::1] noise = rng.standard_normal((n_obs, n_lms, 3))
+    probs_all = np.empty((n_obs, n_lms))
+    cdef double[:, ::1] probs = probs_all
+
+    cdef double[:, ::1] inv_adj_cov = np.empty((2, 2))
+    cdef double[:, ::1] inv_control_noise = np.empty((3, 3))
+    cdef double[:, ::1] information = np.empty((3, 3))
+    cdef double[:, ::1] pose_cov = np.empty((3, 3))
+    cdef double[:, ::1] chol = np.empty((3, 3))
+    cdef double jacobian_t_inv[3][2]
+    cdef double gain[3][2]
+    cdef double mean[3]
+    cdef double new_pose[3]
+    cdef double innovation0, innovation1, dx, dy
+
+    _inv3(control_noise, inv_control_noise)
+
+    for l in range(n_lms):
+        # proposal distribution of the landmark
+        _inv2(adj_cov[l], inv_adj_cov)
+        for i in range(3):
+            for j in range(2):
+                jacobian_t_inv[i][j] = pose_jacobian[l,0,i] * inv_adj_cov[0,j] + pose_jacobian[l,1,i] * inv_adj_cov[1,j]
+        for i in range(3):
+            for j in range(3):
+                information[i,j] = jacobian_t_inv[i][0] * pose_jacobian[l,0,j] + jacobian_t_inv[i][1] * pose_jacobian[l,1,j] + inv_control_noise[i,j]
+        _inv3(information, pose_cov)
+        for i in range(3):
+            for j in range(2):
+                gain[i][j] = pose_cov[i,0] * jacobian_t_inv[0][j] + pose_cov[i,1] * jacobian_t_inv[1][j] + pose_cov[i,2] * jacobian_t_inv[2][j]
+        _chol3(pose_cov, chol)
+
+        for m in range(n_obs):
+            # sample a pose and compute the likelihood of the observation from it
+            innovation0 = obs[m,0] - predicted_obs[l,0]
+            innovation1 = obs[m,1] - predicted_obs[l,1]
+            for i in range(3):
+                mean[i] = pose[i] + gain[i][0] * innovation0 + gain[i][1] * innovation1
+            for i in range(3):
+                new_pose[i] = mean[i] + chol[i,0] * noise[m,l,0] + chol[i,1] * noise[m,l,1] + chol[i,2] * noise[m,l,2]
+            dx = mus[l,0] - new_pose[0]
+            dy = mus[l,1] - new_pose[1]
+            probs[m,l] = _multi_normal2(obs[m,0] - sqrt(dx * dx + dy * dy), obs[m,1] - atan2(dy, dx), adj_cov[l])
+
+    # most likely landmark of each observation, the first one on ties and nan as np.argmax
+    idxs_all = np.zeros(n_obs, dtype=np.int64)
+    best_probs = np.empty(n_obs)
+    cdef long long[::1] idxs = idxs_all
+    cdef double[::1] best = best_probs
+    for m in range(n_obs):
+        best[m] = probs[m,0]
+        for l in range(1, n_lms):
+            if isnan(best[m]):
+                break
+            if isnan(probs[m,l]) or probs[m,l] > best[m]:
+                best[m] = probs[m,l]
+                idxs[m] = l
+    return best_probs, idxs_all
+
+def pose_proposal(const double[:] pose, const double[:, :] pose_jacobian, const double[:, :] adj_cov,
+                  const double[:] innovation, const double[:, :] inv_control_noise):
+    '''See kernel.pose_proposal'''
+    cdef Py_ssize_t i, j
+    cdef double[:, ::1] inv_adj_cov = np.empty((2, 2))
+    cdef double[:, ::1] information = np.empty((3, 3))
+    cdef double jacobian_t_inv[3][2]
+    pose_cov = np.empty((3, 3))
+    pose_mean = np.empty(3)
+    cdef double[:, ::1] cov_v = pose_cov
+    cdef double[::1] mean_v = pose_mean
+
+    _inv2(adj_cov, inv_adj_cov)
+    for i in range(3):
+        for j in range(2):
+            jacobian_t_inv[i][j] = pose_jacobian[0,i] * inv_adj_cov[0,j] + pose_jacobian[1,i] * inv_adj_cov[1,j]
+    for i in range(3):
+        for j in range(3):
+            information[i,j] = jacobian_t_inv[i][0] * pose_jacobian[0,j] + jacobian_t_inv[i][1] * pose_jacobian[1,j] + inv_control_noise[i,j]
+    _inv3(information, cov_v)
+    for i in range(3):
+        mean_v[i] = pose[i]
+        for j in range(3):
+            mean_v[i] += cov_v[i,j] * (jacobian_t_inv[j][0] * innovation[0] + jacobian_t_inv[j][1] * innovation[1])
+    return pose_mean, pose_cov
+
+def landmark_update(const double[:] mu, const double[:, :] sig, const double[:, :] feature_jacobian,
+                    const double[:, :] adj_cov, const double[:] innovation):
+    '''See kernel.landmark_update'''
+    cdef Py_ssize_t i, j
+    cdef double[:, ::1] inv_adj_cov = np.empty((2, 2))
+    cdef double sig_jacobian_t[2][2]
+    cdef double K[2][2]
+    new_mu = np.empty(2)
+    new_sig = np.empty((2, 2))
+    cdef double[::1] mu_v = new_mu
+    cdef double[:, ::1] sig_v = new_sig
+
+    _inv2(adj_cov, inv_adj_cov)
+    # K = sig @ feature_jacobian.T @ inv(adj_cov)
+    for i in range(2):
+        for j in range(2):
+            sig_jacobian_t[i][j] = sig[i,0] * feature_jacobian[j,0] + sig[i,1] * feature_jacobian[j,1]
+    for i in range(2):
+        for j in range(2):
+            K[i][j] = sig_jacobian_t[i][0] * inv_adj_cov[0,j] + sig_jacobian_t[i][1] * inv_adj_cov[1,j]
+    for i in range(2):
+        mu_v[i] = mu[i] + K[i][0] * innovation[0] + K[i][1] * innovation[1]
+    # (I - K @ feature_jacobian) @ sig
+    for i in range(2):
+        for j in range(2):
+            sig_v[i,j] = sig[i,j] - (K[i][0] * feature_jacobian[0,0] + K[i][1] * feature_jacobian[1,0]) * sig[0,j] \
+                                  - (K[i][0] * feature_jacobian[0,1] + K[i][1] * feature_jacobian[1,1]) * sig[1,j]
+    return new_mu, new_sig
@@ -0,0 +1,13 @@
+'''
+Build the compiled kernel of the particles (requires cython and a C compiler):
+    python setup.py build_ext --inplace
+fastSLAM.kernel uses it once built, the NumPy implementation otherwise.
+'''
+
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+setup(
+    name='fastslam-kernel',
+    ext_modules=cythonize([Extension('kernel', ['kernel.pyx'])]),
+)
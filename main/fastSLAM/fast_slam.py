@@ -4,37 +4,83 @@ FastSlam object is inspired by https://github.com/nwang57/FastSLAM/blob/master/f
 Methods annoted with a 1 are copy of the original object.
 '''
 
-import random, math, os
+import math, os
 import numpy as np
-from multiprocessing import Process, Queue
-from copy import deepcopy
-from .slam_helper import resampling, timer
 from .particle2 import Particle2
+from .particle_set import ParticleSet
+from .particle_pool import ParticlePool
+from .profiler import profiler
+from .preprocessing import ObservationFilter
+from .map_summary import MapSummary
+from . import map_file
 
 
 class FastSlam:
-    """Main class that implements the FastSLAM2.0 algorithm"""
-    def __init__(self, x, y, orien, particle_size = 50):
-        self.particles = [Particle2(x, y, orien + .1*(random.random()-.5)) for i in range(particle_size)]
+    """
+    Main class that implements the FastSLAM2.0 algorithm  
+    The particles are updated in a pool of n_workers processes (default: number of cpus),
+    or serially if there are less than POOL_MIN_PARTICLES particles.  
+    Call close() to stop the workers.  
+    Every MAINTENANCE_PERIOD steps, the maps of the particles are cleaned (see Particle2.maintain_landmarks):
+    the landmarks closer than MERGE_THRESHOLD (squared Mahalanobis distance) are merged,
+    the ones not re-observed PRUNE_AGE steps after their creation are dropped,
+    at most max_landmarks landmarks are kept per particle.  
+    The particles are resampled when their effective sample size drops below resample_threshold * particle_size.  
+    seed: seed of the random streams of the particles (see ParticleSet), None for a random one.  
+    warm_start: file of maps stored by store_landmarks, the particles start with the best of these maps instead of empty ones.  
+    size_bounds (min, max): adapt the number of particles at each resampling with KLD-sampling (see ParticleSet),
+    None: particle_size particles during the whole run.  
+    obs_filter: ObservationFilter applied to the observations of each step, True: the default one, None: no preprocessing.
+    """
+    POOL_MIN_PARTICLES = 200
+    MAINTENANCE_PERIOD = 5
+    MERGE_THRESHOLD = 4.0
+    PRUNE_AGE = 10
+    MAX_LANDMARKS = 500
+    RESAMPLE_THRESHOLD = 0.5
+    particle_set_class = ParticleSet
+    summary_class = MapSummary
+    # records of the maps in the file of store_landmarks, see map_file
+    map_dtype = map_file.DTYPE
+    map_file_class = map_file.MapFile
+
+    def __init__(self, x, y, orien, particle_size = 50, n_workers=None, max_landmarks=MAX_LANDMARKS,
+                 resample_threshold=RESAMPLE_THRESHOLD, seed=None, warm_start=None, size_bounds=None, obs_filter=True):
+        self.particle_set = self.particle_set_class(x, y, orien, particle_size, seed=seed, size_bounds=size_bounds)
+        if warm_start:
+            # before the workers are started, they take the maps of their share
+            self.load_landmarks(warm_start)
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        if n_workers > 1 and particle_size >= self.POOL_MIN_PARTICLES:
+            self.updater = ParticlePool(self.particle_set, min(n_workers, particle_size))
+        else:
+            self.updater = self.particle_set
         self.robot = Particle2(x, y, orien, is_robot=True)
-        self.particle_size = particle_size
-        self.resample_timer = 0
+        self.max_landmarks = max_landmarks
+        self.resample_threshold = resample_threshold
+        self.maintenance_timer = 0
+        # number of processed steps, the summaries are computed once per step
+        self.n_steps = 0
+        self.summary = self.summary_class(self)
+        self.obs_filter = ObservationFilter() if obs_filter is True else obs_filter
+
+    @property
+    def particles(self):
+        return self.particle_set.particles
+
+    @property
+    def particle_size(self):
+        '''current number of particles'''
+        return self.particle_set.size
+
+    @property
+    def gated_pairs(self):
+        '''number of (obs, landmark) pairs removed by the association gate since the start, see obs_filter.removed for the observations'''
+        return self.particle_set.gated
 
     def update_p(self, obs):
-        # implement multiprocessing to speed up the particles update
-        processes = []
-        for p in self.particles:
-            try:
-                q = Queue()
-                pro = Process(target=p.update, args=[obs, q])
-                processes.append((pro, q))
-                pro.start()
-            except:
-                print('warning: particle on landmark.')
-                return
-        for [pro, q], i in zip(processes, range(self.particle_size)):
-            pro.join()
-            self.particles[i] = q.get()[0]
+        self.updater.update(obs)
 
     def run(self, mov, obs):
         '''
@@ -44,109 +90,97 @@ class FastSlam:
         mov (distance, angle): displacement of the robot  
         obs list (distance, angle): Observation of landmark(s)  
         '''
-        # move particles
-        
-        # start by turn
-        self.turn_left(int(mov[1] * 180/math.pi))
-        # then move
-        self.move_forward(mov[0])
-            
-        # update particles
-        obs = np.array(obs)
-        self.update_p(obs)
-
-        # resample particles every three execution
-        self.resample_timer += 1
-        if self.resample_timer == 3:
-            self.resample_timer = 0
-            self.particles = resampling(self.particles, self.particle_size)
+        self.n_steps += 1
+        with profiler.phase('run'):
+            # move particles
+            with profiler.phase('motion'):
+                # start by turn
+                self.turn_left(int(mov[1] * 180/math.pi))
+                # then move
+                self.move_forward(mov[0])
+
+            obs = np.array(obs, dtype=float)
+            if self.obs_filter:
+                with profiler.phase('preprocessing'):
+                    obs = self.obs_filter(obs)
+
+            # update particles
+            with profiler.phase('update'):
+                self.update_p(obs)
+
+            # resample particles when the weights are too degenerated
+            with profiler.phase('resampling'):
+                if self.particle_set.effective_sample_size() < self.resample_threshold * self.particle_size:
+                    self.updater.resample()
+                    profiler.count('resamplings')
+
+            # clean the maps
+            self.maintenance_timer += 1
+            if self.maintenance_timer == self.MAINTENANCE_PERIOD:
+                self.maintenance_timer = 0
+                with profiler.phase('maintenance'):
+                    self.updater.maintain_landmarks(self.MERGE_THRESHOLD, self.PRUNE_AGE, self.max_landmarks)
             
+    def collect_profile(self):
+        '''Merge the profiles of the workers in the profiler of the main process'''
+        self.updater.collect_profile()
+
     def get_mean_pos(self):
         '''return the mean position of the particles'''
-        pos_x = [p.pos_x for p in self.particles]
-        pos_y = [p.pos_y for p in self.particles]
-        mean_x = np.mean(pos_x)
-        mean_y = np.mean(pos_y)
-        return mean_x, mean_y
+        return self.particle_set.mean_pos()
     
     def get_mean_orien(self):
         '''return the mean orientation of the particles'''
-        angles = [p.orientation for p in self.particles]
-        mean_angle = np.mean(angles)
-        return mean_angle
+        return self.particle_set.mean_orien()
     
     def get_mean_landmarks(self):
-        
-
-        # get most frequent number of lms
-        numbers_lms = [len(p.landmarks) for p in self.particles]
-        n_lms = max(set(numbers_lms), key=numbers_lms.count)
-        n_particles = numbers_lms.count(n_lms)
-
-        lms = [[0,0] for _ in range(n_lms)]
-
-        for p in self.particles:
-            if len(p.landmarks) != n_lms:
-                continue
-            for i, lm in enumerate(p.landmarks):
-                lms[i][0] += lm.pos()[0]
-                lms[i][1] += lm.pos()[1]
-        
-        for lm in lms:
-            lm[0] /= n_particles
-            lm[1] /= n_particles
-        
-        return lms
+        '''Weighted mean of the landmarks of same index over the particles, list of [x, y] (see MapSummary.mean_map)'''
+        return self.summary.mean_map().tolist()
 
     def move_forward(self, step): # 1 #
         self.robot.forward(step)
-        for p in self.particles:
-            p.forward(step)
+        self.particle_set.forward(step)
 
     def turn_left(self, angle): # 1 #
         self.robot.turn_left(angle)
-        for p in self.particles:
-            p.turn_left(angle)
+        self.particle_set.turn_left(angle)
 
     def turn_right(self, angle): # 1 #
         self.robot.turn_right(angle)
-        for p in self.particles:
-            p.turn_right(angle)
-
-    def resample_particles(self): # 1 #
-        new_particles = []
-        weight = [p.weight for p in self.particles]
-        index = int(random.random() * self.particle_size)
-        beta = 0.0
-        mw = max(weight)
-        for i in range(self.particle_size):
-            beta += random.random() * 2.0 * mw
-            while beta > weight[index]:
-                beta -= weight[index]
-                index = (index + 1) % self.particle_size
-            new_particle = deepcopy(self.particles[index])
-            new_particle.weight = 1
-            new_particles.append(new_particle)
-        return new_particles
+        self.particle_set.turn_right(angle)
 
     def get_landmarks_dps(self, index=0):
-        return [lm.pos() for lm in self.particles[index].landmarks]
+        return self.summary.landmarks_dps(index)
     
     def get_particles_dps(self):
-        return [particle.pos() for particle in self.particles]
+        return self.summary.particles_dps()
 
     def stop(self):
-        print('normal:',len(self.particles[0].landmarks))
-        print('cleaned:',len(self.particles[1].landmarks))
+        print('normal:',len(self.updater.landmarks(0)))
+        print('cleaned:',len(self.updater.landmarks(1)))
+
+    def close(self):
+        '''Stop the workers of the pool, if any'''
+        self.updater.close()
     
-    def store_landmarks(self, n_particle=None):
-        
+    def store_landmarks(self, n_particle=None, filename=map_file.PATH):
+        '''Store the maps of the n_particle particles of highest weight (default: all), by decreasing weight, see map_file'''
         if not n_particle:
             n_particle = self.particle_size
 
-        with open(os.path.join('data','landmarks.csv'), 'w') as file:
-            file.write('x,y\n')
-            for i in range(n_particle):
-                landmarks = self.get_landmarks_dps(i)
-                for lm in landmarks:
-                    file.write(f'{lm[0]},{lm[1]}\n')
\ No newline at end of file
+        order = np.argsort(-self.particle_set.log_weights, kind='stable')[:n_particle]
+        map_file.save_maps([self.updater.landmarks(i) for i in order.tolist()], filename, self.map_dtype)
+
+    def load_landmarks(self, filename=map_file.PATH):
+        '''
+        Give to all the particles the best map stored by store_landmarks (the first one), shared copy-on-write.  
+        The other maps aren't loaded: the divergent maps of the low weight particles would spread the particles
+        while their weights are uniform again.  
+        Must be done before the particles are dispatched in workers.
+        '''
+        maps = self.map_file_class(filename)
+        if len(maps) == 0:
+            return
+        best = maps.landmarks(0)
+        for i, particle in enumerate(self.particle_set.particles):
+            particle.landmarks = best if i == 0 else best.copy()
\ No newline at end of file
@@ -0,0 +1,224 @@
+'''
+FastSLAM with occupancy grids as maps instead of landmarks.
+
+Each particle carries a log-odds occupancy grid of the window, the grids of all the particles
+are stacked in one (N,X,Y) array: the update of the maps and the weighting of the particles
+are computed on all the particles and all the rays at once.
+The cells are a SUBDIVISION of the cells of mlneat.Model's grid (Spec.SCALE_FACTOR pixels),
+indexed [x, y] as well: coverage_grid() pools them into a grid of Spec.GRID_SHAPE.
+
+A step costs the same whatever the number of times the walls were seen:
+each ray updates the cells it crosses (free) and the cell of its end point (occupied), once per step.
+'''
+
+import math
+import numpy as np
+from .particle_set import ParticleSet
+from .fast_slam import FastSlam
+from .map_summary import MapSummary
+from .profiler import profiler
+from . import map_file
+from specifications import Specifications as Spec
+
+
+class GridParticleSet(ParticleSet):
+    '''
+    Particles with an occupancy grid each, there is no Particle2 object: the maps are the rows of grids.
+    The particles are moved with noise (motion_noise, turning_noise) and weighted with the likelihood
+    of the end points of the observations in their map (scan to map), before their map is updated.
+
+    The landmarks of a particle (see map_means) are the centers of the cells of its grid above OCCUPIED.
+
+    Attributes:
+        grids: (N,X,Y) log odds of the occupancy of the cells of each particle
+        revisions: (N,) revision of each grid, changed when the grid is updated and kept by the resampling
+    '''
+    SUBDIVISION = 4
+    RESOLUTION = Spec.SCALE_FACTOR / SUBDIVISION # pixel
+    SHAPE = (Spec.GRID_SHAPE[0] * SUBDIVISION, Spec.GRID_SHAPE[1] * SUBDIVISION)
+    # log odds of an observation of the cell occupied/free, bounds of the log odds
+    L_OCCUPIED = math.log(.7 / .3)
+    L_FREE = math.log(.4 / .6)
+    L_MIN = -4.
+    L_MAX = 4.
+    # log odds of an occupied cell
+    OCCUPIED = 1.0
+    # likelihood of an end point: mixture of the occupancy of the cells around it and a uniform noise
+    Z_HIT = 0.9
+    Z_RANDOM = 0.1
+    # bins of the cells of the grid
+    KLD_BIN_SIZE = (RESOLUTION, RESOLUTION, 5 * math.pi / 180)
+    motion_noise = 2.
+    turning_noise = 1. # unit: degree
+
+    def __init__(self, x, y, orien, size, spread=.1, seed=None, size_bounds=None):
+        super(GridParticleSet, self).__init__(x, y, orien, size, spread, seed, size_bounds)
+        self.grids = np.zeros((size,) + self.SHAPE, dtype=np.float32)
+        self.revisions = np.arange(size)
+        self.n_revisions = size
+
+    def create_particles(self, seeds, start=0):
+        return []
+
+    def cells(self, points):
+        '''Return the flat indexes (...) in a grid of the cells of the points (...,2) and if they are in the window'''
+        cells = np.floor(points / self.RESOLUTION).astype(int)
+        x, y = cells[...,0], cells[...,1]
+        inside = (x >= 0) & (x < self.SHAPE[0]) & (y >= 0) & (y < self.SHAPE[1])
+        return np.where(inside, x * self.SHAPE[1] + y, 0), inside
+
+    def update(self, obs):
+        '''Weight the particles with their maps then integrate the observations (M,2) in the maps'''
+        obs = np.asarray(obs, dtype=float).reshape(-1, 2)
+        obs = obs[obs[:,0] > 0]
+        if len(obs) == 0:
+            return
+        self.update_rays(obs[None,:,0], obs[None,:,1])
+
+    def update_rays(self, distances, angles):
+        '''
+        Update with the rays (distance, angle) of each particle: (N,M) arrays, or (1,M) if all the particles
+        have the same observations, the rays of null distance are ignored
+        '''
+        valid = distances > 0
+        directions = np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+        ends = self.poses[:,None,:2] + distances[...,None] * directions # (N,M,2)
+
+        with profiler.phase('scan likelihood'):
+            self.log_weights += self.log_likelihood(ends, valid)
+
+        with profiler.phase('grid update'):
+            self.integrate(distances, directions, ends, valid)
+        self.renew_revisions(np.broadcast_to(np.any(valid, axis=1), (self.size,)))
+
+    def renew_revisions(self, rows):
+        '''New revisions for the grids of the rows (N,) bool'''
+        n = int(np.sum(rows))
+        self.revisions[rows] = self.n_revisions + np.arange(n)
+        self.n_revisions += n
+
+    def log_likelihood(self, ends, valid):
+        '''(N,) log likelihood of the end points (N,M,2) of each particle in its map'''
+        flat_grids = self.grids.reshape(self.size, -1)
+        rows = np.arange(self.size)[:,None]
+        # the most occupied cell of the 3x3 neighbourhood: tolerance of a cell to the noise of the measures
+        occupancy = np.zeros(ends.shape[:2])
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cells, inside = self.cells(ends + self.RESOLUTION * np.array([dx, dy]))
+                log_odds = np.where(inside, flat_grids[rows, cells], -np.inf)
+                occupancy = np.maximum(occupancy, 1 / (1 + np.exp(-log_odds)))
+        return np.sum(np.where(valid, np.log(self.Z_HIT * occupancy + self.Z_RANDOM), 0), axis=1)
+
+    def integrate(self, distances, directions, ends, valid):
+        '''Log odds update of the cells crossed by the rays and of the cells of the end points'''
+        flat_grids = self.grids.reshape(-1)
+        offsets = np.arange(self.size)[:,None] * (self.SHAPE[0] * self.SHAPE[1])
+
+        # samples every half cell along the rays, until the cell before the end point
+        steps = np.arange(0, np.max(distances), self.RESOLUTION / 2)
+        before_end = steps < distances[...,None] - self.RESOLUTION # (N,M,S)
+        rows, rays, samples = np.nonzero(np.broadcast_to(before_end, (self.size,) + before_end.shape[1:]))
+        if len(directions) == 1:
+            points = self.poses[rows,:2] + steps[samples,None] * directions[0,rays]
+        else:
+            points = self.poses[rows,:2] + steps[samples,None] * directions[rows,rays]
+        cells, inside = self.cells(points)
+        free = (cells + offsets[rows,0])[inside]
+
+        cells, inside = self.cells(ends)
+        occupied = (cells + offsets)[inside & valid]
+
+        # each cell is updated once per step, whatever the number of rays crossing it:
+        # the values are computed before the assignments, the duplicated indexes write the same value
+        occupied_odds = np.minimum(flat_grids[occupied] + self.L_OCCUPIED, self.L_MAX)
+        flat_grids[free] = np.maximum(flat_grids[free] + self.L_FREE, self.L_MIN)
+        flat_grids[occupied] = occupied_odds
+
+    def select(self, indexes):
+        self.select_poses(indexes)
+        self.grids = self.grids[indexes]
+        self.revisions = self.revisions[indexes]
+
+    def maintain_landmarks(self, *args):
+        '''The grids don't need any maintenance'''
+        pass
+
+    def landmarks(self, index):
+        '''(X,Y) log odds grid of the particle'''
+        return self.grids[index]
+
+    def occupied_centers(self, grid):
+        '''(L,2) centers of the cells of the (X,Y) log odds grid above OCCUPIED'''
+        x, y = np.nonzero(grid > self.OCCUPIED)
+        return (np.stack((x, y), axis=-1) + .5) * self.RESOLUTION
+
+    def map_means(self, indexes, known):
+        '''See particle_set.map_means, the means are the centers of the occupied cells'''
+        known = set(known)
+        result = []
+        for index in indexes:
+            revision = int(self.revisions[index])
+            if revision in known:
+                result.append((revision, None))
+            else:
+                known.add(revision)
+                result.append((revision, self.occupied_centers(self.grids[index])))
+        return result
+
+
+class GridSummary(MapSummary):
+    '''MapSummary of the grids, the landmarks are the centers of the occupied cells (see GridParticleSet.map_means)'''
+    def compute_mean_map(self):
+        '''Centers of the occupied cells of the weighted mean of the occupancy probabilities of the grids'''
+        particle_set = self.fastslam.particle_set
+        probabilities = np.tensordot(particle_set.weights, 1 / (1 + np.exp(-particle_set.grids)), axes=1)
+        return particle_set.occupied_centers(np.log(probabilities / (1 - probabilities)))
+
+
+class GridFastSlam(FastSlam):
+    '''
+    FastSlam with occupancy grids, same interface as FastSlam.
+    The grids are updated on all the particles at once, there is no pool of workers (n_workers is ignored).
+    get_landmarks_dps() returns the centers of the occupied cells (log odds above OCCUPIED),
+    get_mean_landmarks() the ones of the weighted mean of the grids (see GridSummary).
+    The grids are stored by store_landmarks in map_file.GRID_PATH.
+    '''
+    particle_set_class = GridParticleSet
+    summary_class = GridSummary
+    OCCUPIED = GridParticleSet.OCCUPIED
+
+    def __init__(self, x, y, orien, particle_size=50, n_workers=None, resample_threshold=FastSlam.RESAMPLE_THRESHOLD,
+                 seed=None, warm_start=None, size_bounds=None, obs_filter=True):
+        super(GridFastSlam, self).__init__(x, y, orien, particle_size, n_workers=1, resample_threshold=resample_threshold,
+                                           seed=seed, warm_start=warm_start, size_bounds=size_bounds, obs_filter=obs_filter)
+
+    def occupied(self, index=0):
+        '''(X,Y) bool grid of the occupied cells of the particle'''
+        return self.updater.landmarks(index) > self.OCCUPIED
+
+    def coverage_grid(self, index=0):
+        '''
+        Number of occupied cells of the particle in each cell of mlneat.Model's grid:
+        (Spec.GRID_SHAPE) int16 array, indexed [x, y] as Model.grid
+        '''
+        n = GridParticleSet.SUBDIVISION
+        occupied = self.occupied(index).reshape(Spec.GRID_SHAPE[0], n, Spec.GRID_SHAPE[1], n)
+        return np.sum(occupied, axis=(1, 3)).astype('int16')
+
+    def store_landmarks(self, n_particle=None, filename=map_file.GRID_PATH):
+        '''Store the grids of the n_particle particles of highest weight (default: all) by decreasing weight, (N,X,Y) .npy'''
+        if not n_particle:
+            n_particle = self.particle_size
+
+        order = np.argsort(-self.particle_set.log_weights, kind='stable')[:n_particle]
+        np.save(filename, self.particle_set.grids[order])
+
+    def load_landmarks(self, filename=map_file.GRID_PATH):
+        '''Give to all the particles the best grid stored by store_landmarks (the first one)'''
+        grids = np.load(filename, mmap_mode='r')
+        if len(grids) == 0:
+            return
+        if grids.shape[1:] != GridParticleSet.SHAPE:
+            raise ValueError(f'grids of shape {grids.shape[1:]} in {filename}, expected {GridParticleSet.SHAPE}')
+        self.particle_set.grids[:] = grids[0]
@@ -0,0 +1,64 @@
+'''
+Kernel of the particles: motion model, data association and EKF updates.
+
+The functions below are the NumPy implementation, cython_files/kernel.pyx is a compiled version of them.
+When the extension is built (see cython_files/setup.py), it replaces the NumPy functions at import,
+COMPILED tells which implementation is used.
+
+tests/test_kernel.py checks the NumPy implementation and the parity of the two implementations.
+'''
+
+import numpy as np
+from .small_linalg import inv2, inv3
+from .association import compute_jacobians, data_association
+
+
+def forward(poses, d):
+    '''Move the poses (N,3) forward of distance d, in place'''
+    poses[:,0] += d * np.cos(poses[:,2])
+    poses[:,1] += d * np.sin(poses[:,2])
+
+def turn(poses, angles):
+    '''Turn the poses (N,3) of angles (N,) (radian), in place'''
+    poses[:,2] = (poses[:,2] + angles) % (2 * np.pi)
+
+def pose_proposal(pose, pose_jacobian, adj_cov, innovation, inv_control_noise):
+    '''
+    EKF update of the pose with one observation, the proposal distribution of FastSLAM2.0
+
+    Arguments:
+        pose (3,), pose_jacobian (2,3), adj_cov (2,2), innovation (2,), inv_control_noise (3,3)
+
+    Return the mean (3,) and covariance (3,3) of the proposal distribution
+    '''
+    jacobian_t_inv = pose_jacobian.T @ inv2(adj_cov)
+    pose_cov = inv3(jacobian_t_inv @ pose_jacobian + inv_control_noise)
+    return pose + pose_cov @ jacobian_t_inv @ innovation, pose_cov
+
+def landmark_update(mu, sig, feature_jacobian, adj_cov, innovation):
+    '''
+    EKF update of a landmark
+
+    Arguments:
+        mu (2,), sig (2,2), feature_jacobian (2,2), adj_cov (2,2), innovation (2,)
+
+    Return the new mean (2,) and covariance (2,2)
+    '''
+    K = sig @ feature_jacobian.T @ inv2(adj_cov)
+    return mu + K @ innovation, (np.eye(2) - K @ feature_jacobian) @ sig
+
+
+NUMPY_KERNEL = {
+    'forward': forward,
+    'turn': turn,
+    'compute_jacobians': compute_jacobians,
+    'data_association': data_association,
+    'pose_proposal': pose_proposal,
+    'landmark_update': landmark_update,
+}
+
+try:
+    from .cython_files.kernel import forward, turn, compute_jacobians, data_association, pose_proposal, landmark_update
+    COMPILED = True
+except ImportError:
+    COMPILED = False
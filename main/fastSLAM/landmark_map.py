@@ -0,0 +1,381 @@
+'''
+Copy-on-write landmark map, inspired by the balanced tree of the log(N) FastSLAM
+(Montemerlo et al., FastSLAM: A Factored Solution to the Simultaneous Localization and Mapping Problem).
+
+The landmarks are packed in blocks of BLOCK_SIZE landmarks: contiguous arrays of the means (B,2),
+covariances (B,2,2), numbers of observations (B,) and creation steps (B,).
+The blocks are the leaves of a complete binary tree indexed by the block index.
+The nodes and the blocks are shared between the maps and reference counted:
+copying a map is O(1), it only shares the root. Before a modification, the shared nodes
+on the path to the modified block are copied, as well as the block, which costs O(log L).
+A new block is only allocated every BLOCK_SIZE landmarks.
+
+The maps are also indexed by a uniform grid hash of the landmark positions (cells of CELL_SIZE),
+used to select the landmarks in the cone of the sensor without scanning all of them.
+The grid is shared copy-on-write as well: the dict of cells is copied on the first modification
+after a copy of the map, the list of a cell when it is modified for the first time afterwards.
+
+Each modification gives the map a new revision, unique across the processes: the copies of a map
+have the same revision until they are modified, a summary of the maps (see map_summary) only
+needs to read again the maps whose revision changed.
+'''
+
+import math, os, itertools
+import numpy as np
+from specifications import Specifications as Spec
+from .slam_helper import pi_2_pi
+
+
+class _Node:
+    __slots__ = ('children', 'refs')
+
+    def __init__(self, children):
+        self.children = children
+        # number of parents/maps referencing the node
+        self.refs = 1
+
+    def copy(self):
+        for child in self.children:
+            if child is not None:
+                child.refs += 1
+        return _Node(self.children.copy())
+
+
+class _Block:
+    __slots__ = ('mus', 'sigs', 'hits', 'created', 'refs')
+
+    def __init__(self, size):
+        self.mus = np.zeros((size, 2))
+        self.sigs = np.zeros((size, 2, 2))
+        self.hits = np.zeros(size, dtype=int)
+        self.created = np.zeros(size, dtype=int)
+        self.refs = 1
+
+    def copy(self):
+        block = _Block.__new__(_Block)
+        block.mus, block.sigs = self.mus.copy(), self.sigs.copy()
+        block.hits, block.created = self.hits.copy(), self.created.copy()
+        block.refs = 1
+        return block
+
+
+class _Grid:
+    __slots__ = ('cells', 'owned', 'refs')
+
+    def __init__(self, cells):
+        # cell -> list of landmark indexes
+        self.cells = cells
+        # the cells whose list isn't shared with another grid
+        self.owned = set()
+        self.refs = 1
+
+    def copy(self):
+        # the lists of the cells are now shared by both grids
+        self.owned = set()
+        return _Grid(self.cells.copy())
+
+
+_revisions = itertools.count()
+
+def new_revision():
+    '''Revision of a modified map, unique across the processes'''
+    # the workers are forked with the same counter
+    return (os.getpid(), next(_revisions))
+
+def _own(node):
+    '''Return a node referenced only once: the node itself or a copy of it if it is shared'''
+    if node.refs == 1:
+        return node
+    node.refs -= 1
+    return node.copy()
+
+def _release(node):
+    '''Remove a reference to the node, release its children if it isn't referenced anymore'''
+    node.refs -= 1
+    if node.refs == 0 and isinstance(node, _Node):
+        for child in node.children:
+            if child is not None:
+                _release(child)
+
+
+class LandmarkView:
+    '''Thin view on a landmark of a LandmarkMap, has the interface of Landmark'''
+    __slots__ = ('map', 'index')
+
+    def __init__(self, landmark_map, index):
+        self.map = landmark_map
+        self.index = index
+
+    @property
+    def pos_x(self):
+        block, row = self.map._block(self.index)
+        return block.mus[row,0]
+
+    @property
+    def pos_y(self):
+        block, row = self.map._block(self.index)
+        return block.mus[row,1]
+
+    def pos(self):
+        block, row = self.map._block(self.index)
+        x, y = block.mus[row].tolist()
+        return (x, y)
+
+    @property
+    def mu(self):
+        '''column vector (2,1)'''
+        block, row = self.map._block(self.index)
+        return block.mus[row][:,None].copy()
+
+    @property
+    def sig(self):
+        block, row = self.map._block(self.index)
+        return block.sigs[row].copy()
+
+    @property
+    def hits(self):
+        block, row = self.map._block(self.index)
+        return int(block.hits[row])
+
+    @property
+    def created(self):
+        block, row = self.map._block(self.index)
+        return int(block.created[row])
+
+    def __str__(self):
+        return str(self.pos())
+
+
+class LandmarkMap:
+    '''
+    Landmarks of a particle, behave like a list of landmarks (views, see LandmarkView).
+    The landmarks must be modified only through update()/remove(), which copy the shared data
+    and keep the grid up to date.
+    Use copy() to get a map sharing the landmarks, release() when a map isn't used anymore.
+    '''
+    BLOCK_SIZE = 32
+    CELL_SIZE = Spec.SENSOR_SCOPE / 2
+
+    def __init__(self):
+        self.root = _Node([None, None])
+        self.depth = 1
+        self.size = 0
+        self.grid = _Grid({})
+        self.revision = new_revision()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError('landmark index out of range')
+        return LandmarkView(self, index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield LandmarkView(self, index)
+
+    def blocks(self):
+        '''Return the blocks in the index order'''
+        blocks = []
+        stack = [(self.root, self.depth)]
+        n_blocks = -(-self.size // self.BLOCK_SIZE)
+        while stack and len(blocks) < n_blocks:
+            node, depth = stack.pop()
+            if depth == 0:
+                blocks.append(node)
+            else:
+                for child in node.children[::-1]:
+                    if child is not None:
+                        stack.append((child, depth-1))
+        return blocks
+
+    def _packed(self, attribute):
+        blocks = self.blocks()
+        if len(blocks) == 0:
+            return getattr(_Block(0), attribute)
+        return np.concatenate([getattr(block, attribute) for block in blocks])[:self.size]
+
+    def means(self):
+        '''(L,2) array of the positions of the landmarks'''
+        return self._packed('mus')
+
+    def covariances(self):
+        '''(L,2,2) array of the covariances of the landmarks'''
+        return self._packed('sigs')
+
+    def hits(self):
+        '''(L,) array of the numbers of observations of the landmarks'''
+        return self._packed('hits')
+
+    def created(self):
+        '''(L,) array of the creation steps of the landmarks'''
+        return self._packed('created')
+
+    def gather(self, indexes):
+        '''Return the means (n,2) and covariances (n,2,2) of the landmarks at the given indexes'''
+        indexes = np.asarray(indexes, dtype=int)
+        mus = np.empty((len(indexes), 2))
+        sigs = np.empty((len(indexes), 2, 2))
+        blocks_idx, rows = np.divmod(indexes, self.BLOCK_SIZE)
+        for block_idx in np.unique(blocks_idx).tolist():
+            block = self._leaf(block_idx)
+            selected = blocks_idx == block_idx
+            mus[selected] = block.mus[rows[selected]]
+            sigs[selected] = block.sigs[rows[selected]]
+        return mus, sigs
+
+    def copy(self):
+        '''Return a map sharing all the landmarks of this one'''
+        new = LandmarkMap.__new__(LandmarkMap)
+        new.root, new.depth, new.size, new.grid = self.root, self.depth, self.size, self.grid
+        new.revision = self.revision
+        self.root.refs += 1
+        self.grid.refs += 1
+        return new
+
+    def release(self):
+        '''Release the nodes of the map, the map mustn't be used afterwards'''
+        _release(self.root)
+        self.grid.refs -= 1
+        self.root = None
+        self.grid = None
+
+    def _leaf(self, block_idx):
+        node = self.root
+        for level in range(self.depth-1, -1, -1):
+            node = node.children[(block_idx >> level) & 1]
+        return node
+
+    def _block(self, index):
+        '''Return the block containing the landmark and the landmark's row in it'''
+        block_idx, row = divmod(index, self.BLOCK_SIZE)
+        return self._leaf(block_idx), row
+
+    def _path(self, block_idx):
+        '''Copy the shared nodes on the path to the leaf, return the parent of the leaf and the leaf's slot'''
+        self.root = _own(self.root)
+        node = self.root
+        for level in range(self.depth-1, 0, -1):
+            bit = (block_idx >> level) & 1
+            child = node.children[bit]
+            child = _Node([None, None]) if child is None else _own(child)
+            node.children[bit] = child
+            node = child
+        return node, block_idx & 1
+
+    def _mutable_block(self, index):
+        '''Return the block containing the landmark, copied if it is shared, and the landmark's row in it'''
+        block_idx, row = divmod(index, self.BLOCK_SIZE)
+        node, bit = self._path(block_idx)
+        node.children[bit] = _own(node.children[bit])
+        return node.children[bit], row
+
+    def append(self, mu, sig, created=0, hits=1):
+        '''Add a landmark of mean mu (2,) and covariance sig (2,2)'''
+        self.revision = new_revision()
+        block_idx, row = divmod(self.size, self.BLOCK_SIZE)
+        if row == 0:
+            # new block
+            if block_idx == 1 << self.depth:
+                # full: add a level on top of the tree
+                self.root = _Node([self.root, None])
+                self.depth += 1
+            node, bit = self._path(block_idx)
+            node.children[bit] = _Block(self.BLOCK_SIZE)
+        block, row = self._mutable_block(self.size)
+        block.mus[row] = np.ravel(mu)
+        block.sigs[row] = sig
+        block.hits[row] = hits
+        block.created[row] = created
+        self._cell_list(self._cell(block.mus[row])).append(self.size)
+        self.size += 1
+
+    def update(self, index, mu, sig, hits=1):
+        '''Update the EKF of the landmark at the given index, add hits to its number of observations'''
+        if not 0 <= index < self.size:
+            raise IndexError('landmark index out of range')
+        self.revision = new_revision()
+        block, row = self._mutable_block(index)
+        old_cell = self._cell(block.mus[row])
+        block.mus[row] = np.ravel(mu)
+        block.sigs[row] = sig
+        block.hits[row] += hits
+        new_cell = self._cell(block.mus[row])
+        if new_cell != old_cell:
+            self._cell_list(old_cell).remove(index)
+            self._cell_list(new_cell).append(index)
+
+    def remove(self, index):
+        '''Remove the landmark at the given index, the last landmark takes its index'''
+        if not 0 <= index < self.size:
+            raise IndexError('landmark index out of range')
+        self.revision = new_revision()
+        last = self.size - 1
+        block, row = self._block(index)
+        self._cell_list(self._cell(block.mus[row])).remove(index)
+
+        if index != last:
+            last_block, last_row = self._block(last)
+            mu, sig = last_block.mus[last_row].copy(), last_block.sigs[last_row].copy()
+            hits, created = last_block.hits[last_row], last_block.created[last_row]
+            cell_list = self._cell_list(self._cell(mu))
+            cell_list[cell_list.index(last)] = index
+
+            block, row = self._mutable_block(index)
+            block.mus[row], block.sigs[row] = mu, sig
+            block.hits[row], block.created[row] = hits, created
+
+        self.size -= 1
+        if self.size % self.BLOCK_SIZE == 0:
+            # the last block is empty
+            node, bit = self._path(self.size // self.BLOCK_SIZE)
+            _release(node.children[bit])
+            node.children[bit] = None
+
+    def _cell(self, pos):
+        return (math.floor(pos[0] / self.CELL_SIZE), math.floor(pos[1] / self.CELL_SIZE))
+
+    def _cell_list(self, cell):
+        '''Return the list of the cell, owned by the map's grid'''
+        if self.grid.refs > 1:
+            self.grid.refs -= 1
+            self.grid = self.grid.copy()
+        grid = self.grid
+        if cell not in grid.owned:
+            grid.cells[cell] = list(grid.cells.get(cell, ()))
+            grid.owned.add(cell)
+        return grid.cells[cell]
+
+    def query_cone(self, pos, orientation, radius, half_angle):
+        '''
+        Return the indexes of the landmarks in the cone of apex pos, axis orientation,
+        whose distance to pos is smaller than radius and angle to the axis smaller than half_angle.
+        Only the cells overlapping the bounding box of the cone are scanned.
+        '''
+        # bounding box of the cone: apex, both ends of the arc and the extreme points of the circle in the cone
+        xs, ys = [pos[0]], [pos[1]]
+        for angle in (orientation - half_angle, orientation + half_angle):
+            xs.append(pos[0] + radius * math.cos(angle))
+            ys.append(pos[1] + radius * math.sin(angle))
+        for k in range(4):
+            if abs(pi_2_pi(k * math.pi/2 - orientation)) < half_angle:
+                xs.append(pos[0] + radius * round(math.cos(k * math.pi/2)))
+                ys.append(pos[1] + radius * round(math.sin(k * math.pi/2)))
+
+        (x0, y0), (x1, y1) = self._cell((min(xs), min(ys))), self._cell((max(xs), max(ys)))
+        candidates = []
+        cells = self.grid.cells
+        for i in range(x0, x1+1):
+            for j in range(y0, y1+1):
+                candidates.extend(cells.get((i, j), ()))
+        if len(candidates) == 0:
+            return []
+        candidates.sort()
+
+        positions, _ = self.gather(candidates)
+        dx = positions[:,0] - pos[0]
+        dy = positions[:,1] - pos[1]
+        angles = pi_2_pi(np.arctan2(dy, dx) - pi_2_pi(orientation))
+        selected = (np.hypot(dx, dy) < radius) & (np.abs(angles) < half_angle)
+        return [idx for idx, is_selected in zip(candidates, selected) if is_selected]
@@ -0,0 +1,118 @@
+'''
+Extraction of the walls seen in a sweep of observations, the features of the line FastSLAM (see line_slam).
+
+The end points of the observations are taken relative to the robot: distance * (cos(angle), sin(angle)),
+the angles being absolute, they don't depend on the pose of a particle and the extraction is done once per sweep.
+The walls are found with a sequential RANSAC: the line with the most inliers is fitted (total least squares),
+its inliers are split where the gap between two points is too large and removed, until no line has enough inliers.
+RANSAC doesn't need the points ordered along the walls: a sweep can put together several turns of the sensor
+(see MLSimulation.turn_around), each one giving the nearest wall hit by each ray (see BaseSimulation.collision).
+
+A line is in Hessian normal form (r, phi): x*cos(phi) + y*sin(phi) = r, r >= 0.
+'''
+
+import math
+import numpy as np
+
+# standard deviation of the position of an end point (pixel), uniform noise of NOISE_POWER (see BaseSimulation)
+POINT_NOISE = 15.0
+# maximal distance of an inlier to the line (pixel)
+INLIER_THRESHOLD = 35.0
+# maximal gap between two consecutive points of a segment (pixel)
+GAP_THRESHOLD = 100.0
+MIN_POINTS = 4
+MIN_LENGTH = 40.0
+N_TRIALS = 40
+
+
+def end_points(obs):
+    '''obs (M,2): distance, angle, return the (M,2) end points relative to the robot, without the empty observations'''
+    obs = np.asarray(obs, dtype=float).reshape(-1, 2)
+    obs = obs[obs[:,0] > 0]
+    return obs[:,0,None] * np.stack((np.cos(obs[:,1]), np.sin(obs[:,1])), axis=-1)
+
+def normal_form(normal, point):
+    '''Return (r, phi) of the line of normal (2,) passing by point (2,), with r >= 0'''
+    r = float(normal @ point)
+    if r < 0:
+        normal, r = -normal, -r
+    return r, math.atan2(normal[1], normal[0])
+
+def fit_line(points):
+    '''
+    Total least squares fit of the points (P,2)
+
+    Return (r, phi), the (2,2) covariance of (r, phi) and the (2,2) end points of the segment
+    '''
+    centroid = np.mean(points, axis=0)
+    centered = points - centroid
+    eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+    r, phi = normal_form(eigenvectors[:,0], centroid)
+    normal = np.array([math.cos(phi), math.sin(phi)])
+    tangent = np.array([-normal[1], normal[0]])
+
+    # covariance of the fit, each point with an isotropic noise of variance sig2
+    s = centered @ tangent
+    sig2 = max(eigenvalues[0] / len(points), POINT_NOISE**2)
+    var_phi = sig2 / max(float(s @ s), 1e-9)
+    # r = centroid . normal: dr = dcentroid . normal + (centroid . tangent) dphi
+    lever = float(centroid @ tangent)
+    cov = np.array([[sig2 / len(points) + lever**2 * var_phi, lever * var_phi],
+                    [lever * var_phi, var_phi]])
+
+    ends = centroid + np.array([s.min(), s.max()])[:,None] * tangent
+    return (r, phi), cov, ends
+
+def split_gaps(points, tangent):
+    '''Split the points (P,2) of a line where two consecutive points along the tangent are further than GAP_THRESHOLD'''
+    s = points @ tangent
+    order = np.argsort(s)
+    cuts = np.flatnonzero(np.diff(s[order]) > GAP_THRESHOLD) + 1
+    return [points[part] for part in np.split(order, cuts)]
+
+def extract_lines(obs, rng=None):
+    '''
+    Sequential RANSAC on the end points of the observations
+
+    Arguments:
+        obs (M,2): distance, angle of each observation
+        rng: numpy.random.Generator drawing the pairs of points of the hypotheses
+
+    Return lines (K,2): r, phi of each segment, covs (K,2,2), ends (K,2,2): end points relative to the robot
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    points = end_points(obs)
+    lines, covs, ends = [], [], []
+
+    while len(points) >= MIN_POINTS:
+        # hypotheses: lines through pairs of points, all scored at once
+        pairs = rng.integers(0, len(points), (N_TRIALS, 2))
+        pairs = pairs[pairs[:,0] != pairs[:,1]]
+        if len(pairs) == 0:
+            break
+        direction = points[pairs[:,1]] - points[pairs[:,0]]
+        normals = np.stack((-direction[:,1], direction[:,0]), axis=-1)
+        normals /= np.maximum(np.hypot(normals[:,0], normals[:,1]), 1e-9)[:,None]
+        distances = np.abs(np.einsum('tk,pk->tp', normals, points) - np.sum(normals * points[pairs[:,0]], axis=1)[:,None])
+        inliers = distances < INLIER_THRESHOLD
+        best = int(np.argmax(np.sum(inliers, axis=1)))
+        if np.sum(inliers[best]) < MIN_POINTS:
+            break
+
+        # refine the line on its inliers
+        (r, phi), cov, _ = fit_line(points[inliers[best]])
+        normal = np.array([math.cos(phi), math.sin(phi)])
+        inliers = (np.abs(points @ normal - r) < INLIER_THRESHOLD) | inliers[best]
+
+        for segment in split_gaps(points[inliers], np.array([-normal[1], normal[0]])):
+            if len(segment) < MIN_POINTS:
+                continue
+            line, cov, segment_ends = fit_line(segment)
+            if np.hypot(*(segment_ends[1] - segment_ends[0])) >= MIN_LENGTH:
+                lines.append(line)
+                covs.append(cov)
+                ends.append(segment_ends)
+        points = points[~inliers]
+
+    return np.array(lines).reshape(-1, 2), np.array(covs).reshape(-1, 2, 2), np.array(ends).reshape(-1, 2, 2)
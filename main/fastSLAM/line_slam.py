@@ -0,0 +1,375 @@
+'''
+FastSLAM2.0 with walls as landmarks instead of points.
+
+Each sweep of observations is fitted into segments (see line_features), the landmarks of a particle
+are the lines of the walls: an EKF of (rho, theta), x*cos(theta) + y*sin(theta) = rho in the world,
+and the extent of the wall seen so far along the line.
+A room is mapped with a handful of lines per particle instead of thousands of points.
+
+As for the point landmarks (see association.compute_jacobians), the observed angles are taken relative
+to the orientation of the particle: turning the particle of d turns the lines it sees of d.
+'''
+
+import math
+import numpy as np
+from .slam_helper import pi_2_pi
+from .small_linalg import inv2, inv3, log_multi_normal, sample_multi_normal
+from .particle2 import Particle2
+from .particle_set import ParticleSet
+from .fast_slam import FastSlam
+from .landmark_map import new_revision
+from .map_summary import MapSummary
+from .line_features import extract_lines
+from . import kernel, map_file
+from .profiler import profiler
+
+
+def tangents(thetas):
+    '''(...,2) direction of the lines of normal angles thetas'''
+    return np.stack((-np.sin(thetas), np.cos(thetas)), axis=-1)
+
+def rotate(points, angle):
+    '''Rotate the points (...,2) of angle around the origin'''
+    cos, sin = math.cos(angle), math.sin(angle)
+    return np.stack((cos * points[...,0] - sin * points[...,1], sin * points[...,0] + cos * points[...,1]), axis=-1)
+
+def line_jacobians(pose, reference, mus, sigs, lines, covs):
+    '''
+    Innovations and jacobians of observed lines against lines of the map, the arguments are broadcast together
+
+    Arguments:
+        pose (3,): pose of the particle
+        reference: orientation of the particle when the lines were observed
+        mus (...,2), sigs (...,2,2): rho, theta of the lines of the map and their covariances
+        lines (...,2), covs (...,2,2): r, phi of the observed lines (relative to the robot) and their covariances
+
+    Return innovation (...,2), feature_jacobian (...,2,2), pose_jacobian (...,2,3), adj_cov (...,2,2)
+    '''
+    rho, theta = mus[...,0], mus[...,1]
+    cos, sin = np.cos(theta), np.sin(theta)
+    predicted_r = rho - pose[0] * cos - pose[1] * sin
+
+    # the observed line with the normal of the line of the map: the normal of an observed line
+    # points away from the robot, the one of the map away from the origin
+    r, phi = lines[...,0], lines[...,1] + pose[2] - reference
+    flip = np.cos(phi - theta) < 0
+    r = np.where(flip, -r, r)
+    phi = np.where(flip, phi - np.pi, phi)
+    sign = np.where(flip, -1., 1.)
+    covs = covs * np.stack((np.stack((np.ones_like(sign), sign), axis=-1), np.stack((sign, np.ones_like(sign)), axis=-1)), axis=-2)
+
+    shape = np.broadcast_shapes(predicted_r.shape, r.shape)
+    innovation = np.stack((np.broadcast_to(r - predicted_r, shape), np.broadcast_to(pi_2_pi(phi - theta), shape)), axis=-1)
+
+    feature_jacobian = np.zeros(shape + (2, 2))
+    feature_jacobian[...,0,0] = 1
+    feature_jacobian[...,0,1] = pose[0] * sin - pose[1] * cos
+    feature_jacobian[...,1,1] = 1
+
+    pose_jacobian = np.zeros(shape + (2, 3))
+    pose_jacobian[...,0,0] = -cos
+    pose_jacobian[...,0,1] = -sin
+    pose_jacobian[...,1,2] = -1
+
+    adj_cov = feature_jacobian @ sigs @ np.swapaxes(feature_jacobian, -1, -2) + covs
+    return innovation, feature_jacobian, pose_jacobian, adj_cov
+
+
+class LineMap:
+    '''
+    Lines of the walls seen by a particle.
+    There are only a few lines per map: they are stored in plain arrays, copied entirely.
+    The revision changes at each modification, as LandmarkMap.revision.
+
+    Attributes:
+        mus: (L,2) rho, theta of the lines, rho >= 0
+        sigs: (L,2,2) covariances
+        extents: (L,2) interval of the seen wall, coordinates along the tangent (-sin(theta), cos(theta))
+        n_hits: (L,) numbers of observations
+        steps: (L,) creation steps
+    '''
+    def __init__(self):
+        self.mus = np.zeros((0, 2))
+        self.sigs = np.zeros((0, 2, 2))
+        self.extents = np.zeros((0, 2))
+        self.n_hits = np.zeros(0, dtype=int)
+        self.steps = np.zeros(0, dtype=int)
+        self.revision = new_revision()
+
+    def __len__(self):
+        return len(self.mus)
+
+    def copy(self):
+        new = LineMap.__new__(LineMap)
+        new.mus, new.sigs, new.extents = self.mus.copy(), self.sigs.copy(), self.extents.copy()
+        new.n_hits, new.steps = self.n_hits.copy(), self.steps.copy()
+        new.revision = self.revision
+        return new
+
+    def release(self):
+        pass
+
+    def means(self):
+        return self.mus
+
+    def covariances(self):
+        return self.sigs
+
+    def hits(self):
+        return self.n_hits
+
+    def created(self):
+        return self.steps
+
+    @staticmethod
+    def _normalize(mu, sig, extent):
+        '''Keep rho positive: the opposite normal flips the sign of rho, of the covariance of (rho, theta) and the tangent'''
+        if mu[0] < 0:
+            mu = np.array([-mu[0], mu[1] + math.pi])
+            sig = sig * np.array([[1, -1], [-1, 1]])
+            extent = -extent[::-1]
+        mu[1] = pi_2_pi(mu[1])
+        return mu, sig, extent
+
+    def append(self, mu, sig, extent, created=0, hits=1):
+        self.revision = new_revision()
+        mu, sig, extent = self._normalize(np.array(mu, dtype=float), sig, np.asarray(extent, dtype=float))
+        self.mus = np.concatenate((self.mus, mu[None]))
+        self.sigs = np.concatenate((self.sigs, sig[None]))
+        self.extents = np.concatenate((self.extents, extent[None]))
+        self.n_hits = np.append(self.n_hits, hits)
+        self.steps = np.append(self.steps, created)
+
+    def update(self, index, mu, sig, extent, hits=1):
+        '''Set the line, extent: interval along the tangent of the new line'''
+        self.revision = new_revision()
+        self.mus[index], self.sigs[index], self.extents[index] = self._normalize(np.array(mu, dtype=float), sig, extent)
+        self.n_hits[index] += hits
+
+    def remove(self, indexes):
+        self.revision = new_revision()
+        self.mus = np.delete(self.mus, indexes, axis=0)
+        self.sigs = np.delete(self.sigs, indexes, axis=0)
+        self.extents = np.delete(self.extents, indexes, axis=0)
+        self.n_hits = np.delete(self.n_hits, indexes)
+        self.steps = np.delete(self.steps, indexes)
+
+    def segments(self):
+        '''(L,2,2) end points of the seen walls'''
+        normals = np.stack((np.cos(self.mus[:,1]), np.sin(self.mus[:,1])), axis=-1)
+        feet = self.mus[:,0,None] * normals
+        return feet[:,None] + self.extents[...,None] * tangents(self.mus[:,1])[:,None]
+
+
+class LineMapFile(map_file.MapFile):
+    '''Maps of lines stored by save_maps with LINE_DTYPE, see map_file.MapFile'''
+    def landmarks(self, particle, keep_steps=False):
+        '''Return the lines of the particle as a LineMap, see MapFile.landmarks'''
+        start, end = self._bounds(particle)
+        records = self.records[start:end]
+        landmarks = LineMap()
+        created = records['created'] if keep_steps else np.zeros(len(records), dtype=int)
+        for mu, sig, extent, hits, step in zip(records['mu'], records['sig'], records['extent'], records['hits'].tolist(), created.tolist()):
+            landmarks.append(mu, sig, extent, created=step, hits=hits)
+        return landmarks
+
+
+class LineParticle(Particle2):
+    '''
+    Particle of the line FastSLAM, the observations of update() are the segments extracted by line_features.extract_lines.
+    The segments are associated with the nearest line of the map: the (squared) Mahalanobis distance
+    must be under ASSOCIATION_GATE and the segment closer than EXTENT_MARGIN to the seen part of the wall.
+    '''
+    # chi2 quantile, 2 degrees of freedom, 99%
+    ASSOCIATION_GATE = 9.21
+    EXTENT_MARGIN = 80.0
+
+    def __init__(self, *args, **kwargs):
+        super(LineParticle, self).__init__(*args, **kwargs)
+        self.landmarks = LineMap()
+
+    def update(self, obs):
+        '''
+        After the motion, update the weight of the particle and its EKFs based on the sensor data
+        obs: lines (K,2), covs (K,2,2), ends (K,2,2), see line_features.extract_lines
+        '''
+        lines, covs, ends = obs
+        self.step += 1
+        reference = self.pose[2]
+        landmarks_idx = np.full(len(lines), -1)
+        if len(self.landmarks) != 0 and len(lines) != 0:
+            with profiler.phase('association'):
+                landmarks_idx = self.associate(lines, covs, ends)
+        associated = np.flatnonzero(landmarks_idx > -1)
+
+        # the proposal distribution incorporates the associated lines one after the other
+        initial_pose = self.pose.copy()
+        pose_mean = initial_pose
+        pose_cov = self.control_noise
+        with profiler.phase('proposal'):
+            for k in associated.tolist():
+                idx = landmarks_idx[k]
+                innovation, feature_jacobian, pose_jacobian, adj_cov = line_jacobians(pose_mean, reference,
+                    self.landmarks.mus[idx], self.landmarks.sigs[idx], lines[k], covs[k])
+                pose_mean, pose_cov = kernel.pose_proposal(pose_mean, pose_jacobian, adj_cov, innovation, inv3(pose_cov))
+            if len(associated) != 0:
+                self.set_pos(*sample_multi_normal(self.rng, pose_mean, pose_cov))
+
+        with profiler.phase('EKF update'):
+            for k, idx in enumerate(landmarks_idx.tolist()):
+                if idx > -1:
+                    innovation, feature_jacobian, pose_jacobian, adj_cov = line_jacobians(self.pose, reference,
+                        self.landmarks.mus[idx], self.landmarks.sigs[idx], lines[k], covs[k])
+                    self.log_weight += log_multi_normal(innovation, np.zeros(2), adj_cov)
+                    self.update_line(idx, ends[k], reference, feature_jacobian, adj_cov, innovation)
+                else:
+                    self.create_line(lines[k], covs[k], ends[k], reference)
+                    self.log_weight += math.log(self.NEW_LANDMARK_LIKELIHOOD)
+        if profiler.enabled:
+            profiler.count('associated lines', len(associated))
+            profiler.count('new lines', len(lines) - len(associated))
+
+        prior = log_multi_normal(self.pose, initial_pose, self.control_noise)
+        prop = log_multi_normal(self.pose, pose_mean, pose_cov)
+        self.log_weight += prior - prop
+
+    def world_ends(self, ends, reference):
+        '''End points (...,2,2) of segments seen from the robot, in the world'''
+        return self.pose[:2] + rotate(ends, self.pose[2] - reference)
+
+    def associate(self, lines, covs, ends):
+        '''Return the index of the line of the map associated with each observed line (K,), -1 for a new line'''
+        landmarks = self.landmarks
+        innovation, feature_jacobian, pose_jacobian, adj_cov = line_jacobians(self.pose, self.pose[2],
+            landmarks.mus[None], landmarks.sigs[None], lines[:,None], covs[:,None])
+        # the uncertainty of the motion is added, as the pose isn't sampled yet
+        adj_cov = adj_cov + pose_jacobian @ self.control_noise @ np.swapaxes(pose_jacobian, -1, -2)
+        mahalanobis = np.sum((inv2(adj_cov) @ innovation[...,None])[...,0] * innovation, axis=-1) # (K,L)
+
+        # gap between the observed segments and the seen parts of the walls
+        s = np.einsum('kei,li->kle', self.world_ends(ends, self.pose[2]), tangents(landmarks.mus[:,1]))
+        gaps = np.maximum(np.min(s, axis=-1) - landmarks.extents[:,1], landmarks.extents[:,0] - np.max(s, axis=-1))
+
+        mahalanobis[(mahalanobis >= self.ASSOCIATION_GATE) | (gaps >= self.EXTENT_MARGIN)] = np.inf
+        idxs = np.argmin(mahalanobis, axis=1)
+        idxs[np.isinf(mahalanobis[np.arange(len(lines)), idxs])] = -1
+        return idxs
+
+    def update_line(self, idx, ends, reference, feature_jacobian, adj_cov, innovation):
+        mu, sig = kernel.landmark_update(self.landmarks.mus[idx], self.landmarks.sigs[idx], feature_jacobian, adj_cov, innovation)
+        s = self.world_ends(ends, reference) @ tangents(mu[1])
+        extent = self.landmarks.extents[idx]
+        self.landmarks.update(idx, mu, sig, np.array([min(extent[0], s.min()), max(extent[1], s.max())]))
+
+    def create_line(self, line, cov, ends, reference):
+        '''Line of the world from the observed line (r, phi), at the current pose'''
+        x, y, orien = self.pose
+        r, phi = line[0], line[1] + orien - reference
+        jacobian = np.array([[1, -x * math.sin(phi) + y * math.cos(phi)], [0, 1]])
+        mu = np.array([r + x * math.cos(phi) + y * math.sin(phi), phi])
+        s = self.world_ends(ends, reference) @ tangents(phi)
+        self.landmarks.append(mu, jacobian @ cov @ jacobian.T, np.array([s.min(), s.max()]), created=self.step)
+
+    def maintain_landmarks(self, merge_threshold, prune_age, max_landmarks):
+        '''
+        Clean the map of the particle, as Particle2.maintain_landmarks:
+        merge the lines closer than merge_threshold (squared Mahalanobis distance) whose seen parts overlap or nearly,
+        drop the lines that haven't been re-observed prune_age steps after their creation,
+        keep at most max_landmarks lines, the most observed ones.
+        '''
+        landmarks = self.landmarks
+        if len(landmarks) == 0:
+            return
+        removed = set()
+
+        # all the pairs at once, there are only a few lines
+        i, j = np.triu_indices(len(landmarks), 1)
+        diff = landmarks.mus[i] - landmarks.mus[j]
+        diff[:,1] = pi_2_pi(diff[:,1])
+        dists = np.sum((inv2(landmarks.sigs[i] + landmarks.sigs[j]) @ diff[...,None])[...,0] * diff, axis=1)
+        gaps = np.maximum(landmarks.extents[i,0], landmarks.extents[j,0]) - np.minimum(landmarks.extents[i,1], landmarks.extents[j,1])
+        for k in np.argsort(dists).tolist():
+            if dists[k] >= merge_threshold:
+                break
+            a, b = i[k], j[k]
+            if a in removed or b in removed or gaps[k] >= self.EXTENT_MARGIN:
+                continue
+            # product of the two gaussians, b expressed around the angle of a
+            mu_b = landmarks.mus[b].copy()
+            mu_b[1] = landmarks.mus[a,1] - pi_2_pi(landmarks.mus[a,1] - mu_b[1])
+            inv_a, inv_b = inv2(landmarks.sigs[a]), inv2(landmarks.sigs[b])
+            sig = inv2(inv_a + inv_b)
+            mu = sig @ (inv_a @ landmarks.mus[a] + inv_b @ mu_b)
+            extent = np.array([min(landmarks.extents[a,0], landmarks.extents[b,0]), max(landmarks.extents[a,1], landmarks.extents[b,1])])
+            landmarks.update(a, mu, sig, extent, hits=landmarks.n_hits[b])
+            removed.add(b)
+
+        # prune
+        stale = (landmarks.n_hits == 1) & (self.step - landmarks.steps >= prune_age)
+        removed.update(np.flatnonzero(stale).tolist())
+
+        # cap, drop the least observed (the oldest first)
+        n_excess = len(landmarks) - len(removed) - max_landmarks
+        if n_excess > 0:
+            kept = np.array([k for k in range(len(landmarks)) if k not in removed])
+            order = np.lexsort((landmarks.steps[kept], landmarks.n_hits[kept]))
+            removed.update(kept[order[:n_excess]].tolist())
+
+        if removed:
+            landmarks.remove(sorted(removed))
+
+
+class LineParticleSet(ParticleSet):
+    particle_class = LineParticle
+
+
+class LineSummary(MapSummary):
+    '''MapSummary of the lines (rho, theta) of the particles'''
+    def compute_mean_map(self):
+        '''Weighted mean of the lines of same index, the feet of their normals are averaged: the angles wrap around'''
+        self.update_stack()
+        feet = self.stack[...,0,None] * np.stack((np.cos(self.stack[...,1]), np.sin(self.stack[...,1])), axis=-1)
+        mean = self.weighted_mean(feet)
+        return np.stack((np.hypot(mean[:,0], mean[:,1]), np.arctan2(mean[:,1], mean[:,0])), axis=-1)
+
+
+class LineFastSlam(FastSlam):
+    '''
+    FastSLAM2.0 mapping the walls as lines, same interface as FastSlam.
+    The segments of each sweep are extracted once and given to all the particles.
+    get_landmarks_dps() returns points along the seen walls, every DPS_SPACING pixels, get_segments() their end points.
+    The maps are stored by store_landmarks in map_file.LINE_PATH.
+    get_mean_landmarks() and summary give the lines [rho, theta] (see LineSummary).
+    '''
+    particle_set_class = LineParticleSet
+    summary_class = LineSummary
+    map_dtype = map_file.LINE_DTYPE
+    map_file_class = LineMapFile
+    DPS_SPACING = 10
+
+    def __init__(self, x, y, orien, particle_size=50, seed=None, **kwargs):
+        super(LineFastSlam, self).__init__(x, y, orien, particle_size, seed=seed, **kwargs)
+        # random stream of the extraction of the segments
+        self.rng = np.random.default_rng(seed)
+
+    def update_p(self, obs):
+        with profiler.phase('extraction'):
+            lines = extract_lines(obs, self.rng)
+        self.updater.update(lines)
+
+    def get_segments(self, index=0):
+        '''(L,2,2) end points of the walls of the particle'''
+        return self.updater.landmarks(index).segments()
+
+    def get_landmarks_dps(self, index=0):
+        points = []
+        for start, end in self.get_segments(index):
+            n = max(2, int(np.hypot(*(end - start)) / self.DPS_SPACING) + 1)
+            points.extend(map(tuple, (start + np.linspace(0, 1, n)[:,None] * (end - start)).tolist()))
+        return points
+
+    def store_landmarks(self, n_particle=None, filename=map_file.LINE_PATH):
+        super(LineFastSlam, self).store_landmarks(n_particle, filename)
+
+    def load_landmarks(self, filename=map_file.LINE_PATH):
+        super(LineFastSlam, self).load_landmarks(filename)
@@ -0,0 +1,201 @@
+'''
+Localization only (Monte Carlo localization) in a known map.
+
+When the room is known, there is no need to map it: the particles are only poses,
+weighted with a likelihood field of the map (Thrun, Probabilistic Robotics, 6.4).
+The likelihood of an observation is precomputed for each cell of a grid from the distance
+to the closest wall (distance transform), a step is a few vectorized operations on the
+(particles x observations) end points of the observations and one table lookup.
+'''
+
+import math
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+from . import kernel, map_file
+from .slam_helper import log_sum_exp, low_variance_sampling
+from specifications import Specifications as Spec
+
+
+class LikelihoodField:
+    '''
+    Log likelihood of an observation ending in each cell of the window.
+    The likelihood is a mixture of a gaussian of the distance to the closest wall (Z_HIT, SIGMA)
+    and a uniform noise (Z_RANDOM), the end points out of the window get the uniform noise only.
+    Build it with from_plan(), from_points() or from_map_file().
+
+    Arguments:
+        occupied: (H,W) bool array, cells of the walls, of size resolution (pixel)
+    '''
+    RESOLUTION = 4
+    SIGMA = 20
+    Z_HIT = 0.9
+    Z_RANDOM = 0.1
+
+    def __init__(self, occupied, resolution=RESOLUTION):
+        self.resolution = resolution
+        self.shape = occupied.shape
+        # distance of each cell to the closest wall (pixel)
+        self.distances = distance_transform_edt(~occupied) * resolution
+
+        random_density = self.Z_RANDOM / Spec.SENSOR_SCOPE
+        hit_density = self.Z_HIT * np.exp(-0.5 * (self.distances / self.SIGMA)**2) / (math.sqrt(2 * math.pi) * self.SIGMA)
+        self.log_field = np.log(hit_density + random_density)
+        self.log_outside = math.log(random_density)
+
+    @classmethod
+    def from_points(cls, points, resolution=RESOLUTION):
+        '''points (N,2): positions of the walls, e.g. landmarks of FastSlam'''
+        shape = (Spec.WINDOW[1] // resolution, Spec.WINDOW[0] // resolution)
+        occupied = np.zeros(shape, dtype=bool)
+        cells = np.floor(np.asarray(points, dtype=float).reshape(-1, 2) / resolution).astype(int)
+        inside = (cells[:,0] >= 0) & (cells[:,0] < shape[1]) & (cells[:,1] >= 0) & (cells[:,1] < shape[0])
+        occupied[cells[inside,1], cells[inside,0]] = True
+        return cls(occupied, resolution)
+
+    @classmethod
+    def from_plan(cls, plan, resolution=RESOLUTION):
+        '''plan: corners of the room (as Interface.plan)'''
+        points = []
+        for start, end in zip(plan, plan[1:] + plan[:1]):
+            start, end = np.array(start, dtype=float), np.array(end, dtype=float)
+            # sample the wall every half cell
+            n = max(2, int(np.hypot(*(end - start)) / resolution * 2) + 1)
+            points.append(start + np.linspace(0, 1, n)[:,None] * (end - start))
+        return cls.from_points(np.concatenate(points), resolution)
+
+    @classmethod
+    def from_map_file(cls, filename=map_file.PATH, resolution=RESOLUTION):
+        '''Landmarks of all the particles stored by FastSlam.store_landmarks'''
+        return cls.from_points(map_file.MapFile(filename).means(), resolution)
+
+    def log_likelihood(self, points):
+        '''points (...,2): end points of observations, return the log likelihood of each one (...)'''
+        cells = np.floor(points / self.resolution).astype(int)
+        x, y = cells[...,0], cells[...,1]
+        inside = (x >= 0) & (x < self.shape[1]) & (y >= 0) & (y < self.shape[0])
+        log_likelihood = np.full(points.shape[:-1], self.log_outside)
+        log_likelihood[inside] = self.log_field[y[inside], x[inside]]
+        return log_likelihood
+
+
+class MonteCarloLocalization:
+    '''
+    Localization of the robot in a known map, can replace FastSlam when the map is known:
+    same run(mov, obs), get_mean_pos(), get_mean_orien() and get_particles_dps().
+    The observations (distance, angle) are the same as for FastSlam.
+    Motion noise: DISTANCE_NOISE (proportion of the distance), TURNING_NOISE (radian) and POSITION_NOISE (pixel) per step.
+    The particles are resampled when their effective sample size drops below resample_threshold * particle_size.
+
+    Arguments:
+        likelihood_field: LikelihoodField of the map
+        spread (x, y, orientation): standard deviation of the initial poses around (x, y, orien)
+    '''
+    DISTANCE_NOISE = 0.05
+    TURNING_NOISE = 2 * math.pi / 180
+    POSITION_NOISE = 2.0
+    RESAMPLE_THRESHOLD = 0.5
+
+    def __init__(self, x, y, orien, likelihood_field, particle_size=1000, spread=(5., 5., .05),
+                 resample_threshold=RESAMPLE_THRESHOLD, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.likelihood_field = likelihood_field
+        self.particle_size = particle_size
+        self.resample_threshold = resample_threshold
+        self.poses = np.array([x, y, orien], dtype=float) + self.rng.normal(0, spread, (particle_size, 3))
+        self.poses[:,2] %= 2 * math.pi
+        self.log_weights = np.full(particle_size, -math.log(particle_size))
+
+    @classmethod
+    def from_plan(cls, x, y, orien, plan, **kwargs):
+        return cls(x, y, orien, LikelihoodField.from_plan(plan), **kwargs)
+
+    def run(self, mov, obs):
+        '''
+        Arguments:
+        mov (distance, angle): displacement of the robot
+        obs list (distance, angle): Observation of landmark(s)
+        '''
+        self.move(*mov)
+        obs = np.array(obs, dtype=float).reshape(-1, 2)
+        if len(obs) != 0:
+            self.update(obs)
+        if self.effective_sample_size() < self.resample_threshold * self.particle_size:
+            self.resample()
+
+    def move(self, distance, angle):
+        '''Turn of angle then move forward of distance, with noise'''
+        size = self.particle_size
+        kernel.turn(self.poses, angle + self.rng.normal(0, self.TURNING_NOISE, size))
+        distances = distance * (1 + self.rng.normal(0, self.DISTANCE_NOISE, size))
+        self.poses[:,0] += distances * np.cos(self.poses[:,2])
+        self.poses[:,1] += distances * np.sin(self.poses[:,2])
+        self.poses[:,:2] += self.rng.normal(0, self.POSITION_NOISE, (size, 2))
+
+    def update(self, obs):
+        '''Weight the particles with the likelihood of the end points of the observations (M,2)'''
+        # end points of the observations from each particle: (N,M,2)
+        offsets = obs[:,0,None] * np.stack((np.cos(obs[:,1]), np.sin(obs[:,1])), axis=-1)
+        points = self.poses[:,None,:2] + offsets[None]
+        self.log_weights += np.sum(self.likelihood_field.log_likelihood(points), axis=1)
+        self.normalize_weights()
+
+    def normalize_weights(self):
+        total = log_sum_exp(self.log_weights)
+        if np.isfinite(total):
+            self.log_weights -= total
+        else:
+            self.log_weights[:] = -math.log(self.particle_size)
+
+    @property
+    def weights(self):
+        return np.exp(self.log_weights)
+
+    def effective_sample_size(self):
+        return 1.0 / np.sum(self.weights**2)
+
+    def resample(self):
+        indexes = low_variance_sampling(self.weights, self.rng)
+        self.poses = self.poses[indexes]
+        self.log_weights[:] = -math.log(self.particle_size)
+
+    def get_mean_pos(self):
+        '''return the weighted mean position of the particles'''
+        mean_x, mean_y = self.weights @ self.poses[:,:2]
+        return mean_x, mean_y
+
+    def get_mean_orien(self):
+        '''return the weighted circular mean orientation of the particles'''
+        weights = self.weights
+        angle = math.atan2(weights @ np.sin(self.poses[:,2]), weights @ np.cos(self.poses[:,2]))
+        return angle % (2 * math.pi)
+
+    def get_particles_dps(self):
+        return [tuple(pos) for pos in self.poses[:,:2].tolist()]
+
+    def get_landmarks_dps(self, index=0):
+        '''The map is known, no landmark'''
+        return []
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    # timing of a step on a plan of data/room.pickle, run from main/
+    from time import perf_counter
+    from planGenerator import Generator
+    from geometry import middle
+
+    plan = Generator(Spec.WINDOW).load_plans()[0]
+    x, y = middle(plan)
+    start = perf_counter()
+    field = LikelihoodField.from_plan(plan)
+    print(f'likelihood field {field.shape}: {1000 * (perf_counter() - start):.1f}ms')
+    rng = np.random.default_rng(0)
+    obs = np.stack((rng.uniform(50, Spec.SENSOR_SCOPE, 20), rng.uniform(-math.pi, math.pi, 20)), axis=-1)
+    for particle_size in (1000, 5000, 20000):
+        mcl = MonteCarloLocalization(x, y, 0, field, particle_size, seed=0)
+        start = perf_counter()
+        for _ in range(20):
+            mcl.run((10, 0.1), obs)
+        print(f'{particle_size} particles: {1000 * (perf_counter() - start) / 20:.2f}ms/step')
@@ -0,0 +1,86 @@
+'''
+Binary file of the landmark maps of the particles.
+
+The file is a .npy record array with one record per landmark: index of the particle, mean, covariance,
+number of observations and creation step, sorted by particle.
+FastSlam.store_landmarks writes the maps by decreasing weight of their particle: the map 0 is the best one.
+It is opened memory-mapped: opening it doesn't read the landmarks,
+the landmarks of a particle are read when they are requested.
+The maps of lines (see line_slam.LineMap) are stored the same way in LINE_PATH, with the extents of the lines (LINE_DTYPE).
+The occupancy grids of grid_slam are stored in GRID_PATH as a (N,X,Y) .npy array, see GridFastSlam.store_landmarks.
+'''
+
+import os
+import numpy as np
+from .landmark_map import LandmarkMap
+
+PATH = os.path.join('data', 'landmarks.npy')
+LINE_PATH = os.path.join('data', 'lines.npy')
+GRID_PATH = os.path.join('data', 'grids.npy')
+
+DTYPE = np.dtype([
+    ('particle', np.int32),
+    ('mu', np.float64, (2,)),
+    ('sig', np.float64, (2, 2)),
+    ('hits', np.int32),
+    ('created', np.int32),
+])
+LINE_DTYPE = np.dtype(DTYPE.descr + [('extent', np.float64, (2,))])
+
+
+def save_maps(maps, filename=PATH, dtype=DTYPE):
+    '''Store the LandmarkMap of each particle, or the LineMap with LINE_DTYPE'''
+    records = np.empty(sum(len(landmarks) for landmarks in maps), dtype=dtype)
+    start = 0
+    for particle, landmarks in enumerate(maps):
+        end = start + len(landmarks)
+        records['particle'][start:end] = particle
+        records['mu'][start:end] = landmarks.means()
+        records['sig'][start:end] = landmarks.covariances()
+        records['hits'][start:end] = landmarks.hits()
+        records['created'][start:end] = landmarks.created()
+        if 'extent' in dtype.names:
+            records['extent'][start:end] = landmarks.extents
+        start = end
+    np.save(filename, records)
+
+
+class MapFile:
+    '''
+    Maps stored by save_maps, the particles without landmarks at the end of the file aren't counted.
+
+    Attributes:
+        records: memory-mapped record array, see DTYPE
+    '''
+    def __init__(self, filename=PATH):
+        self.records = np.load(filename, mmap_mode='r')
+
+    def __len__(self):
+        '''number of particles'''
+        if len(self.records) == 0:
+            return 0
+        return int(self.records['particle'][-1]) + 1
+
+    def _bounds(self, particle):
+        particles = self.records['particle']
+        return np.searchsorted(particles, particle), np.searchsorted(particles, particle, side='right')
+
+    def means(self, particle=None):
+        '''(L,2) positions of the landmarks of the particle (of all the particles if None)'''
+        if particle is None:
+            return np.array(self.records['mu'])
+        start, end = self._bounds(particle)
+        return np.array(self.records['mu'][start:end])
+
+    def landmarks(self, particle, keep_steps=False):
+        '''
+        Return the landmarks of the particle as a LandmarkMap.
+        The creation steps are reset to 0 unless keep_steps, for a particle starting from this map.
+        '''
+        start, end = self._bounds(particle)
+        records = self.records[start:end]
+        landmarks = LandmarkMap()
+        created = records['created'] if keep_steps else np.zeros(len(records), dtype=int)
+        for mu, sig, hits, step in zip(records['mu'], records['sig'], records['hits'].tolist(), created.tolist()):
+            landmarks.append(mu, sig, created=step, hits=hits)
+        return landmarks
@@ -0,0 +1,104 @@
+'''
+Summaries of the maps and the particles of FastSlam for the display, served from arrays.
+
+The summaries are computed at most once per step of FastSlam: polling them at each frame is free.
+The means of the maps are cached by revision (see LandmarkMap.revision), only the maps modified
+since the last query are read again (and transferred from the workers of the pool).
+The maps of all the particles are kept in a padded (N,L,2) array, the rows are only rewritten when
+the map of the particle changed: the weighted mean map is a masked weighted sum over this array.
+The variants of FastSlam give their own summary (see FastSlam.summary_class): the maps of
+line_slam are lines, the ones of grid_slam are summarized by the centers of their occupied cells.
+'''
+
+import numpy as np
+
+
+class MapSummary:
+    '''
+    Summaries of the state of fastslam:
+        particle_positions(): (N,2) positions of the particles
+        landmarks(index): (L,2) landmarks of the particle
+        best_map(): (L,2) landmarks of the particle of highest weight
+        mean_map(): (L,2) weighted mean of the landmarks of same index over the particles that have them
+    The arrays are views on internal buffers, they must not be modified.
+    The dps versions (lists of tuples, see Interface.add_dps) are cached as well.
+    '''
+    def __init__(self, fastslam):
+        self.fastslam = fastslam
+        self.step = None
+        # revision -> means of the map, the maps used during the last step are kept
+        self.cache = {}
+        self.used = set()
+        # maps of all the particles: means padded to the largest map, size and revision of each row
+        self.stack = np.zeros((0, 0, 2))
+        self.sizes = np.zeros(0, dtype=int)
+        self.revisions = []
+        self.results = {}
+
+    def cached(self, key, compute):
+        '''Result of compute, computed once per step of fastslam'''
+        if self.step != self.fastslam.n_steps:
+            self.step = self.fastslam.n_steps
+            self.results = {}
+            self.cache = {revision: self.cache[revision] for revision in self.used}
+            self.used = set()
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+    def fetch(self, indexes):
+        '''Means of the maps of the particles, only the modified maps are read'''
+        items = self.fastslam.updater.map_means(indexes, set(self.cache))
+        for revision, means in items:
+            if means is not None:
+                self.cache[revision] = means
+            self.used.add(revision)
+        return [(revision, self.cache[revision]) for revision, means in items]
+
+    def particle_positions(self):
+        return self.fastslam.particle_set.poses[:,:2]
+
+    def landmarks(self, index):
+        return self.cached(('landmarks', index), lambda: self.fetch([index])[0][1])
+
+    def best_map(self):
+        return self.landmarks(int(np.argmax(self.fastslam.particle_set.log_weights)))
+
+    def update_stack(self):
+        '''Rewrite the rows of the particles whose map changed since the last update'''
+        maps = self.fetch(range(self.fastslam.particle_size))
+
+        size = max([len(means) for revision, means in maps] + [0])
+        if self.stack.shape[0] != len(maps) or self.stack.shape[1] < size:
+            # reallocate with room for the next landmarks
+            self.stack = np.zeros((len(maps), max(size, 2 * self.stack.shape[1]), 2))
+            self.sizes = np.zeros(len(maps), dtype=int)
+            self.revisions = [None] * len(maps)
+
+        for i, (revision, means) in enumerate(maps):
+            if self.revisions[i] != revision:
+                self.stack[i,:len(means)] = means
+                self.sizes[i] = len(means)
+                self.revisions[i] = revision
+
+    def weighted_mean(self, stack):
+        '''Weighted mean (L,C) of the rows (N,L,C) of the stack over the particles that have them'''
+        size = np.max(self.sizes, initial=0)
+        # weights of the particles for each landmark index, null where the particle has no such landmark
+        weights = self.fastslam.particle_set.weights[:,None] * (np.arange(size) < self.sizes[:,None])
+        totals = np.sum(weights, axis=0)
+        mean = np.einsum('nl,nlc->lc', weights, stack[:,:size])
+        return mean / np.where(totals > 0, totals, 1)[:,None]
+
+    def compute_mean_map(self):
+        self.update_stack()
+        return self.weighted_mean(self.stack)
+
+    def mean_map(self):
+        return self.cached('mean map', self.compute_mean_map)
+
+    def particles_dps(self):
+        return self.cached('particles dps', lambda: [tuple(pos) for pos in self.particle_positions().tolist()])
+
+    def landmarks_dps(self, index):
+        return self.cached(('landmarks dps', index), lambda: [tuple(pos) for pos in self.landmarks(index).tolist()])
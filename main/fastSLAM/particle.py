@@ -6,7 +6,7 @@
 import random
 import math
 import numpy as np
-from scipy import linalg
+from .small_linalg import inv2
 from .slam_helper import *
 from .landmark import Landmark
 
@@ -78,7 +78,7 @@ class Particle(object):
     def dick(self):
         return [(self.pos_x, self.pos_y), (self.pos_x + self.scope * math.cos(self.orientation), self.pos_y + self.scope * math.sin(self.orientation))]
 
-    def update(self, obs, q):
+    def update(self, obs):
         """After the motion, update the weight of the particle and its EKFs based on the sensor data"""
         for o in obs:
             prob = np.exp(-70)
@@ -95,8 +95,6 @@ class Particle(object):
                 # no initial landmarks
                 self.create_landmark(o)
             self.weight *= prob
-        
-        q.put([self]) ###
 
     def compute_jacobians(self, landmark):
         dx = landmark.pos_x - self.pos_x
@@ -142,7 +140,7 @@ class Particle(object):
 
     def update_landmark(self, obs, landmark_idx, ass_obs, ass_jacobian, ass_adjcov):
         landmark = self.landmarks[landmark_idx]
-        K = landmark.sig.dot(np.transpose(ass_jacobian)).dot(linalg.inv(ass_adjcov))
+        K = landmark.sig.dot(np.transpose(ass_jacobian)).dot(inv2(ass_adjcov))
         new_mu = landmark.mu + K.dot(obs - ass_obs)
         new_sig = (np.eye(2) - K.dot(ass_jacobian)).dot(landmark.sig)
         landmark.update(new_mu, new_sig)
@@ -4,143 +4,273 @@ modified update(self) to implement multiprocessing, optimised a bit the function
 created select_landmarks method to optimise whole process
 '''
 
-import random, math
+import math
 from operator import itemgetter
 import numpy as np
-from scipy import linalg
+from scipy.spatial import cKDTree
 from .slam_helper import *
-from .landmark import Landmark
+from .small_linalg import inv2, inv3, chol3, log_multi_normal
+from .landmark_map import LandmarkMap
+from .association import mahalanobis_gate
+from . import kernel
 from .particle import Particle
+from .profiler import profiler
 from specifications import Specifications as Spec
 
 
-counter = Counter()
-
 class Particle2(Particle):
     SELECT_LMS_THRESHOLD = 1.2
+    # squared Mahalanobis distance of the pairs (obs, landmark) tested in the data association
+    # (chi-square 99.9%, 2 degrees of freedom), None: all the pairs are tested
+    ASSOCIATION_GATE = 13.8
+    # likelihood of an observation that creates a new landmark
+    NEW_LANDMARK_LIKELIHOOD = 1e-40
     """Inherit from Particle. Incorporates latest obs in the proposal distribution"""
-    def __init__(self, x, y, orien, is_robot=False):
+    def __init__(self, x, y, orien, is_robot=False, pose=None, log_weight=None, seed=None):
+        # pose (3,) and log_weight (1,) can be views on the rows of a ParticleSet's arrays
+        # each particle draws its samples from its own random stream, seed: see numpy.random.default_rng
+        self.rng = np.random.default_rng(seed)
+        self.pose = np.empty(3) if pose is None else pose
+        self._log_weight = np.empty(1) if log_weight is None else log_weight
         super(Particle2, self).__init__(x, y, orien, is_robot)
         self.control_noise = np.array([[0.2, 0, 0], [0, 0.2, 0], [0, 0, (3.0*math.pi/180)**2]])
         self.obs_noise = np.array([[0.1, 0], [0, (3.0*math.pi/180)**2]])
+        self.landmarks = LandmarkMap()
+        # number of updates, used to date the landmarks
+        self.step = 0
+        # number of (obs, landmark) pairs removed by the association gate during the last update
+        self.gated = 0
+        # jacobians of the landmarks at the current pose: landmark index -> (batch of jacobians, row)
+        self._jacobians = {}
+
+    def bind(self, pose, log_weight):
+        '''Copy the state of the particle in the given views and keep them as storage'''
+        pose[:] = self.pose
+        log_weight[:] = self._log_weight
+        self.pose = pose
+        self._log_weight = log_weight
+
+    @property
+    def pos_x(self):
+        return self.pose[0]
+
+    @pos_x.setter
+    def pos_x(self, value):
+        self.pose[0] = value
+
+    @property
+    def pos_y(self):
+        return self.pose[1]
+
+    @pos_y.setter
+    def pos_y(self, value):
+        self.pose[1] = value
+
+    @property
+    def orientation(self):
+        return self.pose[2]
+
+    @orientation.setter
+    def orientation(self, value):
+        self.pose[2] = value
 
-    def update(self, obs, q): ###
+    @property
+    def log_weight(self):
+        # the weights are kept in log space, the products of densities underflow
+        return self._log_weight[0]
+
+    @log_weight.setter
+    def log_weight(self, value):
+        self._log_weight[0] = value
+
+    @property
+    def weight(self):
+        return math.exp(self.log_weight)
+
+    @weight.setter
+    def weight(self, value):
+        self.log_weight = math.log(value) if value > 0 else -math.inf
+
+    def set_pos(self, x, y, orien):
+        super(Particle2, self).set_pos(x, y, orien)
+        self._jacobians.clear()
+
+    def update(self, obs):
         """After the motion, update the weight of the particle and its EKFs based on the sensor data"""
+        self.step += 1
+        self._jacobians.clear()
+        self.gated = 0
         # Find data association first
-        data_association = []
-        for o in obs:
-            prob = 1e-40
-            landmark_idx = -1
-            if len(self.landmarks) != 0:
-                # find the data association with ML
-                prob, landmark_idx = self.pre_compute_data_association(o)
-                if prob < self.TOL:
-                    # create new landmark
-                    landmark_idx = -1
-            data_association.append((o, landmark_idx, prob))
+        probs = np.full(len(obs), self.NEW_LANDMARK_LIKELIHOOD)
+        landmarks_idx = np.full(len(obs), -1)
+        if len(self.landmarks) != 0 and len(obs) != 0:
+            # find the data association with ML
+            with profiler.phase('association'):
+                probs, landmarks_idx = self.pre_compute_data_association(obs)
+            # create new landmark
+            landmarks_idx[probs < self.TOL] = -1
+        data_association = list(zip(obs, landmarks_idx.tolist(), probs.tolist()))
         # Incorporates obs that creates new features last
         data_association.sort(key=itemgetter(1), reverse=True)
         # incorporate multiple obs to get the proposal distribution
-        initial_pose = np.array([[self.pos_x], [self.pos_y], [self.orientation]])
+        initial_pose = self.pose.copy()
         pose_mean = initial_pose
         pose_cov = self.control_noise
-        inv_pos_cov = linalg.inv(pose_cov)
-        for da in data_association:
-            if da[1] > -1:
-                # Using EKF to update the robot pose
-                predicted_obs, featurn_jacobian, pose_jacobian, adj_cov = self.compute_jacobians(self.landmarks[da[1]])
-                pose_cov = linalg.inv( np.transpose(pose_jacobian).dot(linalg.inv(adj_cov).dot(pose_jacobian)) + inv_pos_cov )
-                pose_mean = initial_pose + pose_cov.dot(np.transpose(pose_jacobian)).dot(linalg.inv(adj_cov)).dot(np.transpose(np.array([da[0]])) - predicted_obs)
-                new_pose = np.random.multivariate_normal(pose_mean[:,0], pose_cov)
-                self.set_pos(*new_pose)
-            else:
-                # Using the latest pose to create the landmark
-                self.create_landmark(da[0])
-
-        # update the landmarks EKFs
-        for da in data_association:
-            if da[1] > -1:
-                predicted_obs, featurn_jacobian, pose_jacobian, adj_cov = self.compute_jacobians(self.landmarks[da[1]])
-                self.weight *= multi_normal(np.transpose(np.array([da[0]])), predicted_obs, adj_cov)
-                self.update_landmark(np.transpose(np.array([da[0]])), da[1], predicted_obs, featurn_jacobian, adj_cov)
-            else:
-                self.weight *= da[2]
-        
-        new_pos = np.array([[self.pos_x], [self.pos_y], [self.orientation]])
-
-        prior = multi_normal(new_pos, initial_pose, self.control_noise)
-        prop = multi_normal(new_pos, pose_mean, pose_cov)
-        self.weight = self.weight * prior / prop
-
-        q.put([self]) ###
-
-    @counter
-    def compute_jacobians(self, landmark):
-        dx = landmark.pos_x - self.pos_x
-        dy = landmark.pos_y - self.pos_y
-        d2 = dx**2 + dy**2
-        d = math.sqrt(d2)
-
-        predicted_obs = np.array([[d],[math.atan2(dy, dx)]])
-        feature_jacobian = np.array([[dx/d,   dy/d],
-                                     [-dy/d2, dx/d2]])
-        pose_jacobian = np.array([[-dx/d, -dy/d, 0],
-                                  [dy/d2, -dx/d2, -1]])
-        adj_cov = feature_jacobian.dot(landmark.sig).dot(np.transpose(feature_jacobian)) + self.obs_noise
-        return predicted_obs, feature_jacobian, pose_jacobian, adj_cov
-
-    @counter
-    def pre_compute_data_association(self, obs):
-        """Tries all the landmarks to incorporate the obs to get the proposal distribution and get the one with maximum likelihood"""
-        prob = 0
-        ass_obs = np.zeros((2,1))
-        ass_jacobian = np.zeros((2,2))
-        ass_adjcov = np.zeros((2,2))
-        landmark_idx = -1
-        initial_pose = np.array([[self.pos_x], [self.pos_y], [self.orientation]])
-        inv_control_noise = linalg.inv(self.control_noise)
-        tran_arr_obs = np.transpose(np.array([obs]))
+        inv_pos_cov = inv3(pose_cov)
+        with profiler.phase('proposal'):
+            noise = self.rng.standard_normal((len(data_association), 3))
+            for da, sample_noise in zip(data_association, noise):
+                if da[1] > -1:
+                    # Using EKF to update the robot pose
+                    predicted_obs, feature_jacobian, pose_jacobian, adj_cov = self.compute_jacobians(da[1])
+                    pose_mean, pose_cov = kernel.pose_proposal(initial_pose, pose_jacobian, adj_cov, da[0] - predicted_obs, inv_pos_cov)
+                    self.set_pos(*(pose_mean + chol3(pose_cov) @ sample_noise))
+                else:
+                    # Using the latest pose to create the landmark
+                    self.create_landmark(da[0])
+
+        # update the landmarks EKFs, the jacobians at the final pose are computed in one batch
+        with profiler.phase('EKF update'):
+            associated = {da[1] for da in data_association if da[1] > -1} - self._jacobians.keys()
+            if associated:
+                self.cache_jacobians(list(associated))
+            for da in data_association:
+                if da[1] > -1:
+                    predicted_obs, feature_jacobian, pose_jacobian, adj_cov = self.compute_jacobians(da[1])
+                    self.log_weight += log_multi_normal(da[0], predicted_obs, adj_cov)
+                    self.update_landmark(da[0], da[1], predicted_obs, feature_jacobian, adj_cov)
+                else:
+                    self.log_weight += math.log(max(da[2], self.NEW_LANDMARK_LIKELIHOOD))
+        if profiler.enabled:
+            n_new = sum(da[1] == -1 for da in data_association)
+            profiler.count('associated observations', len(data_association) - n_new)
+            profiler.count('new landmarks', n_new)
+
+        prior = log_multi_normal(self.pose, initial_pose, self.control_noise)
+        prop = log_multi_normal(self.pose, pose_mean, pose_cov)
+        self.log_weight += prior - prop
 
+    def cache_jacobians(self, idxs):
+        """
+        Compute the jacobians of the landmarks at the current pose in one batch and keep them
+        until the pose or the landmark changes, return the means of the landmarks and the jacobians (see kernel.compute_jacobians)
+        """
+        mus, sigs = self.landmarks.gather(idxs)
+        jacobians = kernel.compute_jacobians(self.pose, mus, sigs, self.obs_noise)
+        self._jacobians.update((idx, (jacobians, row)) for row, idx in enumerate(idxs))
+        return mus, jacobians
+
+    def compute_jacobians(self, landmark_idx):
+        """return predicted_obs (2,), feature_jacobian (2,2), pose_jacobian (2,3), adj_cov (2,2) of the landmark"""
+        if landmark_idx not in self._jacobians:
+            self.cache_jacobians([landmark_idx])
+        jacobians, row = self._jacobians[landmark_idx]
+        return tuple(jacobian[row] for jacobian in jacobians)
+
+    def pre_compute_data_association(self, obs):
+        """
+        Tries all the landmarks to incorporate all the obs to get the proposal distribution and get the ones with maximum likelihood  
+        obs: (M,2) array  
+        return the likelihoods (M,) and indexes of the landmarks (M,), -1 if no landmark is selected
+        """
         # select landmarks according to the sensor scope
-        selected_lms = self.select_landmarks()
-
-        for idx, landmark in selected_lms:
-            # Sample a new particle pose from the proposal distribution
-            predicted_obs, featurn_jacobian, pose_jacobian, adj_cov = self.compute_jacobians(landmark)
-            inv_adj_cov = linalg.inv(adj_cov)
-            pose_cov = linalg.inv( np.transpose(pose_jacobian).dot(inv_adj_cov.dot(pose_jacobian)) + inv_control_noise )
-            pose_mean = initial_pose + pose_cov.dot(np.transpose(pose_jacobian)).dot(inv_adj_cov).dot(tran_arr_obs - predicted_obs)
-            new_pose = np.random.multivariate_normal(pose_mean[:,0], pose_cov)
-
-            distance = euclidean_distance((landmark.pos_x, landmark.pos_y), (new_pose[0], new_pose[1]))
-            direction = cal_direction((new_pose[0], new_pose[1]), (landmark.pos_x, landmark.pos_y))
-            p = multi_normal(tran_arr_obs, np.array([[distance],[direction]]), adj_cov)
-            if p > prob:
-                prob = p
-                landmark_idx = idx
-        return prob, landmark_idx
-
-    @counter
+        idxs = np.array(self.select_landmarks(), dtype=int)
+        if len(idxs) == 0:
+            return np.zeros(len(obs)), np.full(len(obs), -1)
+
+        mus, (predicted_obs, feature_jacobian, pose_jacobian, adj_cov) = self.cache_jacobians(idxs.tolist())
+
+        if self.ASSOCIATION_GATE is None:
+            probs, selected_idxs = kernel.data_association(self.pose, mus, obs, predicted_obs, pose_jacobian, adj_cov,
+                                                           self.control_noise, self.rng)
+            return probs, idxs[selected_idxs]
+
+        # only the observations and the landmarks with a pair in the gate go through the proposal sampling
+        gate = mahalanobis_gate(obs, predicted_obs, pose_jacobian, adj_cov, self.control_noise, self.ASSOCIATION_GATE)
+        rows = np.flatnonzero(np.any(gate, axis=1))
+        cols = np.flatnonzero(np.any(gate, axis=0))
+        self.gated = gate.size - len(rows) * len(cols)
+        profiler.count('gated pairs', self.gated)
+
+        probs = np.zeros(len(obs))
+        landmarks_idx = np.full(len(obs), -1)
+        if len(rows) == 0:
+            return probs, landmarks_idx
+        sub_probs, selected_idxs = kernel.data_association(self.pose, mus[cols], obs[rows], predicted_obs[cols],
+                                                           pose_jacobian[cols], adj_cov[cols], self.control_noise, self.rng)
+        # a pair out of the gate is never associated
+        selected_idxs = cols[selected_idxs]
+        valid = gate[rows, selected_idxs]
+        probs[rows[valid]] = sub_probs[valid]
+        landmarks_idx[rows[valid]] = idxs[selected_idxs[valid]]
+        return probs, landmarks_idx
+
     def update_landmark(self, obs, landmark_idx, ass_obs, ass_jacobian, ass_adjcov):
-        landmark = self.landmarks[landmark_idx]
-        K = landmark.sig.dot(np.transpose(ass_jacobian)).dot(linalg.inv(ass_adjcov))
-        new_mu = landmark.mu + K.dot(obs - ass_obs)
-        new_sig = (np.eye(2) - K.dot(ass_jacobian)).dot(landmark.sig)
-        landmark.update(new_mu, new_sig)
+        mus, sigs = self.landmarks.gather([landmark_idx])
+        new_mu, new_sig = kernel.landmark_update(mus[0], sigs[0], ass_jacobian, ass_adjcov, obs - ass_obs)
+        self.landmarks.update(landmark_idx, new_mu, new_sig)
+        self._jacobians.pop(landmark_idx, None)
     
-    def select_landmarks(self):
-        ''' select the landmarks to be tested in pre_compute_data_association'''
-        selected_lms = []
+    def create_landmark(self, obs):
+        landmark = self.guess_landmark(obs)
+        self.landmarks.append(landmark.mu, landmark.sig, created=self.step)
+
+    def maintain_landmarks(self, merge_threshold, prune_age, max_landmarks):
+        '''
+        Clean the map of the particle:  
+        merge the landmarks closer than merge_threshold (squared Mahalanobis distance),  
+        drop the landmarks that haven't been re-observed prune_age steps after their creation,  
+        keep at most max_landmarks landmarks, the most observed ones.
+        '''
+        if len(self.landmarks) == 0:
+            return
+        mus = self.landmarks.means()
+        sigs = self.landmarks.covariances()
+        hits = self.landmarks.hits()
+        created = self.landmarks.created()
+        removed = set()
+
+        # merge: only the pairs closer than the largest possible distance under the threshold are tested
+        radius = math.sqrt(merge_threshold * 2 * np.max(np.trace(sigs, axis1=1, axis2=2)))
+        pairs = cKDTree(mus).query_pairs(radius, output_type='ndarray')
+        if len(pairs) != 0:
+            diff = mus[pairs[:,0]] - mus[pairs[:,1]]
+            inv_sum = inv2(sigs[pairs[:,0]] + sigs[pairs[:,1]])
+            dists = np.sum((inv_sum @ diff[...,None])[...,0] * diff, axis=1)
+            for k in np.argsort(dists):
+                if dists[k] >= merge_threshold:
+                    break
+                i, j = pairs[k]
+                if i in removed or j in removed:
+                    continue
+                # product of the two gaussians
+                inv_i, inv_j = inv2(sigs[i]), inv2(sigs[j])
+                sig = inv2(inv_i + inv_j)
+                mu = sig @ (inv_i @ mus[i] + inv_j @ mus[j])
+                self.landmarks.update(i, mu[:,None], sig, hits=hits[j])
+                # the next merges into i start from the merged landmark
+                mus[i], sigs[i] = mu, sig
+                hits[i] += hits[j]
+                removed.add(j)
 
-        for i, lm in enumerate(self.landmarks):
-            # check according to the distance (sensor scope)
-            if euclidean_distance(self.pos(), lm.pos()) < self.SELECT_LMS_THRESHOLD * Spec.SENSOR_SCOPE:
-                # check according to the angle of the observation (angle of vision)
-                angle = cal_direction(self.pos(), lm.pos())-pi_2_pi(self.orientation)
-                angle = pi_2_pi(angle)
-                if abs(angle) < self.SELECT_LMS_THRESHOLD * Spec.SENSOR_ANGLES[1]:
-                    selected_lms.append((i,lm))
+        # prune
+        stale = (hits == 1) & (self.step - created >= prune_age)
+        removed.update(np.flatnonzero(stale).tolist())
 
-        #print(f'selected: {len(selected_lms)/len(self.landmarks)*100:.0f}%')
+        # cap, drop the least observed (the oldest first)
+        n_excess = len(mus) - len(removed) - max_landmarks
+        if n_excess > 0:
+            kept = np.array([i for i in range(len(mus)) if i not in removed])
+            order = np.lexsort((created[kept], hits[kept]))
+            removed.update(kept[order[:n_excess]].tolist())
+
+        for idx in sorted(removed, reverse=True):
+            self.landmarks.remove(idx)
+
+    def select_landmarks(self):
+        ''' select the landmarks to be tested in pre_compute_data_association'''
+        # check according to the distance (sensor scope) and the angle of the observation (angle of vision)
+        idxs = self.landmarks.query_cone(self.pos(), self.orientation,
+                    self.SELECT_LMS_THRESHOLD * Spec.SENSOR_SCOPE, self.SELECT_LMS_THRESHOLD * Spec.SENSOR_ANGLES[1])
 
-        return selected_lms
+        return idxs
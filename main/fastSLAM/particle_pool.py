@@ -0,0 +1,206 @@
+'''
+Persistent pool of worker processes for the update of the particles.
+
+Each worker owns a share of the particles (a contiguous range of indexes) with their landmarks.
+At each step only the poses/log weights of the share and the observations cross the processes,
+the landmarks stay in the workers, they are only transfered when a particle is resampled from another worker.
+The shares are only changed when the number of particles changes (see ParticleSet.size_bounds).
+'''
+
+import atexit
+import random
+import numpy as np
+from multiprocessing import Process, Pipe
+from .particle_set import distribute_landmarks, map_means
+from .profiler import profiler
+
+
+def _bind(particles):
+    '''Bind the particles to new arrays of their poses and log weights, return the arrays'''
+    poses = np.array([p.pose for p in particles])
+    log_weights = np.array([p.log_weight for p in particles])
+    for i, p in enumerate(particles):
+        p.bind(poses[i], log_weights[i:i+1])
+    return poses, log_weights
+
+def _work(conn, start, particles):
+    '''Loop of a worker, particles: the particles of its share, starting at index start'''
+    # the workers are forked with the same random state
+    np.random.seed()
+    random.seed()
+
+    particle_class = type(particles[0])
+    poses, log_weights = _bind(particles)
+
+    while True:
+        cmd, args = conn.recv()
+
+        if cmd == 'update':
+            poses[:], log_weights[:], obs, profile = args
+            profiler.set_context(profile)
+            gated = 0
+            for p in particles:
+                try:
+                    p.update(obs)
+                except ZeroDivisionError:
+                    print('warning: particle on landmark.')
+                gated += p.gated
+            conn.send((poses, log_weights, gated))
+
+        elif cmd == 'maintain':
+            for p in particles:
+                p.maintain_landmarks(*args)
+            conn.send(True)
+
+        elif cmd == 'export':
+            # landmarks of the share needed by the other workers
+            conn.send({idx: particles[idx-start].landmarks for idx in args})
+
+        elif cmd == 'select':
+            indexes, imported, new_start, seeds = args
+            maps = {start+i: p.landmarks for i, p in enumerate(particles)}
+            maps.update(imported)
+            if len(indexes) != len(particles):
+                # new share: drop the last particles or add new ones, their pose is set by the next update
+                step = particles[0].step
+                particles = particles[:len(indexes)] + [particle_class(0, 0, 0, seed=seed) for seed in seeds]
+                for p in particles:
+                    p.step = step
+                poses, log_weights = _bind(particles)
+            start = new_start
+            distribute_landmarks(particles, indexes, maps)
+            conn.send(True)
+
+        elif cmd == 'landmarks':
+            conn.send(particles[args-start].landmarks)
+
+        elif cmd == 'means':
+            indexes, known = args
+            conn.send(map_means([particles[idx-start].landmarks for idx in indexes], known))
+
+        elif cmd == 'profile':
+            conn.send(profiler.snapshot())
+
+        elif cmd == 'stop':
+            conn.close()
+            return
+
+
+class ParticlePool:
+    '''
+    Update the particles of a ParticleSet in persistent worker processes.
+    The poses and log weights are kept in the ParticleSet of the main process,
+    the landmarks are only stored in the workers, use landmarks() to get them.
+    Must be closed with close() (done at exit otherwise).
+    '''
+    def __init__(self, particle_set, n_workers):
+        self.particle_set = particle_set
+        if particle_set.size_bounds is not None:
+            # each worker keeps at least one particle
+            low, high = particle_set.size_bounds
+            particle_set.size_bounds = (max(low, n_workers), max(high, n_workers))
+        self.bounds = np.linspace(0, particle_set.size, n_workers+1).astype(int)
+        # index of the worker owning each particle
+        self.owners = np.repeat(np.arange(n_workers), np.diff(self.bounds))
+
+        self.workers = []
+        for start, end in zip(self.bounds[:-1], self.bounds[1:]):
+            conn, worker_conn = Pipe()
+            process = Process(target=_work, args=(worker_conn, start, particle_set.particles[start:end]), daemon=True)
+            process.start()
+            self.workers.append((process, conn))
+
+        # the landmarks are now owned by the workers
+        for p in particle_set.particles:
+            p.landmarks = type(p.landmarks)()
+
+        self.closed = False
+        atexit.register(self.close)
+
+    def shares(self):
+        for (process, conn), start, end in zip(self.workers, self.bounds[:-1], self.bounds[1:]):
+            yield conn, start, end
+
+    def update(self, obs):
+        poses, log_weights = self.particle_set.poses, self.particle_set.log_weights
+        for conn, start, end in self.shares():
+            conn.send(('update', (poses[start:end], log_weights[start:end], obs, profiler.context())))
+        for conn, start, end in self.shares():
+            poses[start:end], log_weights[start:end], gated = conn.recv()
+            self.particle_set.gated += gated
+
+    def maintain_landmarks(self, *args):
+        '''See Particle2.maintain_landmarks'''
+        for conn, start, end in self.shares():
+            conn.send(('maintain', args))
+        for conn, start, end in self.shares():
+            conn.recv()
+
+    def resample(self):
+        self.select(self.particle_set.resampling_indexes())
+
+    def select(self, indexes):
+        '''Replace the particles by the ones at the given indexes, their number can change'''
+        old_bounds = self.bounds
+        self.bounds = np.linspace(0, len(indexes), len(self.workers)+1).astype(int)
+
+        # get the landmarks that have to be transfered from a worker to another
+        exports = [set() for _ in self.workers]
+        for w, (conn, start, end) in enumerate(self.shares()):
+            for idx in indexes[start:end]:
+                if self.owners[idx] != w:
+                    exports[self.owners[idx]].add(int(idx))
+
+        for (conn, start, end), export in zip(self.shares(), exports):
+            if export:
+                conn.send(('export', export))
+        imported = {}
+        for (conn, start, end), export in zip(self.shares(), exports):
+            if export:
+                imported.update(conn.recv())
+
+        for w, (conn, start, end) in enumerate(self.shares()):
+            sources = indexes[start:end]
+            n_new = (end - start) - (old_bounds[w+1] - old_bounds[w])
+            seeds = self.particle_set.seed_sequence.spawn(n_new) if n_new > 0 else []
+            conn.send(('select', (sources, {idx: imported[idx] for idx in set(sources.tolist()) if self.owners[idx] != w}, start, seeds)))
+        for conn, start, end in self.shares():
+            conn.recv()
+
+        self.owners = np.repeat(np.arange(len(self.workers)), np.diff(self.bounds))
+        self.particle_set.select_poses(indexes)
+
+    def landmarks(self, index):
+        conn = self.workers[self.owners[index]][1]
+        conn.send(('landmarks', index))
+        return conn.recv()
+
+    def map_means(self, indexes, known):
+        '''See particle_set.map_means, only the means of the modified maps cross the processes'''
+        indexes = np.asarray(indexes, dtype=int)
+        owners = self.owners[indexes]
+        for w, (process, conn) in enumerate(self.workers):
+            if np.any(owners == w):
+                conn.send(('means', (indexes[owners == w].tolist(), known)))
+        result = [None] * len(indexes)
+        for w, (process, conn) in enumerate(self.workers):
+            if np.any(owners == w):
+                for i, item in zip(np.flatnonzero(owners == w).tolist(), conn.recv()):
+                    result[i] = item
+        return result
+
+    def collect_profile(self):
+        '''Merge the profiles of the workers in the profiler of the main process'''
+        for conn, start, end in self.shares():
+            conn.send(('profile', None))
+        for conn, start, end in self.shares():
+            profiler.merge(conn.recv())
+
+    def close(self):
+        '''Stop the workers'''
+        if self.closed:
+            return
+        self.closed = True
+        for process, conn in self.workers:
+            conn.send(('stop', None))
+            process.join()
@@ -0,0 +1,201 @@
+'''
+Structure of arrays storage of the FastSlam particles.
+
+The poses and the (log) weights of all the particles are stored in two arrays,
+the motion, the mean pose and the resampling are computed on the whole arrays at once.
+The Particle2 objects are still used for the landmarks and the EKFs, each one is bound to its row of the arrays.
+ParticleSet updates the particles serially, see ParticlePool for the multiprocessing version.
+'''
+
+import math
+import numpy as np
+from . import kernel
+from .slam_helper import log_sum_exp, low_variance_sampling, kld_sampling
+from .particle2 import Particle2
+
+
+class ParticleSet:
+    '''
+    Store the state of the particles.
+    With size_bounds (min, max), the number of particles is adapted at each resampling (KLD-sampling):
+    the particles are drawn until their number is enough for the number of bins of KLD_BIN_SIZE they occupy,
+    KLD_EPSILON and KLD_Z are the bound on the KL divergence and the quantile of its probability.
+
+    Attributes:
+        poses: (N,3) array, x, y, orientation of each particle
+        log_weights: (N,) array, log of the weight of each particle
+        gated: number of (obs, landmark) pairs removed by the association gate since the start (see Particle2.ASSOCIATION_GATE)
+        particles: Particle2 (particle_class) objects, bound to their row of poses/log_weights, carry the landmarks
+    '''
+    # same as the non-robot Particle
+    motion_noise = 0
+    turning_noise = 0 # unit: degree
+    particle_class = Particle2
+    KLD_BIN_SIZE = (5., 5., 3 * math.pi / 180)
+    KLD_EPSILON = 0.15
+    KLD_Z = 1.645
+
+    def __init__(self, x, y, orien, size, spread=.1, seed=None, size_bounds=None):
+        # independent random streams: one for the set (motion, resampling) and one per particle
+        self.seed_sequence = np.random.SeedSequence(seed)
+        seeds = self.seed_sequence.spawn(size + 1)
+        self.rng = np.random.default_rng(seeds[0])
+        self.size = size
+        self.size_bounds = size_bounds
+        self.poses = np.empty((size, 3))
+        self.poses[:,0] = x
+        self.poses[:,1] = y
+        self.poses[:,2] = orien + spread * (self.rng.random(size) - .5)
+        self.log_weights = np.zeros(size)
+        self.gated = 0
+        self.particles = self.create_particles(seeds[1:])
+
+    def create_particles(self, seeds, start=0):
+        '''Particle objects bound to the rows of the arrays from start, seeds: seed of the random stream of each particle'''
+        return [self.particle_class(*self.poses[i], pose=self.poses[i], log_weight=self.log_weights[i:i+1], seed=seed)
+                for i, seed in enumerate(seeds, start)]
+
+    def forward(self, d):
+        '''Motion model: move all the particles forward of distance d'''
+        kernel.forward(self.poses, d)
+        if self.motion_noise:
+            self.poses[:,:2] += self.rng.normal(0, self.motion_noise, (self.size, 2))
+
+    def turn_left(self, angle):
+        '''Turn all the particles of angle (degree)'''
+        angles = np.full(self.size, float(angle))
+        if self.turning_noise:
+            angles += self.rng.normal(0, self.turning_noise, self.size)
+        kernel.turn(self.poses, angles / 180. * math.pi)
+
+    def turn_right(self, angle):
+        self.turn_left(-angle)
+
+    def mean_pos(self):
+        '''return the mean position of the particles'''
+        mean_x, mean_y = np.mean(self.poses[:,:2], axis=0)
+        return mean_x, mean_y
+
+    def mean_orien(self):
+        '''return the mean orientation of the particles'''
+        return np.mean(self.poses[:,2])
+
+    @property
+    def weights(self):
+        '''(N,) normalized weights'''
+        self.normalize_weights()
+        return np.exp(self.log_weights)
+
+    def normalize_weights(self):
+        '''Normalize the weights with log-sum-exp, fall back to uniform weights if they are all null'''
+        self.log_weights[np.isnan(self.log_weights)] = -np.inf
+        total = log_sum_exp(self.log_weights)
+        if np.isfinite(total):
+            self.log_weights -= total
+        else:
+            self.log_weights[:] = -math.log(self.size)
+
+    def effective_sample_size(self):
+        '''1 / sum(w^2) of the normalized weights, between 1 (degenerated) and N (uniform)'''
+        return 1.0 / np.sum(self.weights**2)
+
+    def resampling_indexes(self):
+        '''Low variance resampling, KLD-sampling if the size is adaptive, return the indexes of the drawn particles'''
+        if self.size_bounds is None:
+            return low_variance_sampling(self.weights, self.rng)
+        return kld_sampling(self.weights, self.poses, self.rng, *self.size_bounds,
+                            np.array(self.KLD_BIN_SIZE), self.KLD_EPSILON, self.KLD_Z)
+
+    def resample(self):
+        self.select(self.resampling_indexes())
+
+    def select(self, indexes):
+        '''Replace the particles by the ones at the given indexes, their number can change'''
+        maps = {i: p.landmarks for i, p in enumerate(self.particles)}
+        self.select_poses(indexes)
+        distribute_landmarks(self.particles, indexes, maps)
+
+    def select_poses(self, indexes):
+        poses = self.poses[indexes]
+        if len(indexes) != self.size:
+            self.resize(len(indexes))
+        self.poses[:] = poses
+        self.log_weights[:] = -math.log(self.size)
+
+    def resize(self, size):
+        '''
+        Change the number of particles: new arrays, the particles are bound to their row in them,
+        the last particles are dropped or new particles are added (without pose nor landmarks)
+        '''
+        self.poses = np.zeros((size, 3))
+        self.log_weights = np.zeros(size)
+        particles = self.particles[:size]
+        for i, p in enumerate(particles):
+            p.bind(self.poses[i], self.log_weights[i:i+1])
+        new = self.create_particles(self.seed_sequence.spawn(size - len(particles)), len(particles)) if size > len(particles) else []
+        for p in new:
+            # date the landmarks they will receive as the other particles
+            p.step = particles[0].step
+        self.particles = particles + new
+        self.size = size
+
+    def update(self, obs):
+        '''Serial update of the particles'''
+        for p in self.particles:
+            try:
+                p.update(obs)
+            except ZeroDivisionError:
+                print('warning: particle on landmark.')
+            self.gated += p.gated
+
+    def maintain_landmarks(self, *args):
+        '''See Particle2.maintain_landmarks'''
+        for p in self.particles:
+            p.maintain_landmarks(*args)
+
+    def landmarks(self, index):
+        return self.particles[index].landmarks
+
+    def map_means(self, indexes, known):
+        '''See map_means'''
+        return map_means([self.particles[i].landmarks for i in indexes], known)
+
+    def collect_profile(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def distribute_landmarks(particles, indexes, maps):
+    '''
+    Give to each particle the landmarks of maps[indexes[i]].  
+    The first particle drawn from an index takes the landmarks, the duplicates share them (copy-on-write).
+    The maps that aren't drawn are released.
+    '''
+    taken = set()
+    for p, idx in zip(particles, indexes):
+        if idx in taken:
+            p.landmarks = maps[idx].copy()
+        else:
+            p.landmarks = maps[idx]
+            taken.add(idx)
+
+    for idx, landmarks in maps.items():
+        if idx not in taken:
+            landmarks.release()
+
+def map_means(maps, known):
+    '''
+    Revision and means (L,2) of the maps, the means are None if the revision is in known
+    or was already given for a previous map (see LandmarkMap.revision)
+    '''
+    known = set(known)
+    result = []
+    for landmarks in maps:
+        if landmarks.revision in known:
+            result.append((landmarks.revision, None))
+        else:
+            known.add(landmarks.revision)
+            result.append((landmarks.revision, landmarks.means()))
+    return result
@@ -0,0 +1,64 @@
+'''
+Preprocessing of the observations of a sweep, before they are given to the particles.
+
+The sensor returns the nearest wall hit by each ray (see BaseSimulation.collision): the walls close to the robot
+are seen by many rays, each observation costs a data association and an EKF update in every particle.
+ObservationFilter drops the returns out of range and merges the close ones.
+'''
+
+import numpy as np
+from .profiler import profiler
+from specifications import Specifications as Spec
+
+
+class ObservationFilter:
+    '''
+    Clean the observations (distance, angle) of a sweep, all taken from the same pose:
+    drop the returns out of [min_range, max_range] (a null distance is no return),
+    drop the exact duplicates (e.g. a log or a driver repeating a return),
+    keep one observation per square voxel of voxel_size pixels: the mean of the end points in it (0: no downsampling).
+    The numbers of dropped observations are counted in removed and in the profiler.
+    '''
+    VOXEL_SIZE = 40.
+    MIN_RANGE = 1.
+    MAX_RANGE = 1.2 * Spec.SENSOR_SCOPE
+
+    def __init__(self, voxel_size=VOXEL_SIZE, min_range=MIN_RANGE, max_range=MAX_RANGE):
+        self.voxel_size = voxel_size
+        self.min_range = min_range
+        self.max_range = max_range
+        self.removed = {'out of range': 0, 'duplicated': 0, 'downsampled': 0}
+
+    def count(self, name, n):
+        self.removed[name] += n
+        profiler.count(f'{name} observations', n)
+
+    def __call__(self, obs):
+        '''
+        Return the kept observations (K,2) of the observations (M,2), sorted by distance then angle,
+        or by voxel (x then y index of the voxel of the end point) when voxels are merged
+        '''
+        obs = np.asarray(obs, dtype=float).reshape(-1, 2)
+        n = len(obs)
+
+        in_range = np.isfinite(obs).all(axis=1) & (obs[:,0] >= self.min_range) & (obs[:,0] <= self.max_range)
+        obs = obs[in_range]
+        self.count('out of range', n - len(obs))
+        n = len(obs)
+
+        obs = np.unique(obs, axis=0)
+        self.count('duplicated', n - len(obs))
+        n = len(obs)
+
+        if self.voxel_size and n > 1:
+            # end points relative to the robot, the pose is the same for the whole sweep
+            points = obs[:,0,None] * np.stack((np.cos(obs[:,1]), np.sin(obs[:,1])), axis=-1)
+            voxels, inverse = np.unique(np.floor(points / self.voxel_size), axis=0, return_inverse=True)
+            if len(voxels) < n:
+                inverse = inverse.reshape(-1)
+                counts = np.bincount(inverse)
+                centers = np.stack([np.bincount(inverse, points[:,i]) for i in range(2)], axis=-1) / counts[:,None]
+                obs = np.stack((np.hypot(centers[:,0], centers[:,1]), np.arctan2(centers[:,1], centers[:,0])), axis=-1)
+            self.count('downsampled', n - len(obs))
+
+        return obs
@@ -0,0 +1,168 @@
+'''
+Profiler of FastSLAM: nested phase timers and counters.
+
+Disabled by default, then phase() returns a shared empty context manager and count() does nothing.
+The phases are nested: a phase opened inside another one is stored as 'outer/inner'.
+The workers of a ParticlePool profile their share with the context of the main process,
+their results are merged with FastSlam.collect_profile().
+
+Usage:
+    profiler.enable(trace=True)
+    ... fastslam.run(mov, obs) ...
+    fastslam.collect_profile()
+    print(profiler.summary())
+    profiler.save_json('profile.json')
+    profiler.save_chrome_trace('trace.json') # chrome://tracing or https://ui.perfetto.dev
+'''
+
+import os, json
+from time import perf_counter
+from contextlib import nullcontext
+
+_NO_PHASE = nullcontext()
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._stack.append(self.name)
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        duration = perf_counter() - self.start
+        profiler = self.profiler
+        path = '/'.join(profiler._stack)
+        profiler._stack.pop()
+        stat = profiler.stats.get(path)
+        if stat is None:
+            profiler.stats[path] = [1, duration]
+        else:
+            stat[0] += 1
+            stat[1] += duration
+        if profiler.trace:
+            profiler.events.append((path, self.start, duration))
+
+
+class Profiler:
+    '''
+    Attributes:
+        stats: phase path -> [number of calls, total time (s)], of all the processes
+        counts: name -> count, of all the processes
+        processes: pid -> {'stats', 'counts'} of each worker
+        events: (path, start, duration) of each phase of this process if trace is enabled
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self._stack = []
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+        self.counts = {}
+        self.processes = {}
+        self.events = []
+        self.worker_events = []
+
+    def enable(self, trace=False):
+        '''trace: keep every phase for the chrome trace'''
+        self.enabled = True
+        self.trace = trace
+
+    def disable(self):
+        self.enabled = False
+        self.trace = False
+
+    def phase(self, name):
+        '''Context manager timing a phase'''
+        if self.enabled:
+            return _Phase(self, name)
+        return _NO_PHASE
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def context(self):
+        '''State to give to a worker (see set_context), None if disabled'''
+        if self.enabled:
+            return self.trace, list(self._stack)
+        return None
+
+    def set_context(self, context):
+        '''Profile the phases of a worker as nested in the current phase of the main process'''
+        if context is None:
+            self.disable()
+        else:
+            trace, stack = context
+            self.enable(trace)
+            self._stack = stack
+
+    def snapshot(self):
+        '''Results of this process, to send to the main one, reset them'''
+        snapshot = {'pid': os.getpid(), 'stats': self.stats, 'counts': self.counts, 'events': self.events}
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        '''Add the results of a worker'''
+        for path, (n_calls, total) in snapshot['stats'].items():
+            stat = self.stats.setdefault(path, [0, 0.])
+            stat[0] += n_calls
+            stat[1] += total
+        for name, n in snapshot['counts'].items():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+        process = self.processes.setdefault(snapshot['pid'], {'stats': {}, 'counts': {}})
+        for path, (n_calls, total) in snapshot['stats'].items():
+            stat = process['stats'].setdefault(path, [0, 0.])
+            stat[0] += n_calls
+            stat[1] += total
+        for name, n in snapshot['counts'].items():
+            process['counts'][name] = process['counts'].get(name, 0) + n
+        self.worker_events.extend((snapshot['pid'], *event) for event in snapshot['events'])
+
+    @staticmethod
+    def _phases(stats):
+        return {path: {'calls': n_calls, 'total_ms': 1000 * total, 'mean_ms': 1000 * total / n_calls}
+                for path, (n_calls, total) in sorted(stats.items())}
+
+    def to_dict(self):
+        return {
+            'phases': self._phases(self.stats),
+            'counts': dict(self.counts),
+            'processes': {pid: {'phases': self._phases(process['stats']), 'counts': process['counts']}
+                          for pid, process in self.processes.items()},
+        }
+
+    def summary(self):
+        lines = ['Profile:']
+        for path, phase in self._phases(self.stats).items():
+            indent = '  ' * path.count('/')
+            lines.append(f"{indent}{path.split('/')[-1]}: {phase['calls']} calls, "
+                         f"mean: {phase['mean_ms']:.3f}ms, total: {phase['total_ms']:.1f}ms")
+        for name, n in sorted(self.counts.items()):
+            lines.append(f'{name}: {n}')
+        return '\n'.join(lines)
+
+    def save_json(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def save_chrome_trace(self, filename):
+        '''Save the traced phases in the Trace Event Format (complete events, one row per process)'''
+        pid = os.getpid()
+        events = [(pid, *event) for event in self.events] + self.worker_events
+        trace = [{'name': path.split('/')[-1], 'cat': path, 'ph': 'X', 'pid': event_pid, 'tid': 0,
+                  'ts': 1e6 * start, 'dur': 1e6 * duration}
+                 for event_pid, path, start, duration in events]
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+
+profiler = Profiler()
@@ -0,0 +1,94 @@
+'''
+Binary log of the inputs of FastSlam: the (mov, obs) of each step, to replay a run without pygame or the robot.
+
+File: header MAGIC, VERSION, start pose (x, y, orientation) of the robot,
+then one record per step: timestamp, mov (distance, angle), ground truth pose (NaN if unknown),
+number of observations and the observations (distance, angle), little endian float64.
+The records are flushed as they are written: the log of an interrupted run is complete up to the last step.
+
+Replay a log with `python -m benchmark.replay run.log` from main/.
+'''
+
+import struct, time
+from collections import namedtuple
+import numpy as np
+
+MAGIC = b'FSLG'
+VERSION = 1
+HEADER = struct.Struct('<4sI3d')
+RECORD = struct.Struct('<d2d3dI')
+
+Step = namedtuple('Step', ['timestamp', 'mov', 'obs', 'truth'])
+
+
+class LogWriter:
+    '''
+    Append the steps of a run to a log, start: initial pose (x, y, orientation) given to FastSlam.
+    Can be used as a context manager.
+    '''
+    def __init__(self, filename, start):
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, *start))
+        self.file.flush()
+
+    def write(self, mov, obs, truth=None, timestamp=None):
+        '''
+        mov (distance, angle), obs list (distance, angle): inputs of FastSlam.run
+        truth (x, y, orientation): true pose of the robot after the step, if known
+        timestamp: time of the step (s), default: now
+        '''
+        obs = np.asarray(obs, dtype='<f8').reshape(-1, 2)
+        if timestamp is None:
+            timestamp = time.time()
+        if truth is None:
+            truth = (np.nan, np.nan, np.nan)
+        self.file.write(RECORD.pack(timestamp, *mov, *truth, len(obs)))
+        self.file.write(obs.tobytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LogReader:
+    '''
+    Steps of a log, iterate over it to get the Step (timestamp, mov, obs, truth) of each step,
+    truth is None if unknown.
+
+    Attributes:
+        start: initial pose (x, y, orientation)
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            magic, version, *start = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a FastSlam log')
+        if version != VERSION:
+            raise ValueError(f'{filename}: unsupported log version {version}')
+        self.start = tuple(start)
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as file:
+            file.seek(HEADER.size)
+            while True:
+                record = file.read(RECORD.size)
+                if len(record) < RECORD.size:
+                    # end of the log, or a step cut by an interruption
+                    return
+                timestamp, distance, angle, x, y, orien, n_obs = RECORD.unpack(record)
+                data = file.read(16 * n_obs)
+                if len(data) < 16 * n_obs:
+                    return
+                truth = None if np.isnan(x) else (x, y, orien)
+                yield Step(timestamp, (distance, angle), np.frombuffer(data, dtype='<f8').reshape(n_obs, 2), truth)
+
+    def steps(self):
+        '''list of all the steps'''
+        return list(self)
@@ -0,0 +1,93 @@
+'''
+FastSlam run in a background thread, decoupled from the frame loop of the interface.
+
+The steps (mov, obs) are put in a queue and processed in order by the thread.
+After each step, the thread publishes a Snapshot of the posterior in a double buffer:
+it writes the back buffer then swaps the buffers with a single assignment,
+the readers take the front buffer without lock and without waiting for the step in progress.
+The heavy part of the updates runs in the processes of the pool of FastSlam (see ParticlePool).
+'''
+
+import threading, queue
+from collections import namedtuple
+
+# state of fastslam after a step: number of processed steps, mean position (x, y) and orientation,
+# positions of the particles, landmarks dps of each of the landmarks_particles of the service
+Snapshot = namedtuple('Snapshot', ['step', 'pos', 'orien', 'particles', 'landmarks'])
+
+
+class FastSlamService:
+    '''
+    Process the steps of fastslam (FastSlam or an object with the same interface, e.g. MonteCarloLocalization) in a thread.
+    submit() queues a step and returns at once, snapshot() returns the state after the last processed step.
+    landmarks_particles: indexes of the particles whose landmarks are in the snapshots.
+    fastslam must not be used directly while the service runs: wait() for the steps to be processed first.
+    Must be closed with close().
+    '''
+    def __init__(self, fastslam, landmarks_particles=(0,)):
+        self.fastslam = fastslam
+        self.landmarks_particles = landmarks_particles
+        self.queue = queue.Queue()
+        self.error = None
+        self.step = 0
+        self.buffers = [self.take_snapshot(), None]
+        self.front = 0
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def take_snapshot(self):
+        return Snapshot(self.step, tuple(self.fastslam.get_mean_pos()), self.fastslam.get_mean_orien(),
+                        self.fastslam.get_particles_dps(),
+                        [self.fastslam.get_landmarks_dps(index) for index in self.landmarks_particles])
+
+    def publish(self, snapshot):
+        back = 1 - self.front
+        self.buffers[back] = snapshot
+        # the swap is a single assignment: a reader gets either the previous or the new snapshot, never a partial one
+        self.front = back
+
+    def snapshot(self):
+        '''Newest Snapshot, doesn't wait for the step in progress'''
+        return self.buffers[self.front]
+
+    def work(self):
+        while True:
+            step = self.queue.get()
+            try:
+                if step is None:
+                    return
+                if self.error is None:
+                    self.fastslam.run(*step)
+                    self.step += 1
+                    self.publish(self.take_snapshot())
+            except Exception as error:
+                # the next steps are dropped, the error is raised in the main thread by submit/wait
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('the fastslam service stopped') from self.error
+
+    def submit(self, mov, obs):
+        '''Queue a step (see FastSlam.run)'''
+        self.check()
+        self.queue.put((mov, obs))
+
+    def pending(self):
+        '''Number of steps not processed yet'''
+        return self.queue.qsize()
+
+    def wait(self):
+        '''Wait until all the submitted steps are processed'''
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        '''Process the remaining steps, stop the thread and close fastslam'''
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.fastslam.close()
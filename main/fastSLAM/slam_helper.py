@@ -1,17 +1,7 @@
 import numpy as np
 import math
 import random
-from scipy import linalg
-
-from time import time
-
-def timer(func):
-    def inner(*args, **kwargs):
-        start = time()
-        result = func(*args, **kwargs)
-        print('{}: {:.2f}s'.format(func.__name__, time()-start))
-        return result
-    return inner
+from . import small_linalg
 
 #####
 # imported from https://github.com/nwang57/FastSLAM
@@ -27,11 +17,8 @@ def cal_direction(a, b):
     return math.atan2(b[1]-a[1], b[0]-a[0])
 
 def multi_normal(x, mean, cov):
-    """Calculate the density for a multinormal distribution"""
-    den = 2 * math.pi * math.sqrt(linalg.det(cov))
-    num = np.exp(-0.5*np.transpose((x - mean)).dot(linalg.inv(cov)).dot(x - mean))
-    result = num/den
-    return result[0][0]
+    """Calculate the density for a multinormal distribution, x, mean: column vectors"""
+    return small_linalg.multi_normal(x[:,0], mean[:,0], cov)
 
 def sense_direction(robot_pos, landmark, noise):
     """Measures the direction of the landmark with respect to robot. Add noise"""
@@ -49,89 +36,59 @@ def sense_direction(robot_pos, landmark, noise):
 #####
 # imported from https://pythonrobotics.readthedocs.io/en/latest/modules/slam.html
 
-def normalize_weight(particles, particles_size):
-
-    sumw = sum([p.weight for p in particles])
-
-    try:
-        for i in range(particles_size):
-            particles[i].weight /= sumw
-    except ZeroDivisionError:
-        for i in range(particles_size):
-            particles[i].weight = 1.0 / particles_size
-
-        return particles
-
-    return particles
-
-def resampling(particles, particles_size):
+def low_variance_sampling(weights, rng=np.random, size=None):
     """
-    low variance re-sampling
+    low variance re-sampling  
+    weights: (N,) normalized weights  
+    rng: numpy.random.Generator (default: the global numpy random state)  
+    size: number of particles to draw (default: N)  
+    return the (size,) indexes of the drawn particles
     """
-
-    particles = normalize_weight(particles, particles_size)
-
-    pw = []
-    for i in range(particles_size):
-        pw.append(particles[i].weight)
-
-    pw = np.array(pw)
-
-    wcum = np.cumsum(pw)
-    base = np.cumsum(pw * 0.0 + 1 / particles_size) - 1 / particles_size
-    resampleid = base + np.random.rand(base.shape[0]) / particles_size
-
-    inds = []
-    ind = 0
-    for ip in range(particles_size):
-        while ((ind < wcum.shape[0] - 1) and (resampleid[ip] > wcum[ind])):
-            ind += 1
-        inds.append(ind)
-
-    tparticles = particles[:]
-    for i in range(len(inds)):
-        particles[i].pos_x = tparticles[inds[i]].pos_x
-        particles[i].pos_y = tparticles[inds[i]].pos_y
-        particles[i].weight = 1.0 / particles_size
-
-    return particles
+    n = weights.shape[0]
+    if size is None:
+        size = n
+    wcum = np.cumsum(weights)
+    wcum[-1] = 1.0 # guard against rounding errors
+    resampleid = (np.arange(size) + rng.random()) / size
+    return np.minimum(np.searchsorted(wcum, resampleid), n - 1)
 
 def pi_2_pi(angle):
     return (angle + math.pi) % (2 * math.pi) - math.pi
 
 #####
 
-# use to have an idea of functions performance and spot bottleneck
-class Counter:
-    funcs = {'names':[], 'iterations':[],'time':[]}
-    def __call__(self, func):
-        self.funcs['names'].append(func.__name__)
-        self.funcs['iterations'].append(0)
-        self.funcs['time'].append(0)
-        index = len(self.funcs['names'])-1
-        
-        def inner(*args, **kwargs):
-            self.funcs['iterations'][index] += 1
-            st = time()
-            r = func(*args, **kwargs)
-            self.funcs['time'][index] += time() - st
-            return r
-        
-        return inner
-    
-    def result(self):
-        print('Result:')
-        for i in range(len(self.funcs['names'])):
-            name = self.funcs['names'][i]
-            iteration = self.funcs['iterations'][i]
-            time = self.funcs['time'][i]
-            try:
-                performance = time/iteration
-            except:
-                performance = 0
-            
-            print(f'{name}: {iteration} mean: {performance:.4f} total:{time:.3f}')
-    
-    def reset(self):
-        self.funcs['time'] = [0 for _ in self.funcs['names']]
-        self.funcs['iterations'] = [0 for _ in self.funcs['names']]
+def log_sum_exp(log_weights):
+    """log(sum(exp(log_weights))) without overflow/underflow, -inf if all the weights are null"""
+    top = np.max(log_weights)
+    if not np.isfinite(top):
+        return top
+    return top + np.log(np.sum(np.exp(log_weights - top)))
+
+def kld_bound(k, epsilon, z):
+    """
+    Number of particles needed to approximate a distribution over k bins with a KL divergence under epsilon,
+    with probability 1 - delta, z: upper 1 - delta quantile of the standard normal (Fox, KLD-Sampling, 2003)
+    """
+    k = np.maximum(np.asarray(k, dtype=float) - 1, 1e-9)
+    a = 2 / (9 * k)
+    return np.where(k >= 1, k / (2 * epsilon) * (1 - a + np.sqrt(a) * z)**3, 0)
+
+def kld_sampling(weights, poses, rng, min_size, max_size, bin_size, epsilon, z):
+    """
+    KLD-sampling: draw particles until their number reaches the bound of the number of occupied bins  
+    weights: (N,) normalized weights, poses: (N,3)  
+    bin_size (3,): size of the bins in x, y, orientation  
+    return the indexes (n,) of the drawn particles, min_size <= n <= max_size
+    """
+    # the draws of a low variance sampling, in a random order
+    indexes = rng.permutation(low_variance_sampling(weights, rng, max_size))
+    bins = np.floor(poses[indexes] / bin_size).astype(int)
+    _, first = np.unique(bins, axis=0, return_index=True)
+    new_bin = np.zeros(max_size, dtype=bool)
+    new_bin[first] = True
+    # number of occupied bins after each draw
+    n_bins = np.cumsum(new_bin)
+    n_drawn = np.arange(1, max_size + 1)
+    done = np.flatnonzero((n_drawn >= kld_bound(n_bins, epsilon, z)) & (n_drawn >= min_size))
+    size = done[0] + 1 if len(done) != 0 else max_size
+    return indexes[:size]
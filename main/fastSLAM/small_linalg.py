@@ -0,0 +1,188 @@
+'''
+Closed-form linear algebra of the 2x2 and 3x3 matrices of the EKFs.
+
+On matrices that small, the overhead of scipy.linalg/np.linalg calls dominates the computation,
+the functions below use the analytic formulas instead.
+All the functions accept either a single matrix (2,2)/(3,3) or a batch of matrices (...,2,2)/(...,3,3),
+single matrices are computed on python floats as indexing numpy arrays element by element is slow.
+
+Run this file to get a micro-benchmark against scipy.linalg.
+'''
+
+import math
+import numpy as np
+
+
+def det2(a):
+    if a.ndim == 2:
+        (a00, a01), (a10, a11) = a.tolist()
+        return a00 * a11 - a01 * a10
+    return a[...,0,0] * a[...,1,1] - a[...,0,1] * a[...,1,0]
+
+def inv2(a):
+    if a.ndim == 2:
+        (a00, a01), (a10, a11) = a.tolist()
+        det = a00 * a11 - a01 * a10
+        return np.array([[a11 / det, -a01 / det], [-a10 / det, a00 / det]])
+    inv = np.empty(a.shape)
+    det = det2(a)
+    inv[...,0,0] = a[...,1,1] / det
+    inv[...,0,1] = -a[...,0,1] / det
+    inv[...,1,0] = -a[...,1,0] / det
+    inv[...,1,1] = a[...,0,0] / det
+    return inv
+
+def chol2(a):
+    '''Lower triangular Cholesky factor of a symmetric positive definite matrix'''
+    if a.ndim == 2:
+        (a00, a01), (a10, a11) = a.tolist()
+        l00 = math.sqrt(a00)
+        l10 = a10 / l00
+        return np.array([[l00, 0.], [l10, math.sqrt(a11 - l10**2)]])
+    chol = np.zeros(a.shape)
+    chol[...,0,0] = np.sqrt(a[...,0,0])
+    chol[...,1,0] = a[...,1,0] / chol[...,0,0]
+    chol[...,1,1] = np.sqrt(a[...,1,1] - chol[...,1,0]**2)
+    return chol
+
+def det3(a):
+    if a.ndim == 2:
+        (a00, a01, a02), (a10, a11, a12), (a20, a21, a22) = a.tolist()
+        return a00 * (a11 * a22 - a12 * a21) - a01 * (a10 * a22 - a12 * a20) + a02 * (a10 * a21 - a11 * a20)
+    return (a[...,0,0] * (a[...,1,1] * a[...,2,2] - a[...,1,2] * a[...,2,1])
+          - a[...,0,1] * (a[...,1,0] * a[...,2,2] - a[...,1,2] * a[...,2,0])
+          + a[...,0,2] * (a[...,1,0] * a[...,2,1] - a[...,1,1] * a[...,2,0]))
+
+def inv3(a):
+    # adjugate divided by the determinant
+    if a.ndim == 2:
+        (a00, a01, a02), (a10, a11, a12), (a20, a21, a22) = a.tolist()
+        c00 = a11 * a22 - a12 * a21
+        c10 = a12 * a20 - a10 * a22
+        c20 = a10 * a21 - a11 * a20
+        det = a00 * c00 + a01 * c10 + a02 * c20
+        return np.array([[c00, a02 * a21 - a01 * a22, a01 * a12 - a02 * a11],
+                         [c10, a00 * a22 - a02 * a20, a02 * a10 - a00 * a12],
+                         [c20, a01 * a20 - a00 * a21, a00 * a11 - a01 * a10]]) / det
+    inv = np.empty(a.shape)
+    inv[...,0,0] = a[...,1,1] * a[...,2,2] - a[...,1,2] * a[...,2,1]
+    inv[...,0,1] = a[...,0,2] * a[...,2,1] - a[...,0,1] * a[...,2,2]
+    inv[...,0,2] = a[...,0,1] * a[...,1,2] - a[...,0,2] * a[...,1,1]
+    inv[...,1,0] = a[...,1,2] * a[...,2,0] - a[...,1,0] * a[...,2,2]
+    inv[...,1,1] = a[...,0,0] * a[...,2,2] - a[...,0,2] * a[...,2,0]
+    inv[...,1,2] = a[...,0,2] * a[...,1,0] - a[...,0,0] * a[...,1,2]
+    inv[...,2,0] = a[...,1,0] * a[...,2,1] - a[...,1,1] * a[...,2,0]
+    inv[...,2,1] = a[...,0,1] * a[...,2,0] - a[...,0,0] * a[...,2,1]
+    inv[...,2,2] = a[...,0,0] * a[...,1,1] - a[...,0,1] * a[...,1,0]
+    det = a[...,0,0] * inv[...,0,0] + a[...,0,1] * inv[...,1,0] + a[...,0,2] * inv[...,2,0]
+    inv /= np.asarray(det)[...,None,None]
+    return inv
+
+def chol3(a):
+    '''Lower triangular Cholesky factor of a symmetric positive definite matrix'''
+    if a.ndim == 2:
+        (a00, a01, a02), (a10, a11, a12), (a20, a21, a22) = a.tolist()
+        l00 = math.sqrt(a00)
+        l10, l20 = a10 / l00, a20 / l00
+        l11 = math.sqrt(a11 - l10**2)
+        l21 = (a21 - l20 * l10) / l11
+        return np.array([[l00, 0., 0.], [l10, l11, 0.], [l20, l21, math.sqrt(a22 - l20**2 - l21**2)]])
+    chol = np.zeros(a.shape)
+    chol[...,0,0] = np.sqrt(a[...,0,0])
+    chol[...,1,0] = a[...,1,0] / chol[...,0,0]
+    chol[...,2,0] = a[...,2,0] / chol[...,0,0]
+    chol[...,1,1] = np.sqrt(a[...,1,1] - chol[...,1,0]**2)
+    chol[...,2,1] = (a[...,2,1] - chol[...,2,0] * chol[...,1,0]) / chol[...,1,1]
+    chol[...,2,2] = np.sqrt(a[...,2,2] - chol[...,2,0]**2 - chol[...,2,1]**2)
+    return chol
+
+def det(a):
+    return det2(a) if a.shape[-1] == 2 else det3(a)
+
+def inv(a):
+    return inv2(a) if a.shape[-1] == 2 else inv3(a)
+
+def chol(a):
+    return chol2(a) if a.shape[-1] == 2 else chol3(a)
+
+def sample_multi_normal(rng, mean, cov, size=None):
+    '''
+    Draw samples of 2D/3D normal distributions with the numpy.random.Generator rng,
+    each covariance is factored once (Cholesky) for all its samples.
+    mean: (...,k), cov: (...,k,k), size: number of samples of each distribution (None: one)
+    return (...,k) or (size,...,k)
+    '''
+    shape = mean.shape if size is None else (size,) + mean.shape
+    noise = rng.standard_normal(shape)
+    return mean + (chol(cov) @ noise[...,None])[...,0]
+
+def log_multi_normal(x, mean, cov):
+    '''
+    Log density of 2D/3D normal distributions
+    x, mean: (...,k), cov: (...,k,k), return (...)
+    '''
+    k = cov.shape[-1]
+    diff = x - mean
+    if cov.ndim == 2 and np.ndim(diff) == 1:
+        diff = diff.tolist()
+        inv_cov = inv(cov).tolist()
+        mahalanobis = sum(diff[i] * inv_cov[i][j] * diff[j] for i in range(k) for j in range(k))
+        return -0.5 * (mahalanobis + math.log((2 * math.pi)**k * det(cov)))
+    mahalanobis = np.sum((inv(cov) @ diff[...,None])[...,0] * diff, axis=-1)
+    return -0.5 * (mahalanobis + np.log((2 * math.pi)**k * det(cov)))
+
+def multi_normal(x, mean, cov):
+    '''Density of 2D/3D normal distributions, see log_multi_normal'''
+    log_density = log_multi_normal(x, mean, cov)
+    if isinstance(log_density, float):
+        return math.exp(log_density)
+    return np.exp(log_density)
+
+if __name__ == '__main__':
+    from timeit import timeit
+    from scipy import linalg
+
+    def bench(name, func, number):
+        t = timeit(func, number=number) / number
+        print(f'{name}: {t*1e6:.2f}us')
+        return t
+
+    rng = np.random.default_rng(0)
+    a = rng.random((3,3))
+    cov3 = a @ a.T + np.eye(3)
+    cov2 = cov3[:2,:2].copy()
+    x = rng.random(3)
+
+    print('Single matrix:')
+    for name, m in (('2x2', cov2), ('3x3', cov3)):
+        t_ref = bench(f'  scipy inv {name}', lambda: linalg.inv(m), 20000)
+        t_new = bench(f'  small inv {name}', lambda: inv(m), 20000)
+        print(f'  -> x{t_ref/t_new:.1f}')
+        t_ref = bench(f'  scipy det {name}', lambda: linalg.det(m), 20000)
+        t_new = bench(f'  small det {name}', lambda: det(m), 20000)
+        print(f'  -> x{t_ref/t_new:.1f}')
+        t_ref = bench(f'  scipy cholesky {name}', lambda: linalg.cholesky(m, lower=True), 20000)
+        t_new = bench(f'  small cholesky {name}', lambda: chol(m), 20000)
+        print(f'  -> x{t_ref/t_new:.1f}')
+
+    def ref_multi_normal(x, mean, cov):
+        den = math.sqrt((2 * math.pi)**len(x) * linalg.det(cov))
+        return math.exp(-0.5 * (x - mean) @ linalg.inv(cov) @ (x - mean)) / den
+
+    t_ref = bench('  scipy normal density 3D', lambda: ref_multi_normal(x, 0, cov3), 20000)
+    t_new = bench('  small normal density 3D', lambda: multi_normal(x, 0, cov3), 20000)
+    print(f'  -> x{t_ref/t_new:.1f}')
+
+    print('Batch of 1000 matrices:')
+    covs = np.repeat(cov3[None], 1000, axis=0)
+    t_ref = bench('  numpy inv 3x3', lambda: np.linalg.inv(covs), 500)
+    t_new = bench('  small inv 3x3', lambda: inv3(covs), 500)
+    print(f'  -> x{t_ref/t_new:.1f}')
+    t_ref = bench('  numpy cholesky 3x3', lambda: np.linalg.cholesky(covs), 500)
+    t_new = bench('  small cholesky 3x3', lambda: chol3(covs), 500)
+    print(f'  -> x{t_ref/t_new:.1f}')
+
+    assert np.allclose(inv(cov3), linalg.inv(cov3)) and np.allclose(inv(cov2), linalg.inv(cov2))
+    assert np.isclose(det(cov3), linalg.det(cov3)) and np.isclose(det(cov2), linalg.det(cov2))
+    assert np.allclose(chol(cov3), linalg.cholesky(cov3, lower=True))
+    assert np.isclose(multi_normal(x, 0, cov3), ref_multi_normal(x, 0, cov3))
@@ -76,6 +76,33 @@ def segment_intersect(line1, line2) :
    return intersection_pt
 #####
 
+def cast_rays(origin, angles, walls, scope):
+    '''
+    Nearest intersection of each ray with the walls, all the rays and all the walls in one computation:
+    origin + t * scope * direction = start + u * (end - start), hit if 0 <= t, u <= 1  
+    origin (2,), angles (R,) radian, walls (W,2,2) segments, scope: length of the rays  
+    Return the hits (R,2) and their distance to origin (R,), inf if the ray doesn't hit any wall
+    '''
+    walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+    ray_x, ray_y = scope * np.cos(angles), scope * np.sin(angles) # (R,)
+    edge_x, edge_y = walls[:,1,0] - walls[:,0,0], walls[:,1,1] - walls[:,0,1] # (W,)
+    offset_x, offset_y = walls[:,0,0] - origin[0], walls[:,0,1] - origin[1] # (W,)
+
+    denom = ray_x[:,None] * edge_y - ray_y[:,None] * edge_x # (R,W), null if parallel
+    parallel = denom == 0
+    denom[parallel] = 1
+    t = (offset_x * edge_y - offset_y * edge_x) / denom
+    u = (ray_y[:,None] * offset_x - ray_x[:,None] * offset_y) / denom
+    t[parallel | (t < 0) | (t > 1) | (u < 0) | (u > 1)] = np.inf
+
+    # the first wall on the ray occludes the others
+    nearest = t.min(axis=1) if len(walls) else np.full(len(t), np.inf)
+    reached = np.where(nearest <= 1, nearest, 0)
+    hits = np.empty((len(nearest), 2))
+    hits[:,0] = origin[0] + reached * ray_x
+    hits[:,1] = origin[1] + reached * ray_y
+    return hits, nearest * scope
+
 def is_between_lines(line1, line2, dp):
     '''lines: [[x1, y1], [x2, y2]]'''
     intersect_dp = intersect(line1, line2)
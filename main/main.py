@@ -8,7 +8,8 @@ Interface.set_robot(Robot((800,800), 0))
 
 Interface.keep_track_mov(C.YELLOW)
 
-controller = BaseController()
+# fastslam runs in the background, the window stays responsive during the updates
+controller = BaseController(asynchronous=True)
 
 def display_raw_obs(controller, color=C.BORDEAU):
     '''
@@ -29,7 +30,7 @@ def display_fastslam_obs(controller, color=C.BORDEAU):
     '''
     Display the landmarks of one of the particles of fastslam
     '''
-    landmarks = controller.fastslam.get_landmarks_dps()
+    landmarks = controller.get_landmarks_dps()
     Interface.add_dps(landmarks, color, is_permanent=False)
 
 while Interface.running:
@@ -52,12 +53,17 @@ while Interface.running:
 
     #display_fastslam_obs(controller)
 
+    # place the robot at the newest estimation of fastslam
+    controller.update_robot()
+
     # get and display particles
-    particles = controller.fastslam.get_particles_dps()
+    particles = controller.get_particles_dps()
     Interface.add_dps(particles, C.WHITE, is_permanent=False)
 
     pressed = Interface.run()
 
+# finish the steps in progress
+controller.service.wait()
 controller.fastslam.store_landmarks()
 controller.conn.stop()
 
@@ -1,7 +1,8 @@
 import neat
 import numpy as np
-import os, pickle, time
-from simulation import MLSimulation
+import os, pickle, time, copy
+from simulation import MLSimulation, run_batch
+from fastSLAM.batch_slam import BatchFastSlam
 from planGenerator import Generator
 from mlneat.train import Train, Model
 from interface import Interface, Robot, Const, C
@@ -64,7 +65,14 @@ def use_simulation(plan_idx, genome_filename='gen.pickle', frame_time=.5, with_f
 
     simulation.model.store_grid()
 
-def test_simulation(plan_slice, genome_filename, with_fastslam=False):
+def test_simulation(plan_slice, genome_filename, with_fastslam=False, batch_size=None):
+    '''
+    Test the genome on the plans of the slice, return the ratio of success.  
+    With fastslam, each simulation runs its own FastSlam, as the controller.  
+    With a batch_size, the simulations of batch_size plans are run together (see run_batch) and, with fastslam, their filters
+    are the occupancy grid filters of a BatchFastSlam advanced at once: the batching covers the grid variant only,
+    the position isn't estimated by the FastSlam of the controller.
+    '''
     # load plan
     g = Generator(Const['WINDOW'])
     plans = g.load_plans()
@@ -79,21 +87,44 @@ def test_simulation(plan_slice, genome_filename, with_fastslam=False):
     # store number of success
     n_success = 0
 
-    for i, plan in enumerate(plans):
+    if batch_size is None:
+        for i, plan in enumerate(plans):
+
+            print(i)
+
+            genome.fitness = 0
+
+            model = Model(genome)
+
+            simulation = MLSimulation(model, Spec.POS_START, with_fastslam=with_fastslam, plan=plan)
+
+            while simulation.running:
+                simulation.run()
+            
+            if simulation.success:
+                n_success += 1
+
+        return n_success / len(plans) # return ratio of success
+
+    for i in range(0, len(plans), batch_size):
 
         print(i)
 
-        genome.fitness = 0
+        batch = plans[i:i+batch_size]
+        if with_fastslam:
+            fastslam = BatchFastSlam([(*Spec.POS_START, 0)] * len(batch))
 
-        model = Model(genome)
+        simulations = []
+        for k, plan in enumerate(batch):
+            # the fitness decides the success: one genome per simulation
+            ge = copy.deepcopy(genome)
+            ge.fitness = 0
+            model = Model(ge)
+            simulations.append(MLSimulation(model, Spec.POS_START, plan=plan, fastslam=fastslam.filter(k) if with_fastslam else None))
 
-        simulation = MLSimulation(model, Spec.POS_START, with_fastslam=with_fastslam, plan=plan)
+        run_batch(simulations, fastslam if with_fastslam else None)
 
-        while simulation.running:
-            simulation.run()
-        
-        if simulation.success:
-            n_success += 1
+        n_success += sum(simulation.success for simulation in simulations)
     
     return n_success / len(plans) # return ratio of success
 
@@ -1,9 +1,12 @@
 import pygame
-import math, random, pickle, os
+import math, pickle, os
 import numpy as np
-from geometry import segment_intersect
+from geometry import cast_rays
 from fastSLAM.fast_slam import FastSlam
-from fastSLAM.slam_helper import euclidean_distance, sense_direction, timer
+from fastSLAM.batch_slam import batch_inputs
+from fastSLAM.slam_helper import euclidean_distance, sense_direction
+from fastSLAM.run_log import LogWriter
+from fastSLAM.service import FastSlamService
 from interface import Interface, Delayer, C, Robot
 from specifications import Specifications as Spec
 
@@ -15,12 +18,16 @@ class BaseSimulation:
     Arguments: 
         with_robot, with_fastslam: if robot/fastslam is linked to simulation
         plan: if not specified, take Interface's plan
+        start: (x, y, orientation) initial pose of fastslam, if not specified, take Interface.robot's pose
     '''
     sensor_scope = Spec.SENSOR_SCOPE
     noise_scale = Spec.NOISE_POWER
 
     robot = None
-    def __init__(self, with_robot=True, plan=None, with_fastslam=True):
+    def __init__(self, with_robot=True, plan=None, with_fastslam=True, start=None):
+
+        # random stream of the noise of the measures
+        self.rng = np.random.default_rng()
         
         if with_robot:
             self.robot = Interface.robot
@@ -31,16 +38,22 @@ class BaseSimulation:
         else:
             self.plan = Interface.plan
             self.plan_lines = Interface.plan_lines
+        self.walls = np.array(self.plan_lines, dtype=float).reshape(-1, 2, 2)
 
         if with_fastslam:
             # create fastslam object
-            self.fastslam = FastSlam(Interface.robot.x, Interface.robot.y, Interface.robot.orien, particle_size=50)
+            if start is None:
+                start = (Interface.robot.x, Interface.robot.y, Interface.robot.orien)
+            self.fastslam = FastSlam(*start, particle_size=50)
 
         # create 20 angles to simulated the rotating sensor
         self.angles = list(np.linspace(Spec.SENSOR_ANGLES[0], Spec.SENSOR_ANGLES[1], 20))
 
     def collision(self, position=None, orientation=None):
-        '''In the case where the simulation doesn't have robot object, specify orien/pos in arguments'''
+        '''
+        Return the noisy positions of the walls seen by the rays of the sensor, the nearest hit of each ray.  
+        In the case where the simulation doesn't have robot object, specify orien/pos in arguments
+        '''
         
         if position == None:
             pos = self.robot.get_pos()
@@ -52,54 +65,36 @@ class BaseSimulation:
         else:
             orien = orientation
 
-        cols = []
-        for line0 in self.plan_lines:
-            for angle in self.angles:
-                # get the end of the sensor's line
-                x = math.cos(orien + angle) * self.sensor_scope + pos[0]
-                y = math.sin(orien + angle) * self.sensor_scope + pos[1]
-                
-                line1 = [pos, [x,y]]
-                
-                # test for vertical lines
-                try:
-                    intersect = segment_intersect(line0, line1)
-                except:
-                    # if a line is vertical, m of mx + h is inf, it's produce an error in geometry.slope
-                    # so swap the coor to get an horizontal line
-                    inv_line0 = [dp[::-1] for dp in line0]
-                    inv_line1 = [dp[::-1] for dp in line1]
-                    intersect = segment_intersect(inv_line0, inv_line1)
-                    if intersect != None:
-                        intersect = intersect[::-1]
-                
-                if intersect != None:
-                    # add noise to measures
-                    noise = self.get_noise(self.noise_scale, 2)
-                    intersect = [ c + noise[i] for i, c in enumerate(intersect)]
-                    cols.append(intersect)
-
-        return cols
-
-    def get_observations(self, collisions):
-        '''Return the observations in the correct format for fastslam'''
+        # nearest hit of each ray of the sensor
+        hits, ranges = cast_rays(pos, orien + np.array(self.angles), self.walls, self.sensor_scope)
+
+        # add noise to measures
+        hits = hits[np.isfinite(ranges)]
+        cols = hits + self.get_noise(self.noise_scale, hits.shape)
+
+        return cols.tolist()
+
+    def get_observations(self, collisions, position=None):
+        '''Return the observations in the correct format for fastslam, specify pos if the simulation doesn't have robot'''
         
+        if position == None:
+            pos = self.robot.get_pos()
+        else:
+            pos = position
+
         obs = np.zeros((len(collisions), 2))
         for i, col in enumerate(collisions):
             if col:
                 # get obs and movement of the robot
-                dis = euclidean_distance(col, self.robot.get_pos())
-                angle = sense_direction(self.robot.get_pos(), col, 0.0)
+                dis = euclidean_distance(col, pos)
+                angle = sense_direction(pos, col, 0.0)
                 obs[i,:] = dis, angle
 
         return obs
 
-    @staticmethod
-    def get_noise(scale, size):
-        '''create noise of desired size'''
-        random.seed(random.randint(0,100))
-        noise = [ random.randint(0, scale) - scale//2 for i in range(size)]
-        return noise
+    def get_noise(self, scale, size):
+        '''create noise of desired size: integers in [-scale//2, scale - scale//2], drawn from rng'''
+        return self.rng.integers(0, scale, size, endpoint=True) - scale//2
         
 localization_deco = Delayer(15)
 
@@ -107,14 +102,24 @@ class ManualSimulation(BaseSimulation):
     '''
     Simulation where the move of the robot are chosen with keys w,a,s,d.  
     Implements fastslam. Display another robot to show the supposed position of the robot according to fastslam.  
+    log: file where the inputs of fastslam and the true poses are recorded (see fastSLAM.run_log), None: no record  
+    asynchronous: if fastslam runs in a background thread (see FastSlamService), the display shows its newest snapshot
     '''
     # for fastSlam
     mov_state = None # True: moving, False: turning, None: deplacement not started
     move_counter = 0
 
-    def __init__(self):
+    def __init__(self, log=None, asynchronous=False):
         super().__init__()
         self.sample_robot = Robot(Interface.robot.get_pos(), Interface.robot.orien, display_border=False)
+        self.log = None
+        if log:
+            self.log = LogWriter(log, (Interface.robot.x, Interface.robot.y, Interface.robot.orien))
+        self.service = None
+        if asynchronous:
+            # the landmarks of the particles 0 and 1 are displayed
+            self.service = FastSlamService(self.fastslam, landmarks_particles=(0, 1))
+            self.displayed_step = 0
         # store position and angle of before deplacement
         self.history_state = {'pos':self.robot.get_pos(), 'angle':self.robot.orien}
     
@@ -158,9 +163,6 @@ class ManualSimulation(BaseSimulation):
 
     def localization(self):
 
-        # re-place the particles -> remove old ones
-        Interface.reset_dps()
-
         # compute displacement of the robot with the pos_history
         dis = euclidean_distance(self.history_state['pos'], self.robot.get_pos())
         angle = self.robot.orien - self.history_state['angle']
@@ -172,15 +174,22 @@ class ManualSimulation(BaseSimulation):
         obs = self.get_observations(cols)
 
         # execute fastslam
-        self.fastslam.run(mov,obs)
+        if self.service:
+            # displayed once processed, see run()
+            self.service.submit(mov, obs)
+        else:
+            self.fastslam.run(mov,obs)
+            self.display_localization(self.fastslam.get_landmarks_dps(), self.fastslam.get_particles_dps())
+        if self.log:
+            self.log.write(mov, obs, truth=(*self.robot.get_pos(), self.robot.orien))
 
-        # display dps: landmarks and particles
+    def display_localization(self, landmarks, particles):
+        '''Display dps: landmarks and particles'''
 
-        landmarks = self.fastslam.get_landmarks_dps()
+        # re-place the particles -> remove old ones
+        Interface.reset_dps()
 
         Interface.add_dps(landmarks, C.BORDEAU)
-        
-        particles = self.fastslam.get_particles_dps()
 
         Interface.add_dps(particles, C.WHITE)
         
@@ -188,17 +197,27 @@ class ManualSimulation(BaseSimulation):
         
         self.react_events(pressed)
 
+        if self.service:
+            # newest state of fastslam, the step in progress doesn't block the frame
+            snapshot = self.service.snapshot()
+            if snapshot.step != self.displayed_step:
+                self.displayed_step = snapshot.step
+                self.display_localization(snapshot.landmarks[0], snapshot.particles)
+            pos, lm2 = snapshot.pos, snapshot.landmarks[1]
+        else:
+            pos, lm2 = self.fastslam.get_mean_pos(), self.fastslam.get_landmarks_dps(1)
+
         # update sample robot position
-        self.sample_robot.set_pos(self.fastslam.get_mean_pos(), center=True, scale=True)
+        self.sample_robot.set_pos(pos, center=True, scale=True)
 
         self.sample_robot.display()
 
         # add the landmarks of another particles -> give an idea of the dif between the lms
-        lm2 = self.fastslam.get_landmarks_dps(1)
-
         Interface.add_dps(lm2, C.PURPLE)
         
     def store(self):
+        if self.service:
+            self.service.wait()
         self.fastslam.store_landmarks()
 
 
@@ -213,18 +232,24 @@ class MLSimulation(BaseSimulation):
         - plan: if not specified, take the Interface's plan
         - position: if not specified, try to take the robot's position (must have graphics)
         - with_fastlsam: if the position is determined by fastslam
+        - fastslam: filter of a BatchFastSlam shared with other simulations (see BatchFastSlam.filter),
+        the position is determined by it, the batch must be run between sense() and act()
     '''
-    def __init__(self, model, position=None, plan=None, graphics=False, with_fastslam=False):
+    def __init__(self, model, position=None, plan=None, graphics=False, with_fastslam=False, fastslam=None):
 
         # if graphics are enabled, link to Interface.robot to update his position, set fastSLAM
         # if plan is not specified, take Interface's plan
-        super().__init__(with_robot=graphics, plan=plan, with_fastslam=with_fastslam) 
+        # without graphics, fastslam starts at position, with the orientation of the simulation
+        start = None if graphics or position is None else (*position, 0)
+        super().__init__(with_robot=graphics, plan=plan, with_fastslam=with_fastslam and fastslam is None, start=start) 
 
         self.started = False
         self.model = model
 
         # store previous move for fastslam
-        self.with_fastslam = with_fastslam
+        self.with_fastslam = with_fastslam or fastslam is not None
+        if fastslam is not None:
+            self.fastslam = fastslam
         self.previous_distance = 0
         self.dif_angle = 0
 
@@ -268,6 +293,11 @@ class MLSimulation(BaseSimulation):
         return collisions
 
     def run(self):
+        self.sense()
+        self.act()
+
+    def sense(self):
+        '''Get the orders of the model, give the movement and the observations to fastslam'''
         # get sensors detections
         if self.started:
             collisions = self.collision(orientation=self.orien, position=self.pos)
@@ -287,22 +317,25 @@ class MLSimulation(BaseSimulation):
 
             # run fastslam
             mov = [previous_distance, dif_angle]
-            obs = self.get_observations(collisions)
+            obs = self.get_observations(collisions, self.pos)
             self.fastslam.run(mov, obs)
-            
-            # update position and orien
-            self.pos = self.fastslam.get_mean_pos()
-            self.orien = self.fastslam.get_mean_orien()
-
-            # dislay particles
-            particles = self.fastslam.get_particles_dps()
-            Interface.add_dps(particles, C.WHITE, is_permanent=False)
         
         else:
             # execute order
             self.orien = angle
             self.move(distance)
 
+        self.collisions = collisions
+
+    def act(self):
+        '''Update the position with fastslam, update the graphics'''
+        collisions = self.collisions
+
+        if self.with_fastslam:
+            # update position and orien
+            self.pos = self.fastslam.get_mean_pos()
+            self.orien = self.fastslam.get_mean_orien()
+
         if self.as_graphics:
             # update robot object position
             self.robot.set_pos(self.pos, center=True, scale=True)
@@ -315,9 +348,31 @@ class MLSimulation(BaseSimulation):
             Interface.info_board.hist_pos.set_surf(view_pos)
             Interface.info_board.directions.set_surf(view_dir)
 
+            if self.with_fastslam:
+                # dislay particles
+                particles = self.fastslam.get_particles_dps()
+                Interface.add_dps(particles, C.WHITE, is_permanent=False)
+
             # add landmarks/observations
             if self.with_fastslam:
                 Interface.add_dps(self.fastslam.get_landmarks_dps(), C.BORDEAU, is_permanent=False)
             else:
                 Interface.add_dps(collisions, C.BORDEAU)
-    
\ No newline at end of file
+    
+
+
+def run_batch(simulations, fastslam=None):
+    '''
+    Run the MLSimulations together until they all stop, fastslam: BatchFastSlam whose filters are the ones of the simulations
+    (see MLSimulation fastslam argument), the batch is run between the sense() and the act() of the simulations.
+    '''
+    while any(simulation.running for simulation in simulations):
+        active = [simulation.running for simulation in simulations]
+        for simulation, running in zip(simulations, active):
+            if running:
+                simulation.sense()
+        if fastslam is not None:
+            fastslam.run(*batch_inputs([simulation.fastslam for simulation in simulations]), active=active)
+        for simulation, running in zip(simulations, active):
+            if running:
+                simulation.act()
@@ -0,0 +1,6 @@
+'''Run the tests from main/ (python -m pytest tests), the modules are imported as in the scripts of main/'''
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,108 @@
+'''
+NumPy kernel against direct computations, and compiled kernel against the NumPy one
+(skipped when the extension isn't built, see fastSLAM/cython_files/setup.py).
+'''
+
+import numpy as np
+import pytest
+from fastSLAM import kernel
+from fastSLAM.association import compute_jacobians
+from fastSLAM.particle_set import ParticleSet
+
+COMPILED_KERNEL = {name: getattr(kernel, name) for name in kernel.NUMPY_KERNEL}
+requires_compiled = pytest.mark.skipif(not kernel.COMPILED, reason='the compiled kernel is not built')
+
+rng = np.random.default_rng(0)
+POSE = np.array([800., 800., 1.])
+MUS = POSE[:2] + rng.uniform(-400, 400, (40, 2))
+_a = rng.normal(0, 3, (40, 2, 2))
+SIGS = _a @ _a.transpose(0, 2, 1) + np.eye(2)
+OBS_NOISE = np.array([[0.1, 0], [0, (3.0*np.pi/180)**2]])
+CONTROL_NOISE = np.array([[0.2, 0, 0], [0, 0.2, 0], [0, 0, (3.0*np.pi/180)**2]])
+OBS = np.stack((np.hypot(*(MUS[:12] - POSE[:2]).T), np.arctan2(*(MUS[:12] - POSE[:2]).T[::-1])), axis=-1)
+OBS += rng.normal(0, .5, OBS.shape)
+
+
+def motion(functions, rng):
+    poses = np.tile(POSE, (100, 1))
+    functions['forward'](poses, 12.5)
+    functions['turn'](poses, rng.normal(0, .3, 100))
+    return [poses]
+
+def ekf(functions, rng):
+    predicted_obs, feature_jacobian, pose_jacobian, adj_cov = functions['compute_jacobians'](POSE, MUS, SIGS, OBS_NOISE)
+    innovation = OBS[0] - predicted_obs[0]
+    proposal = functions['pose_proposal'](POSE, pose_jacobian[0], adj_cov[0], innovation, np.linalg.inv(CONTROL_NOISE))
+    update = functions['landmark_update'](MUS[0], SIGS[0], feature_jacobian[0], adj_cov[0], innovation)
+    return [predicted_obs, feature_jacobian, pose_jacobian, adj_cov, *proposal, *update]
+
+def association(functions, rng):
+    predicted_obs, feature_jacobian, pose_jacobian, adj_cov = compute_jacobians(POSE, MUS, SIGS, OBS_NOISE)
+    return functions['data_association'](POSE, MUS, OBS, predicted_obs, pose_jacobian, adj_cov, CONTROL_NOISE, rng)
+
+def particles(functions, rng):
+    '''Whole filter on a noisy robot observing the landmarks, with the functions as kernel'''
+    particle_set = ParticleSet(*POSE, 20, seed=0)
+    robot = POSE.copy()
+    for step in range(30):
+        robot[:2] += 10 * np.array([np.cos(robot[2]), np.sin(robot[2])])
+        robot[2] += .05
+        particle_set.forward(10)
+        particle_set.turn_left(.05 * 180 / np.pi)
+        diff = MUS - robot[:2]
+        step_obs = np.stack((np.hypot(diff[:,0], diff[:,1]), np.arctan2(diff[:,1], diff[:,0])), axis=-1)
+        step_obs = step_obs[step_obs[:,0] < 300] + rng.normal(0, .5, (np.sum(step_obs[:,0] < 300), 2))
+        particle_set.update(step_obs)
+        if step % 3 == 2:
+            particle_set.resample()
+    return [particle_set.poses, particle_set.weights, particle_set.landmarks(0).means()]
+
+def run(functions, scenario, monkeypatch):
+    for name, func in functions.items():
+        monkeypatch.setattr(kernel, name, func)
+    return scenario(functions, np.random.default_rng(0))
+
+
+def test_motion():
+    poses = np.tile(POSE, (3, 1))
+    kernel.NUMPY_KERNEL['forward'](poses, 10)
+    assert np.allclose(poses[:,:2], POSE[:2] + 10 * np.array([np.cos(1), np.sin(1)]))
+    kernel.NUMPY_KERNEL['turn'](poses, np.array([0, np.pi, 2 * np.pi]))
+    assert np.allclose(poses[:,2], [1, 1 + np.pi, 1])
+
+def test_ekf():
+    predicted_obs, feature_jacobian, pose_jacobian, adj_cov, pose_mean, pose_cov, mu, sig = ekf(kernel.NUMPY_KERNEL, None)
+    innovation = OBS[0] - predicted_obs[0]
+    # closed forms of the updates
+    H, Q = pose_jacobian[0], adj_cov[0]
+    expected_cov = np.linalg.inv(H.T @ np.linalg.inv(Q) @ H + np.linalg.inv(CONTROL_NOISE))
+    assert np.allclose(pose_cov, expected_cov)
+    assert np.allclose(pose_mean, POSE + expected_cov @ H.T @ np.linalg.inv(Q) @ innovation)
+    K = SIGS[0] @ feature_jacobian[0].T @ np.linalg.inv(Q)
+    assert np.allclose(mu, MUS[0] + K @ innovation)
+    assert np.allclose(sig, (np.eye(2) - K @ feature_jacobian[0]) @ SIGS[0])
+    # the observation of a landmark reduces its uncertainty
+    assert np.trace(sig) < np.trace(SIGS[0])
+
+def test_association():
+    # exact observations of the first landmarks
+    obs = np.stack((np.hypot(*(MUS[:12] - POSE[:2]).T), np.arctan2(*(MUS[:12] - POSE[:2]).T[::-1])), axis=-1)
+    predicted_obs, feature_jacobian, pose_jacobian, adj_cov = compute_jacobians(POSE, MUS, SIGS, OBS_NOISE)
+    assert np.allclose(predicted_obs[:12], obs)
+    probs, idxs = kernel.NUMPY_KERNEL['data_association'](POSE, MUS, obs, predicted_obs, pose_jacobian, adj_cov,
+                                                          CONTROL_NOISE, np.random.default_rng(0))
+    assert idxs.tolist() == list(range(12))
+    assert np.all(probs > 0)
+
+def test_particles(monkeypatch):
+    poses, weights, means = run(kernel.NUMPY_KERNEL, particles, monkeypatch)
+    assert np.all(np.isfinite(poses)) and np.isclose(np.sum(weights), 1)
+    assert len(means) > 0
+
+@requires_compiled
+@pytest.mark.parametrize('scenario', [motion, ekf, association, particles])
+def test_parity(scenario, monkeypatch):
+    reference = run(kernel.NUMPY_KERNEL, scenario, monkeypatch)
+    result = run(COMPILED_KERNEL, scenario, monkeypatch)
+    for a, b in zip(reference, result):
+        assert np.allclose(a, b, rtol=1e-9, atol=1e-12)
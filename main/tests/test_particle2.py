@@ -0,0 +1,28 @@
+import numpy as np
+from fastSLAM.particle2 import Particle2
+
+
+def test_merge_chain():
+    '''Landmarks merged one after the other into the same one: the information of all of them is kept'''
+    particle = Particle2(0, 0, 0, seed=0)
+    for x in (100., 100.5, 101.):
+        particle.landmarks.append(np.array([x, 0.]), np.eye(2))
+
+    particle.maintain_landmarks(merge_threshold=4.0, prune_age=10, max_landmarks=500)
+
+    assert len(particle.landmarks) == 1
+    assert particle.landmarks.hits().tolist() == [3]
+    assert np.allclose(particle.landmarks.covariances()[0], np.eye(2) / 3)
+    assert np.allclose(particle.landmarks.means()[0], [100.5, 0])
+
+
+def test_maintenance():
+    '''The stale landmarks are pruned and the map is capped, keeping the most observed ones'''
+    particle = Particle2(0, 0, 0, seed=0)
+    particle.step = 20
+    for k in range(5):
+        particle.landmarks.append(np.array([100. * k, 0.]), np.eye(2), created=10, hits=1 if k < 2 else k)
+
+    particle.maintain_landmarks(merge_threshold=4.0, prune_age=10, max_landmarks=2)
+
+    assert sorted(particle.landmarks.hits().tolist()) == [3, 4]
@@ -0,0 +1,28 @@
+import numpy as np
+from fastSLAM.preprocessing import ObservationFilter
+
+
+def test_drops():
+    obs_filter = ObservationFilter(voxel_size=0)
+    obs = [(0, 0), (100, .5), (50, 1.), (100, .5), (1e5, 0)]
+    kept = obs_filter(obs)
+    assert kept.tolist() == [[50, 1.], [100, .5]]
+    assert obs_filter.removed == {'out of range': 2, 'duplicated': 1, 'downsampled': 0}
+
+def test_order_without_merge():
+    '''Sorted by distance then angle'''
+    obs = np.array([(300, -1.), (100, 2.), (300, -2.), (200, 0.)])
+    kept = ObservationFilter()(obs)
+    assert kept.tolist() == [[100, 2.], [200, 0.], [300, -2.], [300, -1.]]
+
+def test_order_with_merge():
+    '''One observation per voxel, sorted by voxel: x index then y index of the end point'''
+    voxel_size = 40.
+    points = np.array([(210., 5.), (-90., 50.), (205., 15.), (-90., -50.), (10., 170.)])
+    obs = np.stack((np.hypot(points[:,0], points[:,1]), np.arctan2(points[:,1], points[:,0])), axis=-1)
+    obs_filter = ObservationFilter(voxel_size)
+    kept = obs_filter(obs)
+
+    assert obs_filter.removed['downsampled'] == 1
+    ends = kept[:,0,None] * np.stack((np.cos(kept[:,1]), np.sin(kept[:,1])), axis=-1)
+    assert np.allclose(ends, [(-90., -50.), (-90., 50.), (10., 170.), (207.5, 10.)])
@@ -0,0 +1,57 @@
+'''
+Headless smoke tests of the two ways mlNeatExec.test_simulation runs the MLSimulations:
+one by one with the FastSlam of each simulation, or together with the filters of a BatchFastSlam (see run_batch).
+The NEAT model is replaced by a scripted one.
+'''
+
+import numpy as np
+from simulation import MLSimulation, run_batch
+from fastSLAM.batch_slam import BatchFastSlam
+from planGenerator import Generator
+from specifications import Specifications as Spec
+
+N_ORDERS = 4
+
+
+class ScriptedModel:
+    '''Interface of mlneat.Model used by MLSimulation: go forward while turning, stop after N_ORDERS orders'''
+    def __init__(self):
+        self.running = True
+        self.success = False
+        self.n_orders = 0
+
+    def set_plan(self, plan):
+        self.plan = plan
+
+    def run(self, position, collisions):
+        self.n_orders += 1
+        self.running = self.n_orders < N_ORDERS
+        return .1 * self.n_orders, 20
+
+
+def plans(n):
+    return Generator(Spec.WINDOW).load_plans()[:n]
+
+
+def test_simulation_with_fastslam():
+    '''Headless: the FastSlam of the simulation starts at its position, not at Interface.robot'''
+    simulation = MLSimulation(ScriptedModel(), Spec.POS_START, with_fastslam=True, plan=plans(1)[0])
+    while simulation.running:
+        simulation.run()
+    assert simulation.model.n_orders == N_ORDERS
+    assert np.hypot(*np.subtract(simulation.pos, Spec.POS_START)) < 200
+
+def test_batch():
+    batch = plans(3)
+    fastslam = BatchFastSlam([(*Spec.POS_START, 0)] * len(batch), particle_size=5, seed=0)
+    simulations = [MLSimulation(ScriptedModel(), Spec.POS_START, plan=plan, fastslam=fastslam.filter(k)) for k, plan in enumerate(batch)]
+    # the simulations stop at different steps
+    simulations[0].model.n_orders = 2
+
+    run_batch(simulations, fastslam)
+
+    assert [simulation.model.n_orders for simulation in simulations] == [N_ORDERS] * len(batch)
+    assert np.all(np.isfinite(fastslam.get_mean_pos()))
+    # the positions of the simulations are the ones of their filters
+    for k, simulation in enumerate(simulations):
+        assert np.allclose(simulation.pos, fastslam.get_mean_pos()[k])